@@ -0,0 +1,123 @@
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+from sqlalchemy import and_, delete, insert, literal, or_, select, union_all
+from sqlalchemy.orm import Bundle, Session
+from app import models
+from app.pagination import Page, SortKey, clamp_page_size, paginate
+import os
+import sys
+
+# Purchases and returned borrows older than this are moved to transactions_archive
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "365"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "1000"))
+
+# Columns copied to the archive, in the same order on both tables
+COLUMNS = ("id", "user_id", "book_id", "transaction_type", "amount", "due_date", "return_date", "is_returned", "created_at")
+
+
+def archivable(cutoff: datetime):
+    """
+    Transactions that are finished (purchases and returned borrows) and older than cutoff.
+    """
+    Transaction = models.Transaction
+    return and_(
+        Transaction.created_at < cutoff,
+        or_(Transaction.transaction_type == "buy", Transaction.is_returned == True),
+    )
+
+
+def archive_batch(db: Session, cutoff: datetime, batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """
+    Move up to batch_size archivable transactions, oldest first.
+    Runs in the caller's DB transaction; returns the number moved.
+    """
+    Transaction = models.Transaction
+    ids = [row.id for row in db.query(Transaction.id).filter(archivable(cutoff)).order_by(Transaction.id).limit(batch_size)]
+    if not ids:
+        return 0
+    source = select(*[getattr(Transaction, name) for name in COLUMNS], literal(datetime.now(timezone.utc)).label("archived_at")).where(Transaction.id.in_(ids))
+    db.execute(insert(models.TransactionArchive).from_select([*COLUMNS, "archived_at"], source))
+    db.execute(delete(Transaction).where(Transaction.id.in_(ids)).execution_options(synchronize_session=False))
+    return len(ids)
+
+
+def archive(db: Session, older_than_days: Optional[int] = None, batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """
+    Move every archivable transaction, committing after each batch so locks
+    stay short. Returns the number moved.
+    """
+    days = ARCHIVE_AFTER_DAYS if older_than_days is None else older_than_days
+    cutoff = datetime.now(timezone.utc) - timedelta(days=days)
+    moved = 0
+    while True:
+        count = archive_batch(db, cutoff, batch_size)
+        db.commit()
+        moved += count
+        if count < batch_size:
+            return moved
+
+
+# --- Member history across both tables ---
+
+def _entries(table, user_id: int, finished_only: bool):
+    """
+    One member's rows of transactions or transactions_archive, with the book title.
+    """
+    query = select(
+        *[getattr(table, name) for name in COLUMNS], models.Book.title.label("book_title")
+    ).join(models.Book, models.Book.id == table.book_id).where(table.user_id == user_id)
+    if finished_only:
+        query = query.where(or_(table.transaction_type == "buy", table.is_returned == True))
+    return query
+
+
+def history_page(
+    db: Session,
+    user_id: int,
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+    limit: Optional[int] = None,
+    include_open: bool = False,
+) -> Page:
+    """
+    One keyset page (newest first) of a member's history from both the live and
+    archived transactions. Open borrows are left out unless include_open is set.
+    Items have the Transaction columns plus book_title.
+    """
+    history = union_all(
+        _entries(models.Transaction, user_id, finished_only=not include_open),
+        _entries(models.TransactionArchive, user_id, finished_only=False),
+    ).subquery("history")
+    entry = Bundle("entry", *[history.c[name] for name in (*COLUMNS, "book_title")])
+    keys = [SortKey(history.c.created_at, descending=True), SortKey(history.c.id, descending=True)]
+    return paginate(db.query(entry), keys, after=after, before=before, page_size=clamp_page_size(limit))
+
+
+def open_borrows(db: Session, user_id: int) -> List:
+    """
+    A member's borrows that have not been returned yet, soonest due first.
+    """
+    return db.execute(
+        _entries(models.Transaction, user_id, finished_only=False)
+        .where(models.Transaction.transaction_type == "borrow", models.Transaction.is_returned == False)
+        .order_by(models.Transaction.due_date)
+    ).all()
+
+
+def entry(db: Session, user_id: int, transaction_id: int):
+    """
+    One of a member's live transactions with its book title, like the items of
+    open_borrows(); None if it is not theirs.
+    """
+    return db.execute(_entries(models.Transaction, user_id, finished_only=False).where(models.Transaction.id == transaction_id)).first()
+
+
+if __name__ == "__main__":
+    # Usage: python -m app.archive [days]
+    from app.database import SessionLocal
+    session = SessionLocal()
+    try:
+        days = int(sys.argv[1]) if len(sys.argv) > 1 else None
+        print(f"Archived {archive(session, older_than_days=days)} transactions")
+    finally:
+        session.close()
@@ -0,0 +1,177 @@
+from typing import Optional
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse
+from starlette.types import Scope
+import anyio
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import stat
+import sys
+import threading
+
+try:
+    import brotli
+except ImportError:  # optional: without it only gzip variants are built
+    brotli = None
+
+STATIC_DIR = "static"
+STATIC_URL = "/static"
+
+# style.css is linked as style.<first 12 hex digits of its sha256>.css
+FINGERPRINT = re.compile(r"^(?P<stem>.+)\.(?P<hash>[0-9a-f]{12})(?P<ext>\.[A-Za-z0-9]+)$")
+FINGERPRINT_LENGTH = 12
+# Cover uploads are already named after their content hash
+CONTENT_ADDRESSED_DIRS = ("images/covers/",)
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+# Pre-built variants, in order of preference
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+COMPRESSIBLE = (".css", ".js", ".svg", ".json", ".txt", ".html")
+
+_digests = {}
+_digests_lock = threading.Lock()
+
+
+def file_digest(path: str, stat_result: Optional[os.stat_result] = None) -> str:
+    """
+    sha256 of a file, cached until its size or modification time changes.
+    """
+    stat_result = stat_result or os.stat(path)
+    key = (stat_result.st_mtime_ns, stat_result.st_size)
+    with _digests_lock:
+        cached = _digests.get(path)
+    if cached and cached[0] == key:
+        return cached[1]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b""):
+            digest.update(chunk)
+    with _digests_lock:
+        _digests[path] = (key, digest.hexdigest())
+    return digest.hexdigest()
+
+
+def static_url(path: str) -> str:
+    """
+    Fingerprinted URL for a file in static/, given as "style.css" or "/static/style.css".
+    Other URLs are returned unchanged.
+    """
+    if path.startswith(STATIC_URL + "/"):
+        relative = path[len(STATIC_URL) + 1:]
+    elif "://" in path or path.startswith("/"):
+        return path
+    else:
+        relative = path
+
+    if relative.startswith(CONTENT_ADDRESSED_DIRS):
+        return f"{STATIC_URL}/{relative}"
+    try:
+        digest = file_digest(os.path.join(STATIC_DIR, relative))
+    except OSError:
+        return f"{STATIC_URL}/{relative}"
+    stem, ext = os.path.splitext(relative)
+    return f"{STATIC_URL}/{stem}.{digest[:FINGERPRINT_LENGTH]}{ext}"
+
+
+def accepts_encoding(accept_encoding: str, encoding: str) -> bool:
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        if name.strip().lower() in (encoding, "*"):
+            return params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000")
+    return False
+
+
+class CachedStaticFiles(StaticFiles):
+    """
+    StaticFiles that resolves fingerprinted names, sends long-lived cache headers
+    and strong content-hash ETags, and serves pre-built .br/.gz variants.
+    """
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        fingerprint = None
+        match = FINGERPRINT.match(path)
+        if match:
+            fingerprint = match["hash"]
+            path = match["stem"] + match["ext"]
+
+        if scope["method"] in ("GET", "HEAD"):
+            try:
+                full_path, stat_result = await anyio.to_thread.run_sync(self.lookup_path, path)
+            except OSError:
+                full_path, stat_result = None, None
+            if stat_result and stat.S_ISREG(stat_result.st_mode):
+                digest = await anyio.to_thread.run_sync(file_digest, full_path, stat_result)
+                # A stale fingerprint still gets the current file, just not cached for good
+                immutable = digest[:FINGERPRINT_LENGTH] == fingerprint or path.replace(os.sep, "/").startswith(CONTENT_ADDRESSED_DIRS)
+                return await anyio.to_thread.run_sync(self.asset_response, full_path, stat_result, digest, immutable, scope)
+
+        return await super().get_response(path, scope)
+
+    def asset_response(self, full_path: str, stat_result: os.stat_result, digest: str, immutable: bool, scope: Scope) -> Response:
+        request_headers = Headers(scope=scope)
+        media_type = mimetypes.guess_type(full_path)[0] or "text/plain"
+        etag = digest[:32]
+        headers = {"cache-control": IMMUTABLE if immutable else REVALIDATE}
+
+        if full_path.endswith(COMPRESSIBLE):
+            headers["vary"] = "Accept-Encoding"
+            accept_encoding = request_headers.get("accept-encoding", "")
+            for encoding, suffix in ENCODINGS:
+                if not accepts_encoding(accept_encoding, encoding):
+                    continue
+                try:
+                    variant_stat = os.stat(full_path + suffix)
+                except OSError:
+                    continue
+                # Ignore variants older than the file they were built from
+                if variant_stat.st_mtime >= stat_result.st_mtime:
+                    full_path, stat_result = full_path + suffix, variant_stat
+                    headers["content-encoding"] = encoding
+                    etag = f"{etag}-{encoding}"
+                    break
+
+        headers["etag"] = f'"{etag}"'
+        response = FileResponse(full_path, stat_result=stat_result, media_type=media_type, headers=headers)
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+def build(directory: str = STATIC_DIR) -> int:
+    """
+    Write .gz (and, with brotli installed, .br) variants next to every compressible
+    static file. Returns the number of variants written.
+    """
+    written = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if not name.endswith(COMPRESSIBLE):
+                continue
+            path = os.path.join(root, name)
+            with open(path, "rb") as f:
+                data = f.read()
+            variants = {".gz": gzip.compress(data, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                variants[".br"] = brotli.compress(data, quality=11)
+            for suffix, compressed in variants.items():
+                if len(compressed) >= len(data):
+                    continue
+                with open(path + suffix, "wb") as f:
+                    f.write(compressed)
+                written += 1
+    return written
+
+
+if __name__ == "__main__":
+    # Usage: python -m app.assets build
+    if sys.argv[1:] != ["build"]:
+        sys.exit("usage: python -m app.assets build")
+    print(f"Wrote {build()} compressed variants")
@@ -0,0 +1,226 @@
+from dataclasses import asdict, dataclass, field
+from datetime import date, datetime
+from typing import IO, Iterable, Iterator, List, Optional, Tuple
+from pydantic import ValidationError
+from sqlalchemy import insert, select, tuple_, update
+from sqlalchemy.orm import Session
+from app import models, schemas, catalog
+import csv
+import io
+import orjson
+import sys
+
+# Rows upserted per statement/commit, and rows fetched per round trip when exporting
+IMPORT_BATCH_SIZE = 1000
+EXPORT_BATCH_SIZE = 1000
+# Only the first errors are kept in the report; error_count has the total
+MAX_REPORTED_ERRORS = 100
+
+FORMATS = ("csv", "jsonl")
+MEDIA_TYPES = {"csv": "text/csv", "jsonl": "application/x-ndjson"}
+
+BOOK_FIELDS = ("title", "author", "description", "price", "quantity", "image_url")
+# Values of the optional columns for new books; existing books keep theirs
+INSERT_DEFAULTS = {
+    name: info.default for name, info in schemas.BookCreate.model_fields.items() if not info.is_required()
+}
+EXPORTS = {
+    "books": [
+        models.Book.id, models.Book.title, models.Book.author, models.Book.description, models.Book.price,
+        models.Book.quantity, models.Book.image_url, models.Book.created_at, models.Book.updated_at,
+    ],
+    "transactions": [
+        models.Transaction.id, models.Transaction.user_id, models.Transaction.book_id, models.Transaction.transaction_type,
+        models.Transaction.amount, models.Transaction.due_date, models.Transaction.return_date,
+        models.Transaction.is_returned, models.Transaction.created_at,
+    ],
+    "transactions_archive": [
+        models.TransactionArchive.id, models.TransactionArchive.user_id, models.TransactionArchive.book_id,
+        models.TransactionArchive.transaction_type, models.TransactionArchive.amount, models.TransactionArchive.due_date,
+        models.TransactionArchive.return_date, models.TransactionArchive.is_returned, models.TransactionArchive.created_at,
+        models.TransactionArchive.archived_at,
+    ],
+}
+
+
+@dataclass
+class ImportReport:
+    """
+    Outcome of a catalog import. errors holds {"line": n, "error": message} entries.
+    """
+    inserted: int = 0
+    updated: int = 0
+    error_count: int = 0
+    errors: List[dict] = field(default_factory=list)
+
+    def add_error(self, line: int, message: str) -> None:
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line, "error": message})
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+def detect_format(filename: Optional[str], default: str = "csv") -> str:
+    if filename and filename.lower().endswith((".jsonl", ".ndjson")):
+        return "jsonl"
+    if filename and filename.lower().endswith(".csv"):
+        return "csv"
+    return default
+
+
+def read_rows(stream: IO[str], fmt: str) -> Iterator[Tuple[int, object]]:
+    """
+    Yield (line number, raw row) from a CSV (with a header) or JSONL text stream.
+    Lines that cannot be parsed are yielded as ValueError instances.
+    """
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for row in reader:
+            # Empty CSV cells mean "not set"
+            yield reader.line_num, {key: (value if value != "" else None) for key, value in row.items() if key}
+        return
+
+    for line_number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield line_number, orjson.loads(line)
+        except orjson.JSONDecodeError as exc:
+            yield line_number, ValueError(f"invalid JSON: {exc}")
+
+
+def validate_row(raw) -> dict:
+    """
+    Check one imported row against BookCreate and return the values of the
+    columns it sets (missing or empty ones are left out). Raises ValueError
+    with a readable message.
+    """
+    if isinstance(raw, Exception):
+        raise raw
+    if not isinstance(raw, dict):
+        raise ValueError("expected an object")
+    try:
+        book = schemas.BookCreate.model_validate({key: raw.get(key) for key in BOOK_FIELDS if raw.get(key) is not None})
+    except ValidationError as exc:
+        raise ValueError("; ".join(f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in exc.errors()))
+    values = book.model_dump(exclude_unset=True)
+    values["title"], values["author"] = values["title"].strip(), values["author"].strip()
+    if not values["title"] or not values["author"]:
+        raise ValueError("title and author must not be empty")
+    if values["quantity"] < 0 or values["price"] < 0:
+        raise ValueError("price and quantity must not be negative")
+    return values
+
+
+def upsert_books(db: Session, batch: dict) -> Tuple[int, int]:
+    """
+    Insert or update a batch of {(title, author): values} with one bulk statement
+    each. Updates only write the columns present in values. Returns (inserted, updated).
+    """
+    existing = dict(
+        ((row.title, row.author), row.id)
+        for row in db.query(models.Book.id, models.Book.title, models.Book.author)
+        .filter(tuple_(models.Book.title, models.Book.author).in_(list(batch)))
+    )
+    now = models.utcnow()
+    updates = [{"id": existing[key], "updated_at": now, **values} for key, values in batch.items() if key in existing]
+    inserts = [{**INSERT_DEFAULTS, **values} for key, values in batch.items() if key not in existing]
+    if updates:
+        db.execute(update(models.Book), updates)
+    if inserts:
+        db.execute(insert(models.Book), inserts)
+    return len(inserts), len(updates)
+
+
+def import_books(db: Session, rows: Iterable[Tuple[int, object]], batch_size: int = IMPORT_BATCH_SIZE) -> ImportReport:
+    """
+    Upsert books keyed on title + author, committing every batch_size rows.
+    Invalid rows are skipped and reported; a later row for the same book
+    overrides the columns it sets.
+    books has no unique (title, author) constraint, so each batch bumps the
+    catalog version before looking its books up: the lock on that row (the
+    write lock on SQLite) is held until the batch commits, which serialises
+    concurrent imports and /books/add, and no two of them insert the same book.
+    """
+    report = ImportReport()
+    batch = {}
+
+    def flush():
+        # Every batch inserts or updates its books, so the version always moves
+        catalog.bump_version(db)
+        inserted, updated = upsert_books(db, batch)
+        db.commit()
+        report.inserted += inserted
+        report.updated += updated
+        batch.clear()
+
+    for line, raw in rows:
+        try:
+            values = validate_row(raw)
+        except ValueError as exc:
+            report.add_error(line, str(exc))
+            continue
+        key = (values["title"], values["author"])
+        batch[key] = {**batch[key], **values} if key in batch else values
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    return report
+
+
+def _plain(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def export_rows(bind, kind: str, fmt: str) -> Iterator[bytes]:
+    """
+    Stream a table as CSV or JSONL chunks. Uses its own session on bind and a
+    server-side cursor (yield_per), so memory use does not grow with the table.
+    """
+    columns = EXPORTS[kind]
+    names = [column.key for column in columns]
+    with Session(bind=bind) as session:
+        result = session.execute(
+            select(*columns).order_by(columns[0]).execution_options(yield_per=EXPORT_BATCH_SIZE)
+        )
+        if fmt == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(names)
+            for rows in result.partitions():
+                writer.writerows([_plain(value) for value in row] for row in rows)
+                yield buffer.getvalue().encode()
+                buffer.seek(0)
+                buffer.truncate()
+            if buffer.tell():
+                yield buffer.getvalue().encode()
+        else:
+            for rows in result.partitions():
+                yield b"".join(orjson.dumps(dict(zip(names, row))) + b"\n" for row in rows)
+
+
+if __name__ == "__main__":
+    # Usage: python -m app.bulk import <file.csv|file.jsonl>
+    #        python -m app.bulk export <books|transactions|transactions_archive> [csv|jsonl] > out
+    from app.database import SessionLocal, engine
+    args = sys.argv[1:]
+    if len(args) == 2 and args[0] == "import":
+        session = SessionLocal()
+        try:
+            with open(args[1], newline="", encoding="utf-8") as f:
+                report = import_books(session, read_rows(f, detect_format(args[1])))
+        finally:
+            session.close()
+        print(f"Inserted {report.inserted}, updated {report.updated}, {report.error_count} invalid rows")
+        for error in report.errors:
+            print(f"  line {error['line']}: {error['error']}", file=sys.stderr)
+    elif len(args) in (2, 3) and args[0] == "export" and args[1] in EXPORTS and (args[2:] or ["csv"])[0] in FORMATS:
+        for chunk in export_rows(engine, args[1], (args[2:] or ["csv"])[0]):
+            sys.stdout.buffer.write(chunk)
+    else:
+        sys.exit("usage: python -m app.bulk import <file> | export <books|transactions|transactions_archive> [csv|jsonl]")
@@ -0,0 +1,140 @@
+from datetime import datetime, timezone
+from typing import List, Optional, Sequence, Tuple
+from fastapi import Request
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.orm import Session
+from app import models, search
+from app.pagination import Page, SortKey, clamp_page_size, paginate
+
+# Stable orderings offered by the catalog; the trailing id makes every ordering total
+CATALOG_SORTS = {
+    "title": [SortKey(models.Book.title), SortKey(models.Book.id)],
+    "newest": [SortKey(models.Book.created_at, descending=True), SortKey(models.Book.id, descending=True)],
+}
+DEFAULT_SORT = "title"
+# Search results are ordered by relevance unless another sort is asked for
+RELEVANCE_SORT = "relevance"
+# Primary key of the single catalog_version row
+CATALOG_VERSION_ID = 1
+
+
+def get_catalog_page(
+    db: Session,
+    q: Optional[str] = None,
+    sort: Optional[str] = None,
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+    limit: Optional[int] = None,
+) -> Page:
+    """
+    Return one keyset page of the catalog, optionally filtered by a search term.
+    """
+    if q:
+        return search.search_books(db, q, keys=CATALOG_SORTS.get(sort), after=after or None, before=before or None, limit=limit)
+
+    keys = CATALOG_SORTS.get(sort or DEFAULT_SORT, CATALOG_SORTS[DEFAULT_SORT])
+    query = db.query(models.Book)
+    return paginate(query, keys, after=after or None, before=before or None, page_size=clamp_page_size(limit))
+
+
+def bump_version(db: Session, deleted: bool = False) -> None:
+    """
+    Mark the catalog as changed. Runs in the caller's DB transaction, so the new
+    version becomes visible in the same commit as the change itself.
+    Pass deleted=True when books were deleted: deletes leave no updated_at
+    behind, so the deletions counter is what tells other workers about them.
+    """
+    CatalogVersion = models.CatalogVersion
+    now = datetime.now(timezone.utc)
+    values = {"version": CatalogVersion.version + 1, "changed_at": now}
+    if deleted:
+        values["deletions"] = CatalogVersion.deletions + 1
+    bumped = db.execute(
+        update(CatalogVersion)
+        .where(CatalogVersion.id == CATALOG_VERSION_ID)
+        .values(values)
+        .execution_options(synchronize_session=False)
+    )
+    if not bumped.rowcount:
+        # The row is normally seeded by migration 3
+        db.execute(insert(CatalogVersion).values(id=CATALOG_VERSION_ID, version=1, deletions=int(deleted), changed_at=now))
+
+
+def current_version(db: Session) -> Tuple[int, Optional[datetime]]:
+    """
+    The catalog version and when it last changed: one primary key lookup.
+    """
+    row = db.query(models.CatalogVersion.version, models.CatalogVersion.changed_at).filter(
+        models.CatalogVersion.id == CATALOG_VERSION_ID
+    ).first()
+    if row is None:
+        return 0, None
+    return row.version, as_utc(row.changed_at)
+
+
+def version_state(db: Session) -> Tuple[int, int, Optional[datetime]]:
+    """
+    The catalog version, its deletions counter and when it last changed.
+    """
+    row = db.query(models.CatalogVersion.version, models.CatalogVersion.deletions, models.CatalogVersion.changed_at).filter(
+        models.CatalogVersion.id == CATALOG_VERSION_ID
+    ).first()
+    if row is None:
+        return 0, 0, None
+    return row.version, row.deletions, as_utc(row.changed_at)
+
+
+def stock_version(db: Session) -> Tuple[int, Optional[datetime]]:
+    """
+    The catalog version and the newest books.updated_at, in one statement.
+    Unlike the version alone it also moves with every stock change.
+    """
+    newest = select(func.max(models.Book.updated_at)).scalar_subquery()
+    version = select(models.CatalogVersion.version).where(models.CatalogVersion.id == CATALOG_VERSION_ID).scalar_subquery()
+    row = db.query(version, newest).one()
+    return row[0] or 0, as_utc(row[1])
+
+
+def books_by_id(db: Session, book_ids: Sequence[int]) -> List[models.Book]:
+    """
+    The books with these ids, in that order; deleted ones are left out.
+    """
+    books = {book.id: book for book in db.query(models.Book).filter(models.Book.id.in_(book_ids))} if book_ids else {}
+    return [books[book_id] for book_id in book_ids if book_id in books]
+
+
+def as_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """
+    A timestamp read back from the database as an aware UTC datetime.
+    """
+    if value is not None and value.tzinfo is None:
+        # SQLite hands back naive datetimes; they are stored in UTC
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def current_sort(q: Optional[str], sort: Optional[str]) -> str:
+    """
+    Name of the ordering actually used for a catalog request.
+    """
+    if sort in CATALOG_SORTS:
+        return sort
+    return RELEVANCE_SORT if q else DEFAULT_SORT
+
+
+def page_links(request: Request, page: Page) -> dict:
+    """
+    Build the previous/next links for a catalog page, keeping the other query parameters.
+    The links are relative (path and query only): they end up in the page cache,
+    so they must not carry the Host header of whichever request filled it.
+    """
+    base = request.url.remove_query_params(["after", "before"])
+
+    def link(**cursor) -> str:
+        url = base.include_query_params(**cursor)
+        return f"{url.path}?{url.query}"
+
+    return {
+        "next_url": link(after=page.next_cursor) if page.next_cursor else None,
+        "prev_url": link(before=page.prev_cursor) if page.prev_cursor else None,
+    }
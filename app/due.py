@@ -0,0 +1,101 @@
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import delete, insert, select
+from sqlalchemy.orm import Session, joinedload
+from app import models
+
+# Borrows due within this many days are flagged as due soon
+DUE_SOON_DAYS = 2
+
+OVERDUE = "overdue"
+DUE_SOON = "due_soon"
+OK = "ok"
+
+
+def _utc(value: datetime) -> datetime:
+    # Due dates are written in UTC; SQLite hands them back naive
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def classify(due_date: datetime, now: Optional[datetime] = None) -> Tuple[str, int]:
+    """
+    Return (state, days late) for a borrow due at due_date.
+    """
+    now = now or datetime.now(timezone.utc)
+    due_date = _utc(due_date)
+    if due_date < now:
+        return OVERDUE, (now - due_date).days
+    if due_date <= now + timedelta(days=DUE_SOON_DAYS):
+        return DUE_SOON, 0
+    return OK, 0
+
+
+def scan(db: Session, now: Optional[datetime] = None) -> Dict[str, int]:
+    """
+    Reclassify every open borrow and rewrite their due states.
+    Runs in the caller's DB transaction; returns the number of borrows per state.
+    """
+    now = now or datetime.now(timezone.utc)
+    Transaction = models.Transaction
+    open_ids = select(Transaction.id).where(
+        Transaction.transaction_type == "borrow",
+        Transaction.is_returned == False,
+        Transaction.due_date.isnot(None)
+    )
+    open_borrows = db.query(Transaction.id, Transaction.user_id, Transaction.book_id, Transaction.due_date).filter(
+        Transaction.id.in_(open_ids)
+    ).all()
+
+    counts = dict.fromkeys((OVERDUE, DUE_SOON, OK), 0)
+    rows = []
+    for row in open_borrows:
+        state, days_late = classify(row.due_date, now)
+        counts[state] += 1
+        rows.append({
+            "transaction_id": row.id, "user_id": row.user_id, "book_id": row.book_id,
+            "due_date": row.due_date, "state": state, "days_late": days_late, "checked_at": now,
+        })
+
+    DueState = models.BorrowDueState
+    # Replace the states of the borrows just classified, not the whole table
+    ids = [row["transaction_id"] for row in rows]
+    for start in range(0, len(ids), 500):
+        db.execute(delete(DueState).where(DueState.transaction_id.in_(ids[start:start + 500])))
+    if rows:
+        db.execute(insert(DueState), rows)
+    # Borrows returned since the snapshot above: their forget() found no row
+    # to delete, so drop the ones just written back (and any other leftovers)
+    db.execute(delete(DueState).where(DueState.transaction_id.not_in(open_ids)))
+    return counts
+
+
+def forget(db: Session, transaction_id: int) -> None:
+    """
+    Drop the due state of a borrow that has just been returned.
+    """
+    db.execute(delete(models.BorrowDueState).where(models.BorrowDueState.transaction_id == transaction_id))
+
+
+def borrows_in_state(db: Session, state: str) -> List[models.Transaction]:
+    """
+    Open borrows in one state, oldest due date first, with their user and book loaded.
+    Borrows returned since the last scan are left out.
+    """
+    return db.query(models.Transaction).join(
+        models.BorrowDueState, models.BorrowDueState.transaction_id == models.Transaction.id
+    ).options(joinedload(models.Transaction.user), joinedload(models.Transaction.book)).filter(
+        models.BorrowDueState.state == state,
+        models.Transaction.is_returned == False
+    ).order_by(models.BorrowDueState.due_date).all()
+
+
+def states_for_user(db: Session, user_id: int) -> Dict[int, models.BorrowDueState]:
+    """
+    Due states of a member's open borrows, keyed by transaction id.
+    """
+    return {
+        row.transaction_id: row
+        for row in db.query(models.BorrowDueState).join(
+            models.Transaction, models.Transaction.id == models.BorrowDueState.transaction_id
+        ).filter(models.BorrowDueState.user_id == user_id, models.Transaction.is_returned == False)
+    }
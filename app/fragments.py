@@ -0,0 +1,59 @@
+from typing import Optional
+from fastapi import Request, status
+from fastapi.responses import HTMLResponse, Response
+from sqlalchemy.orm import Session
+from app import models, archive, recommendations
+from app.templating import env, book_card
+
+# Partial-page responses. static/script.js submits the buy, borrow and return
+# forms with fetch() and an "HX-Request: true" header (the HTMX convention);
+# those requests get back only the HTML that changed, which the script swaps
+# into the page, instead of a redirect to a fully re-rendered catalog, My
+# Books or dashboard page. Without the header the handlers redirect as before.
+
+FRAGMENT_HEADER = "HX-Request"
+# Text the script shows to the user, e.g. why a buy failed
+MESSAGE_HEADER = "X-Message"
+
+
+def wants_fragment(request: Request) -> bool:
+    return request.headers.get(FRAGMENT_HEADER) == "true"
+
+
+def login_redirect() -> Response:
+    """
+    Tell the script to load the login page; a plain redirect would be followed by fetch().
+    """
+    return Response(status_code=status.HTTP_401_UNAUTHORIZED, headers={"HX-Redirect": "/auth/login"})
+
+
+def card_response(db: Session, book_id: int, message: Optional[str] = None, status_code: int = status.HTTP_200_OK) -> Response:
+    """
+    The member catalog card of a book, with its current stock.
+    """
+    book = db.get(models.Book, book_id)
+    if book is None:
+        return Response(status_code=status.HTTP_404_NOT_FOUND, headers={MESSAGE_HEADER: "Book not found"})
+    headers = {MESSAGE_HEADER: message} if message else None
+    also = recommendations.for_books(db, [book_id])[book_id]
+    return HTMLResponse(book_card(book, staff=False, also=also), status_code=status_code, headers=headers)
+
+
+def returned_row_response(db: Session, user_id: int, transaction_id: int, message: Optional[str] = None, status_code: int = status.HTTP_200_OK) -> Response:
+    """
+    The My Books row of a borrow that was just (or had already been) returned.
+    """
+    entry = archive.entry(db, user_id, transaction_id)
+    if entry is None:
+        return Response(status_code=status.HTTP_404_NOT_FOUND, headers={MESSAGE_HEADER: "Transaction not found"})
+    headers = {MESSAGE_HEADER: message} if message else None
+    html = env.get_template("partials/transaction_row.html").render(t=entry, is_open=False, due_states={})
+    return HTMLResponse(html, status_code=status_code, headers=headers)
+
+
+def removed_row_response(message: Optional[str] = None, status_code: int = status.HTTP_200_OK) -> Response:
+    """
+    Empty body: the script removes the row (a dashboard borrow that is no longer due).
+    """
+    headers = {MESSAGE_HEADER: message} if message else None
+    return HTMLResponse("", status_code=status_code, headers=headers)
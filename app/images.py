@@ -0,0 +1,157 @@
+from typing import Optional
+from fastapi import HTTPException, UploadFile
+from starlette.concurrency import run_in_threadpool
+import hashlib
+import os
+import sys
+import tempfile
+
+# Covers are stored under their content hash, so identical uploads are stored
+# once, names never collide and the files can be cached forever.
+COVER_DIR = "static/images/covers"
+COVER_URL = "/static/images/covers"
+MAX_IMAGE_BYTES = int(os.getenv("MAX_IMAGE_BYTES", str(5 * 1024 * 1024)))
+CHUNK_SIZE = 64 * 1024
+
+# Resized WebP variants generated next to every cover for srcset
+COVER_WIDTHS = (240, 480, 960)
+
+EXTENSIONS = {"JPEG": ".jpg", "PNG": ".png", "WEBP": ".webp", "GIF": ".gif"}
+
+
+def variant_name(digest: str, width: int) -> str:
+    return f"{digest}-{width}w.webp"
+
+
+def cover_srcset(image_url: Optional[str]) -> str:
+    """
+    srcset attribute for a cover, or "" for covers without generated variants.
+    """
+    if not image_url or not image_url.startswith(COVER_URL + "/"):
+        return ""
+    digest = os.path.splitext(os.path.basename(image_url))[0]
+    return ", ".join(f"{COVER_URL}/{variant_name(digest, width)} {width}w" for width in COVER_WIDTHS)
+
+
+def _image_errors() -> tuple:
+    """
+    What Pillow raises for files that are not images it can safely decode:
+    unknown or corrupt data, and images over its pixel limit (decompression bombs).
+    """
+    from PIL import Image, UnidentifiedImageError
+    return (UnidentifiedImageError, Image.DecompressionBombError, OSError, SyntaxError, ValueError)
+
+
+def _detect_format(path: str) -> str:
+    from PIL import Image
+    try:
+        with Image.open(path) as image:
+            image.verify()
+            return image.format
+    except _image_errors():
+        return None
+
+
+def _write_variants(path: str, digest: str) -> None:
+    from PIL import Image, ImageOps
+    with Image.open(path) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+        for width in COVER_WIDTHS:
+            target = os.path.join(COVER_DIR, variant_name(digest, width))
+            if os.path.exists(target):
+                continue
+            resized = image.copy()
+            resized.thumbnail((width, width * 2))
+            tmp = target + ".tmp"
+            resized.save(tmp, "WEBP", quality=80, method=4)
+            os.replace(tmp, target)
+
+
+def _store(tmp_path: str, digest: str) -> str:
+    """
+    Move a fully written temporary file to its content-addressed name
+    (or drop it if that content is already stored) and make the variants.
+    """
+    image_format = _detect_format(tmp_path)
+    if image_format not in EXTENSIONS:
+        os.remove(tmp_path)
+        raise HTTPException(status_code=400, detail="Unsupported image format")
+
+    filename = digest + EXTENSIONS[image_format]
+    target = os.path.join(COVER_DIR, filename)
+    if os.path.exists(target):
+        os.remove(tmp_path)
+    else:
+        os.replace(tmp_path, target)
+    try:
+        _write_variants(target, digest)
+    except _image_errors():
+        # verify() passed but the pixels cannot be decoded: drop the file
+        for path in [target] + [os.path.join(COVER_DIR, variant_name(digest, width)) for width in COVER_WIDTHS]:
+            if os.path.exists(path):
+                os.remove(path)
+        raise HTTPException(status_code=400, detail="Unsupported image format")
+    return f"{COVER_URL}/{filename}"
+
+
+async def save_cover(upload: UploadFile) -> str:
+    """
+    Stream an uploaded cover to disk in chunks without blocking the event loop,
+    enforcing MAX_IMAGE_BYTES, and return its public URL.
+    """
+    os.makedirs(COVER_DIR, exist_ok=True)
+    tmp = await run_in_threadpool(tempfile.NamedTemporaryFile, dir=COVER_DIR, suffix=".upload", delete=False)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        while True:
+            chunk = await upload.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > MAX_IMAGE_BYTES:
+                raise HTTPException(status_code=413, detail="Image too large")
+            digest.update(chunk)
+            await run_in_threadpool(tmp.write, chunk)
+        await run_in_threadpool(tmp.close)
+    except BaseException:
+        tmp.close()
+        os.remove(tmp.name)
+        raise
+
+    return await run_in_threadpool(_store, tmp.name, digest.hexdigest()[:32])
+
+
+def import_existing_cover(path: str) -> str:
+    """
+    Copy an image already on disk into the content-addressed store.
+    """
+    os.makedirs(COVER_DIR, exist_ok=True)
+    digest = hashlib.sha256()
+    with open(path, "rb") as source, tempfile.NamedTemporaryFile(dir=COVER_DIR, suffix=".upload", delete=False) as tmp:
+        for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+            tmp.write(chunk)
+    return _store(tmp.name, digest.hexdigest()[:32])
+
+
+if __name__ == "__main__":
+    # Usage: python -m app.images migrate
+    # Moves covers uploaded before content addressing into the store and makes their variants.
+    if sys.argv[1:] != ["migrate"]:
+        sys.exit("usage: python -m app.images migrate")
+    from app.database import SessionLocal
+    from app import models
+    db = SessionLocal()
+    try:
+        for book in db.query(models.Book).filter(models.Book.image_url.like("/static/images/%")):
+            path = book.image_url.lstrip("/")
+            if book.image_url.startswith(COVER_URL + "/") or not os.path.isfile(path):
+                continue
+            book.image_url = import_existing_cover(path)
+            print(f"{book.title}: {book.image_url}")
+        db.commit()
+    finally:
+        db.close()
@@ -0,0 +1,291 @@
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Set
+from sqlalchemy import insert, update
+from sqlalchemy.orm import Session
+from app import models, rollups, due, catalog
+from datetime import timedelta
+import os
+
+BORROW_DAYS = 14  # 2 weeks borrow period
+# Most books one batch checkout may take
+CHECKOUT_MAX_BOOKS = int(os.getenv("CHECKOUT_MAX_BOOKS", "20"))
+
+# Why a book of a batch checkout was not checked out
+NOT_FOUND = "not_found"
+OUT_OF_STOCK = "out_of_stock"
+ALREADY_BORROWED = "already_borrowed"
+
+
+class AlreadyBorrowed(Exception):
+    """
+    Raised when a member tries to borrow a book they have not returned yet.
+    """
+
+
+# Stock changes are single conditional UPDATE statements so that concurrent
+# requests can never oversell: the database checks and decrements atomically.
+# They do not bump the catalog version, whose single row would serialize every
+# checkout on one lock: the books' updated_at carries stock changes to the
+# cards and pages. Only a book going out of (or back into) stock bumps it.
+
+
+def reserve_stock_stmt(book_id: int, quantity: int = 1):
+    """
+    UPDATE taking `quantity` copies of a book if (and only if) enough are in stock.
+    Returns the book id, price and remaining quantity of the reserved book, or no row.
+    """
+    return (
+        update(models.Book)
+        .where(models.Book.id == book_id, models.Book.quantity >= quantity)
+        .values(quantity=models.Book.quantity - quantity)
+        .returning(models.Book.id, models.Book.price, models.Book.quantity)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def restock_stmt(book_id: int, quantity: int = 1):
+    """
+    UPDATE putting `quantity` copies of a book back into stock.
+    Returns the new quantity, or no row.
+    """
+    return (
+        update(models.Book)
+        .where(models.Book.id == book_id)
+        .values(quantity=models.Book.quantity + quantity)
+        .returning(models.Book.quantity)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def reserve_many_stmt(book_ids: List[int]):
+    """
+    UPDATE taking one copy of each of the books that is in stock.
+    Returns the id, price and remaining quantity of every reserved book.
+    """
+    return (
+        update(models.Book)
+        .where(models.Book.id.in_(book_ids), models.Book.quantity >= 1)
+        .values(quantity=models.Book.quantity - 1)
+        .returning(models.Book.id, models.Book.price, models.Book.quantity)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def restock_many_stmt(book_ids: List[int]):
+    """
+    UPDATE putting one copy of each of the books back into stock.
+    """
+    return (
+        update(models.Book)
+        .where(models.Book.id.in_(book_ids))
+        .values(quantity=models.Book.quantity + 1)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def close_borrow_stmt(transaction_id: int, user_id: Optional[int] = None):
+    """
+    UPDATE marking an open borrow as returned; matches nothing if it was already returned.
+    Returns the book id of the borrow, or no row.
+    """
+    conditions = [
+        models.Transaction.id == transaction_id,
+        models.Transaction.transaction_type == "borrow",
+        models.Transaction.is_returned == False,
+    ]
+    if user_id is not None:
+        conditions.append(models.Transaction.user_id == user_id)
+    return (
+        update(models.Transaction)
+        .where(*conditions)
+        .values(is_returned=True, return_date=models.utcnow())
+        .returning(models.Transaction.book_id)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def reserve_stock(db: Session, book_id: int, quantity: int = 1) -> Optional[float]:
+    """
+    Atomically take copies of a book out of stock.
+    Returns the book price, or None if the book does not exist or is out of stock.
+    The caller commits, together with the transaction row it inserts.
+    """
+    row = db.execute(reserve_stock_stmt(book_id, quantity)).first()
+    if row is None:
+        return None
+    if row.quantity == 0:
+        # Sold out: catalog pages show it as out of stock
+        catalog.bump_version(db)
+    return row.price
+
+
+def restock(db: Session, book_id: int, quantity: int = 1) -> None:
+    """
+    Atomically put copies of a book back into stock.
+    """
+    row = db.execute(restock_stmt(book_id, quantity)).first()
+    if row is not None and row.quantity == quantity:
+        # Back in stock
+        catalog.bump_version(db)
+
+
+def return_borrow(db: Session, transaction_id: int, user_id: Optional[int] = None) -> Optional[int]:
+    """
+    Close an open borrow and restock its book in the current DB transaction.
+    Pass user_id to only allow returning that member's own borrows.
+    Returns the book id, or None if there was no open borrow to return.
+    """
+    row = db.execute(close_borrow_stmt(transaction_id, user_id)).first()
+    if not row:
+        return None
+    restock(db, row.book_id)
+    return row.book_id
+
+
+# --- Checkout operations shared by the sync and async request handlers ---
+# They run inside the caller's DB transaction and never commit themselves.
+
+def buy(db: Session, user_id: int, book_id: int) -> Optional[models.Transaction]:
+    """
+    Sell one copy of a book to a member.
+    Returns the new transaction, or None if the book is missing or out of stock.
+    """
+    price = reserve_stock(db, book_id)
+    if price is None:
+        return None
+
+    transaction = models.Transaction(
+        user_id=user_id,
+        book_id=book_id,
+        transaction_type="buy",
+        amount=price
+    )
+    db.add(transaction)
+    rollups.record(db, book_id, units_sold=1, revenue=price)
+    return transaction
+
+
+def has_open_borrow(db: Session, user_id: int, book_id: int) -> bool:
+    """
+    Whether the member currently has this book borrowed and not returned.
+    """
+    return db.query(models.Transaction.id).filter(
+        models.Transaction.user_id == user_id,
+        models.Transaction.book_id == book_id,
+        models.Transaction.transaction_type == "borrow",
+        models.Transaction.is_returned == False
+    ).first() is not None
+
+
+def open_borrow_book_ids(db: Session, user_id: int, book_ids: List[int]) -> Set[int]:
+    """
+    Which of the books the member currently has borrowed, in one query.
+    """
+    return {book_id for (book_id,) in db.query(models.Transaction.book_id).filter(
+        models.Transaction.user_id == user_id,
+        models.Transaction.book_id.in_(book_ids),
+        models.Transaction.transaction_type == "borrow",
+        models.Transaction.is_returned == False
+    )}
+
+
+def borrow(db: Session, user_id: int, book_id: int) -> Optional[models.Transaction]:
+    """
+    Lend one copy of a book to a member for BORROW_DAYS days.
+    Returns the new transaction, or None if the book is missing or out of stock.
+    Raises AlreadyBorrowed if the member still has this book.
+    """
+    if has_open_borrow(db, user_id, book_id):
+        raise AlreadyBorrowed()
+
+    if reserve_stock(db, book_id) is None:
+        return None
+
+    transaction = models.Transaction(
+        user_id=user_id,
+        book_id=book_id,
+        transaction_type="borrow",
+        amount=0, # No cost for borrowing initially
+        due_date=models.utcnow() + timedelta(days=BORROW_DAYS)
+    )
+    db.add(transaction)
+    rollups.record(db, book_id, borrows=1)
+    return transaction
+
+
+def give_back(db: Session, transaction_id: int, user_id: Optional[int] = None) -> Optional[int]:
+    """
+    Return a borrowed book: close the borrow, restock, count the return and
+    drop its due state.
+    Returns the book id, or None if there was no open borrow to return.
+    """
+    book_id = return_borrow(db, transaction_id, user_id=user_id)
+    if book_id is not None:
+        rollups.record(db, book_id, returns=1)
+        due.forget(db, transaction_id)
+    return book_id
+
+
+@dataclass
+class CheckoutResult:
+    """
+    Outcome of a batch checkout: the new transactions, and the books that were
+    not checked out with the reason (NOT_FOUND, OUT_OF_STOCK or ALREADY_BORROWED).
+    """
+    transactions: List[models.Transaction] = field(default_factory=list)
+    failed: Dict[int, str] = field(default_factory=dict)
+
+
+def checkout(db: Session, user_id: int, book_ids: Iterable[int], action: str, partial: bool = False) -> CheckoutResult:
+    """
+    Buy or borrow (action "buy" or "borrow") one copy of each of several books
+    with a fixed number of statements, however many books there are: one
+    double-borrow check, one conditional stock UPDATE, one bulk INSERT of the
+    transactions and one rollup upsert. Repeated ids count once.
+    Without partial it is all or nothing: if any book cannot be checked out,
+    nothing is and the result only lists the failures. With partial, the
+    books that can be checked out are.
+    """
+    book_ids = list(dict.fromkeys(book_ids))
+    result = CheckoutResult()
+
+    if action == "borrow":
+        for book_id in open_borrow_book_ids(db, user_id, book_ids):
+            result.failed[book_id] = ALREADY_BORROWED
+        if result.failed and not partial:
+            return result
+
+    wanted = [book_id for book_id in book_ids if book_id not in result.failed]
+    reserved_rows = db.execute(reserve_many_stmt(wanted)).all() if wanted else []
+    prices = {row.id: row.price for row in reserved_rows}
+
+    missing = [book_id for book_id in wanted if book_id not in prices]
+    if missing:
+        existing = {book_id for (book_id,) in db.query(models.Book.id).filter(models.Book.id.in_(missing))}
+        for book_id in missing:
+            result.failed[book_id] = OUT_OF_STOCK if book_id in existing else NOT_FOUND
+        if not partial and prices:
+            # Undo the reservations; the rows stay locked by this transaction
+            db.execute(restock_many_stmt(list(prices)))
+            return result
+    if not prices:
+        return result
+
+    reserved = [book_id for book_id in wanted if book_id in prices]
+    if action == "buy":
+        rows = [{"user_id": user_id, "book_id": book_id, "transaction_type": "buy", "amount": prices[book_id]} for book_id in reserved]
+        increments = {book_id: {"units_sold": 1, "revenue": prices[book_id]} for book_id in reserved}
+    else:
+        due_date = models.utcnow() + timedelta(days=BORROW_DAYS)
+        rows = [{"user_id": user_id, "book_id": book_id, "transaction_type": "borrow", "amount": 0, "due_date": due_date} for book_id in reserved]
+        increments = {book_id: {"borrows": 1} for book_id in reserved}
+
+    transactions = db.scalars(insert(models.Transaction).returning(models.Transaction), rows)
+    # In the order the books were given
+    position = {book_id: index for index, book_id in enumerate(reserved)}
+    result.transactions = sorted(transactions, key=lambda transaction: position[transaction.book_id])
+    rollups.record_many(db, increments)
+    if any(row.quantity == 0 for row in reserved_rows):
+        # Some books sold out
+        catalog.bump_version(db)
+    return result
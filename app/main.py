@@ -1,55 +1,138 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, Depends
-from fastapi.responses import HTMLResponse
-from fastapi.staticfiles import StaticFiles
-from app.database import engine, Base
-from app.routers import auth, books, dashboard
+from fastapi.responses import HTMLResponse, Response
+from sqlalchemy.exc import OperationalError
+from app.database import ASYNC_DB
+from app import database, utils, assets, migrations, scheduler, templating, profiling, metrics, suggest
+from app.routers import auth, books, dashboard, api
+import logging
+import time
 
-# Create the database tables
-# This will create all tables defined in models.py if they don't exist
-Base.metadata.create_all(bind=engine)
+logger = logging.getLogger(__name__)
+
+
+def prepare_database() -> None:
+    """
+    Check that the schema is current (or upgrade it with DB_AUTO_MIGRATE=1)
+    and open the pooled connections. The tables are created by
+    `python -m app.migrations upgrade`, not here. If the database cannot be
+    reached the worker still starts and connects once it is back; a schema
+    that is out of date stops it.
+    """
+    engine = database.get_engine()
+    try:
+        if database.DB_AUTO_MIGRATE:
+            migrations.upgrade(engine)
+        else:
+            migrations.check(engine)
+        database.warm_up()
+    except OperationalError:
+        logger.warning("Database unavailable at startup, skipping schema check and pool warm-up", exc_info=True)
+
+
+async def warm_up_async_pool() -> None:
+    """
+    Open the async engine's pooled connections too (DB_ASYNC=1 only).
+    """
+    try:
+        await database.warm_up_async()
+    except (OperationalError, OSError):
+        logger.warning("Database unavailable at startup, skipping async pool warm-up", exc_info=True)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    started = time.perf_counter()
+    prepare_database()
+    if ASYNC_DB:
+        await warm_up_async_pool()
+    # Compile all templates before the first request needs them
+    templating.precompile()
+    # Background jobs (overdue scanner) run for the lifetime of the worker
+    jobs = scheduler.start(database.SessionLocal)
+    # Share this worker's metrics with the others through METRICS_DIR
+    metrics_flusher = metrics.start()
+    # Autocomplete index, built in the background and kept in sync
+    suggest_sync = suggest.start()
+    logger.info("Worker ready in %.0f ms", 1000 * (time.perf_counter() - started))
+    yield
+    await suggest.stop(suggest_sync)
+    await metrics.stop(metrics_flusher)
+    await scheduler.stop(database.SessionLocal, jobs)
+    # Stop the password hashing processes
+    utils.shutdown_hashing()
 
 # Initialize the FastAPI application
 app = FastAPI(
     title="Library Management System",
     description="A comprehensive system for managing library books, members, and transactions.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Mount the static directory
-# This allows serving static files like CSS and JavaScript
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# This allows serving static files like CSS and JavaScript. Templates link them
+# through static_url(), whose fingerprinted names are cached by browsers for good.
+app.mount("/static", assets.CachedStaticFiles(directory="static"), name="static")
+
+# Read-your-writes: after a successful write, pin the client's reads to the primary
+@app.middleware("http")
+async def pin_writes_to_primary(request: Request, call_next):
+    response = await call_next(request)
+    if database.ReadSessionLocal is not None and request.method not in ("GET", "HEAD", "OPTIONS") and response.status_code < 400:
+        database.pin_to_primary(response)
+    return response
+
+# Opt-in SQL profiling (SQL_PROFILING=1): Server-Timing header, slow request
+# and N+1 logs, query budgets per route. Nothing is installed when it is off.
+profiling.install(app)
+
+# Request latency, counts and in-flight gauges for /metrics; added last so it
+# wraps the other middleware too
+app.add_middleware(metrics.MetricsMiddleware)
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    """
+    Prometheus text exposition of the request, pool and business metrics,
+    summed over all workers when METRICS_DIR is set.
+    """
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
 
 # Include the routers
-# These routers handle the API endpoints for different features
+# These routers handle the API endpoints for different features.
+# In async mode the async handlers are registered first so they take over their paths.
+# They are only imported then: sqlalchemy.ext.asyncio needs greenlet.
+if ASYNC_DB:
+    from app.routers import async_routes
+    app.include_router(async_routes.router)
 app.include_router(auth.router)
 app.include_router(books.router)
 app.include_router(dashboard.router)
+app.include_router(api.router)
 
 from fastapi import Request, Depends
-from fastapi.templating import Jinja2Templates
 from sqlalchemy.orm import Session
-from sqlalchemy import or_
-from app.database import get_db
-from app import models
-
-templates = Jinja2Templates(directory="templates")
+from app.database import get_read_db
+from app.security import get_current_user
+from app import page_cache
 
-def get_current_user(request: Request, db: Session):
-    user_id = request.cookies.get("user_id")
-    if not user_id:
-        return None
-    return db.query(models.User).filter(models.User.id == int(user_id)).first()
 
 @app.get("/", response_class=HTMLResponse)
-def read_root(request: Request, q: str = None, error: str = None, db: Session = Depends(get_db)):
+def read_root(
+    request: Request,
+    q: str = None,
+    error: str = None,
+    sort: str = None,
+    after: str = None,
+    before: str = None,
+    limit: int = None,
+    db: Session = Depends(get_read_db)
+):
     """
     Root endpoint to render the home page with optional search.
+    The catalog is keyset paginated so only one page of books is loaded per
+    request, and the rendered page is cached until the catalog changes.
     """
-    query = db.query(models.Book)
-    if q:
-        search = f"%{q}%"
-        query = query.filter(or_(models.Book.title.ilike(search), models.Book.author.ilike(search)))
-    
-    books = query.all()
     user = get_current_user(request, db)
-    return templates.TemplateResponse("index.html", {"request": request, "books": books, "user": user, "query": q, "error": error})
+    return page_cache.catalog_response(db, request, user, q=q, error=error, sort=sort, after=after, before=before, limit=limit)
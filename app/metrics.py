@@ -0,0 +1,331 @@
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import asyncio
+import glob
+import json
+import logging
+import math
+import os
+import threading
+import time
+import weakref
+
+# Prometheus-style metrics, served by GET /metrics in the text exposition format.
+#
+# Updates are lock-free: every thread adds to its own dict (a "shard"), and only
+# a scrape or a flush reads all of them. When a thread exits (threadpool
+# threads come and go) its shard is folded into _retired, so the totals stay
+# exact and only live threads have a shard. Each worker process keeps its own
+# shards. With METRICS_DIR set, every worker writes a snapshot of its values
+# to METRICS_DIR/<pid>.json every METRICS_FLUSH_INTERVAL seconds (and on
+# shutdown), and /metrics adds up the snapshots of all workers, so whichever
+# worker the load balancer picks reports the totals. Counters and histograms of
+# workers that have exited are kept; their gauges are dropped.
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1").lower() in ("1", "true", "yes")
+METRICS_DIR = os.getenv("METRICS_DIR") or None
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+
+# Latency buckets in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+logger = logging.getLogger(__name__)
+
+# (metric name, label values, part) -> value. part is "" for counters and
+# gauges; for histograms it is a bucket index or "sum".
+Key = Tuple[str, Tuple[str, ...], object]
+
+_local = threading.local()
+_shards: List[Dict[Key, float]] = []
+# Values of the threads that have exited
+_retired: Dict[Key, float] = {}
+_shards_lock = threading.Lock()
+
+
+class _ThreadShard:
+    """
+    Owner of a thread's shard, kept in thread-local storage: it is freed when
+    the thread exits, which retires the shard.
+    """
+    __slots__ = ("values", "__weakref__")
+
+    def __init__(self):
+        self.values: Dict[Key, float] = {}
+
+
+def _retire(values: Dict[Key, float]) -> None:
+    with _shards_lock:
+        _shards[:] = [shard for shard in _shards if shard is not values]
+        for key, value in values.items():
+            _retired[key] = _retired.get(key, 0.0) + value
+
+
+def _shard() -> Dict[Key, float]:
+    try:
+        return _local.shard.values
+    except AttributeError:
+        shard = _local.shard = _ThreadShard()
+        weakref.finalize(shard, _retire, shard.values)
+        # Only taken once per thread
+        with _shards_lock:
+            _shards.append(shard.values)
+        return shard.values
+
+
+class Metric:
+    """
+    A counter, gauge or histogram with a fixed list of label names.
+    """
+
+    def __init__(self, kind: str, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.kind = kind
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        values = _shard()
+        key = (self.name, labels, "")
+        values[key] = values.get(key, 0.0) + amount
+
+    def dec(self, *labels: str, amount: float = 1.0) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def observe(self, value: float, *labels: str) -> None:
+        values = _shard()
+        bucket = (self.name, labels, bisect_left(self.buckets, value))
+        values[bucket] = values.get(bucket, 0.0) + 1
+        total = (self.name, labels, "sum")
+        values[total] = values.get(total, 0.0) + value
+
+
+REGISTRY: Dict[str, Metric] = {}
+# Functions returning (metric name, label values, value) samples of gauges
+# read at collection time, e.g. the connection pool state
+COLLECTORS: List[Callable[[], Iterable[Tuple[str, Tuple[str, ...], float]]]] = []
+
+
+def _register(metric: Metric) -> Metric:
+    REGISTRY[metric.name] = metric
+    return metric
+
+
+def counter(name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Metric:
+    return _register(Metric("counter", name, documentation, labelnames))
+
+
+def gauge(name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Metric:
+    return _register(Metric("gauge", name, documentation, labelnames))
+
+
+def histogram(name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Metric:
+    return _register(Metric("histogram", name, documentation, labelnames, buckets))
+
+
+def register_collector(collector) -> None:
+    COLLECTORS.append(collector)
+
+
+# --- Metrics of the app ---
+
+REQUEST_DURATION = histogram("http_request_duration_seconds", "Time to handle a request", ("method", "route"))
+REQUESTS = counter("http_requests_total", "Requests handled", ("method", "route", "status"))
+IN_FLIGHT = gauge("http_requests_in_flight", "Requests being handled", ("method",))
+
+POOL_SIZE = gauge("db_pool_size", "Connections the pool keeps open", ("engine",))
+POOL_CHECKED_OUT = gauge("db_pool_checked_out", "Pooled connections in use", ("engine",))
+POOL_OVERFLOW = gauge("db_pool_overflow", "Connections open beyond the pool size", ("engine",))
+POOL_WAIT = histogram("db_pool_wait_seconds", "Time spent waiting for a pooled connection", ("engine",))
+POOL_TIMEOUTS = counter("db_pool_timeouts_total", "Checkouts that gave up waiting for a connection", ("engine",))
+
+BOOKS_BOUGHT = counter("library_books_bought_total", "Books sold")
+BOOKS_BORROWED = counter("library_books_borrowed_total", "Books lent out")
+BOOKS_RETURNED = counter("library_books_returned_total", "Borrowed books returned", ("by",))
+LOGINS = counter("library_logins_total", "Login attempts", ("outcome",))
+
+
+# --- Collection ---
+
+def local_values() -> Dict[Key, float]:
+    """
+    This process's values: the sum of all thread shards plus the collectors' gauges.
+    """
+    with _shards_lock:
+        shards = list(_shards)
+        totals: Dict[Key, float] = dict(_retired)
+    for shard in shards:
+        # dict.copy() is atomic, so a thread adding to its shard meanwhile is harmless
+        for key, value in shard.copy().items():
+            totals[key] = totals.get(key, 0.0) + value
+    for collector in COLLECTORS:
+        for name, labels, value in collector():
+            totals[(name, labels, "")] = value
+    return totals
+
+
+def _snapshot_path(pid: int) -> str:
+    return os.path.join(METRICS_DIR, f"{pid}.json")
+
+
+def flush(final: bool = False) -> None:
+    """
+    Write this worker's values to METRICS_DIR. The final flush on shutdown
+    leaves the gauges out, since the worker no longer has anything in flight.
+    """
+    if not METRICS_DIR:
+        return
+    values = local_values()
+    if final:
+        values = {key: value for key, value in values.items() if REGISTRY[key[0]].kind != "gauge"}
+    path = _snapshot_path(os.getpid())
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        json.dump([[name, list(labels), part, value] for (name, labels, part), value in values.items()], f)
+    # Readers never see a half-written file
+    os.replace(path + ".tmp", path)
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def collect() -> Dict[Key, float]:
+    """
+    Values of every worker when METRICS_DIR is set, else of this process.
+    """
+    if not METRICS_DIR:
+        return local_values()
+    flush()
+    totals: Dict[Key, float] = {}
+    for path in glob.glob(os.path.join(METRICS_DIR, "*.json")):
+        pid = int(os.path.basename(path).split(".")[0])
+        try:
+            with open(path) as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            continue
+        alive = _alive(pid)
+        for name, labels, part, value in entries:
+            metric = REGISTRY.get(name)
+            if metric is None or (metric.kind == "gauge" and not alive):
+                continue
+            key = (name, tuple(labels), part)
+            totals[key] = totals.get(key, 0.0) + value
+    return totals
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def render(values: Optional[Dict[Key, float]] = None) -> str:
+    """
+    The values in the Prometheus text exposition format.
+    """
+    values = collect() if values is None else values
+    by_metric: Dict[str, Dict[Tuple[str, ...], Dict[object, float]]] = {}
+    for (name, labels, part), value in values.items():
+        by_metric.setdefault(name, {}).setdefault(labels, {})[part] = value
+
+    lines = []
+    for name, metric in REGISTRY.items():
+        lines.append(f"# HELP {name} {metric.documentation}")
+        lines.append(f"# TYPE {name} {metric.kind}")
+        for labels, parts in sorted(by_metric.get(name, {}).items()):
+            if metric.kind != "histogram":
+                lines.append(f"{name}{_format_labels(metric.labelnames, labels)} {_format_value(parts.get('', 0.0))}")
+                continue
+            cumulative = 0.0
+            for index, bound in enumerate((*metric.buckets, math.inf)):
+                cumulative += parts.get(index, 0.0)
+                le = "+Inf" if math.isinf(bound) else repr(bound)
+                lines.append(f"{name}_bucket{_format_labels(metric.labelnames, labels, ('le', le))} {_format_value(cumulative)}")
+            lines.append(f"{name}_sum{_format_labels(metric.labelnames, labels)} {_format_value(parts.get('sum', 0.0))}")
+            lines.append(f"{name}_count{_format_labels(metric.labelnames, labels)} {_format_value(cumulative)}")
+    return "\n".join(lines) + "\n"
+
+
+# --- Request metrics ---
+
+class MetricsMiddleware:
+    """
+    ASGI middleware timing every HTTP request by method and route template.
+    A plain ASGI middleware rather than @app.middleware, so streamed bodies are
+    timed to their end and no extra task is spawned per request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            return await self.app(scope, receive, send)
+
+        method = scope["method"]
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        IN_FLIGHT.inc(method)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            IN_FLIGHT.dec(method)
+            # The template ("/books/edit/{book_id}") so ids do not make new
+            # series; mounts (static files) report their prefix
+            route = getattr(scope.get("route"), "path", None) or scope.get("root_path") or "unmatched"
+            REQUEST_DURATION.observe(time.perf_counter() - started, method, route)
+            REQUESTS.inc(method, route, str(status))
+
+
+async def run_flusher() -> None:
+    while True:
+        await asyncio.sleep(METRICS_FLUSH_INTERVAL)
+        try:
+            flush()
+        except OSError:
+            logger.exception("could not write metrics snapshot")
+
+
+def start() -> Optional[asyncio.Task]:
+    """
+    Start writing this worker's snapshots to METRICS_DIR (if set).
+    """
+    if not METRICS_DIR:
+        return None
+    flush()
+    return asyncio.create_task(run_flusher())
+
+
+async def stop(task: Optional[asyncio.Task]) -> None:
+    if task is None:
+        return
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    flush(final=True)
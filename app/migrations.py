@@ -0,0 +1,172 @@
+from datetime import datetime, timezone
+from typing import List
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, func, inspect, insert, select, text
+from app import models, search  # search registers the full-text index DDL
+from app.database import Base
+import sys
+
+# Run once per deploy with `python -m app.migrations upgrade`, not by the app:
+# workers only check at startup that the schema is current.
+# upgrade() creates missing tables, but create_all() never changes existing
+# ones. Each migration below brings an older database up to date. They are
+# idempotent, so on a database create_all() has just built they only record
+# their version.
+
+metadata = MetaData()
+schema_version = Table(
+    "schema_version",
+    metadata,
+    Column("version", Integer, primary_key=True),
+    Column("description", String, nullable=False),
+    Column("applied_at", DateTime(timezone=True), nullable=False),
+)
+
+class SchemaOutOfDate(RuntimeError):
+    """
+    Raised at startup when the database is behind the migrations in this code.
+    """
+
+
+MIGRATIONS = []
+# Arbitrary key for the PostgreSQL advisory lock serialising concurrent upgrades
+LOCK_KEY = 7_430_201
+
+
+def migration(version: int, description: str):
+    def register(apply):
+        MIGRATIONS.append((version, description, apply))
+        MIGRATIONS.sort(key=lambda entry: entry[0])
+        return apply
+    return register
+
+
+@migration(1, "add books.updated_at")
+def add_book_updated_at(conn) -> None:
+    if "updated_at" in {column["name"] for column in inspect(conn).get_columns("books")}:
+        return
+    column_type = models.Book.__table__.c.updated_at.type.compile(dialect=conn.dialect)
+    conn.execute(text(f"ALTER TABLE books ADD COLUMN updated_at {column_type}"))
+    conn.execute(text("UPDATE books SET updated_at = created_at"))
+
+
+@migration(2, "composite indexes for the transaction hot paths")
+def add_transaction_indexes(conn) -> None:
+    names = {
+        "ix_transactions_user_book_open",
+        "ix_transactions_type_returned_due",
+        "ix_transactions_type_created",
+        "ix_transactions_user_created",
+    }
+    for index in models.Transaction.__table__.indexes:
+        if index.name in names:
+            index.create(conn, checkfirst=True)
+
+
+@migration(3, "seed the catalog version counter")
+def seed_catalog_version(conn) -> None:
+    table = models.CatalogVersion.__table__
+    table.create(conn, checkfirst=True)
+    if conn.execute(select(table.c.id).where(table.c.id == 1)).first() is None:
+        conn.execute(insert(table).values(id=1, version=0, changed_at=datetime.now(timezone.utc)))
+
+
+@migration(4, "precomputed book recommendations")
+def add_recommendation_tables(conn) -> None:
+    models.BookRecommendation.__table__.create(conn, checkfirst=True)
+    models.RecommendationState.__table__.create(conn, checkfirst=True)
+    for table in (models.Transaction.__table__, models.TransactionArchive.__table__):
+        for index in table.indexes:
+            if index.name.endswith("_book_user"):
+                index.create(conn, checkfirst=True)
+
+
+@migration(5, "composite indexes for the catalog keyset sorts")
+def add_catalog_sort_indexes(conn) -> None:
+    for index in models.Book.__table__.indexes:
+        if index.name in ("ix_books_title_id", "ix_books_created_id"):
+            index.create(conn, checkfirst=True)
+
+
+@migration(6, "index books.updated_at for change polling")
+def add_book_updated_at_index(conn) -> None:
+    for index in models.Book.__table__.indexes:
+        if index.name == "ix_books_updated_at":
+            index.create(conn, checkfirst=True)
+
+
+@migration(7, "add catalog_version.deletions")
+def add_catalog_deletions(conn) -> None:
+    if "deletions" in {column["name"] for column in inspect(conn).get_columns("catalog_version")}:
+        return
+    conn.execute(text("ALTER TABLE catalog_version ADD COLUMN deletions INTEGER NOT NULL DEFAULT 0"))
+
+
+@migration(8, "index transactions.created_at for the recommendations refresh")
+def add_transaction_created_index(conn) -> None:
+    for index in models.Transaction.__table__.indexes:
+        if index.name == "ix_transactions_created_at":
+            index.create(conn, checkfirst=True)
+
+
+def current_version(conn) -> int:
+    schema_version.create(conn, checkfirst=True)
+    return conn.execute(select(func.max(schema_version.c.version))).scalar() or 0
+
+
+def latest_version() -> int:
+    return MIGRATIONS[-1][0]
+
+
+def check(bind) -> int:
+    """
+    Return the schema version, raising SchemaOutOfDate if migrations are
+    pending. Unlike upgrade() it never changes the database.
+    """
+    with bind.connect() as conn:
+        version = 0
+        if inspect(conn).has_table(schema_version.name):
+            version = conn.execute(select(func.max(schema_version.c.version))).scalar() or 0
+    if version < latest_version():
+        raise SchemaOutOfDate(
+            f"Database schema is at version {version}, this code needs {latest_version()}: "
+            "run `python -m app.migrations upgrade`"
+        )
+    return version
+
+
+def upgrade(bind) -> List[int]:
+    """
+    Create missing tables and apply the pending migrations in one transaction.
+    Returns the versions applied.
+    """
+    applied = []
+    with bind.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            # Several workers may start at once; let one of them do the work
+            conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": LOCK_KEY})
+        Base.metadata.create_all(bind=conn)
+        current = current_version(conn)
+        for version, description, apply in MIGRATIONS:
+            if version <= current:
+                continue
+            apply(conn)
+            conn.execute(insert(schema_version).values(version=version, description=description, applied_at=datetime.now(timezone.utc)))
+            applied.append(version)
+    return applied
+
+
+if __name__ == "__main__":
+    # Usage: python -m app.migrations [upgrade|status]
+    from app.database import get_engine
+    engine = get_engine()
+    command = sys.argv[1] if len(sys.argv) > 1 else "upgrade"
+    if command == "upgrade":
+        applied = upgrade(engine)
+        print(f"Applied migrations {applied}" if applied else "Database is up to date")
+    elif command == "status":
+        with engine.begin() as conn:
+            version = current_version(conn)
+        for number, description, _ in MIGRATIONS:
+            print(f"{'x' if number <= version else ' '} {number:>3} {description}")
+    else:
+        sys.exit("usage: python -m app.migrations [upgrade|status]")
@@ -1,7 +1,15 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime, Float, Text
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime, Date, Float, Text, Index, SmallInteger
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.database import Base
+from app import images
+from datetime import datetime, timezone
+
+
+def utcnow():
+    # Set on the Python side as well so that keyset cursors round-trip exactly
+    # (SQLite's CURRENT_TIMESTAMP has no fractional seconds).
+    return datetime.now(timezone.utc)
 
 class User(Base):
     """
@@ -24,6 +32,13 @@ class Book(Base):
     Book model representing the inventory.
     """
     __tablename__ = "books"
+    __table_args__ = (
+        # Keyset pagination of the catalog sorts (app/catalog.py CATALOG_SORTS)
+        Index("ix_books_title_id", "title", "id"),
+        Index("ix_books_created_id", "created_at", "id"),
+        # Recently changed books (stock stream, ETags, autocomplete sync)
+        Index("ix_books_updated_at", "updated_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, index=True, nullable=False)
@@ -32,17 +47,40 @@ class Book(Base):
     price = Column(Float, nullable=False)
     quantity = Column(Integer, default=0)
     image_url = Column(String, nullable=True)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(DateTime(timezone=True), default=utcnow, server_default=func.now())
+    # Bumped by every ORM or Core UPDATE (stock changes included); feeds the API ETags
+    updated_at = Column(DateTime(timezone=True), default=utcnow, onupdate=utcnow, server_default=func.now())
 
     # Relationships
     transactions = relationship("Transaction", back_populates="book")
 
+    @property
+    def cover_srcset(self) -> str:
+        """
+        srcset of the resized cover variants ("" for covers uploaded before they existed).
+        """
+        return images.cover_srcset(self.image_url)
+
 
 class Transaction(Base):
     """
     Transaction model for tracking sales and borrowing history.
     """
     __tablename__ = "transactions"
+    __table_args__ = (
+        # Double-borrow check: a member's open borrow of one book
+        Index("ix_transactions_user_book_open", "user_id", "book_id", "transaction_type", "is_returned"),
+        # Dashboard overdue / due soon lists
+        Index("ix_transactions_type_returned_due", "transaction_type", "is_returned", "due_date"),
+        # Sales by day (rollup backfill, reports)
+        Index("ix_transactions_type_created", "transaction_type", "created_at"),
+        # A member's history, newest first
+        Index("ix_transactions_user_created", "user_id", "created_at"),
+        # Members who have a book (recommendations refresh)
+        Index("ix_transactions_book_user", "book_id", "user_id"),
+        # Transactions since the last recommendations refresh
+        Index("ix_transactions_created_at", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -52,8 +90,124 @@ class Transaction(Base):
     due_date = Column(DateTime(timezone=True), nullable=True)  # For borrowed books
     return_date = Column(DateTime(timezone=True), nullable=True)  # When book was returned
     is_returned = Column(Boolean, default=False) # Status for borrowed books
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(DateTime(timezone=True), default=utcnow, server_default=func.now())
 
     # Relationships
     user = relationship("User", back_populates="transactions")
     book = relationship("Book", back_populates="transactions")
+
+
+class TransactionArchive(Base):
+    """
+    Old purchases and returned borrows moved out of the transactions table by
+    app/archive.py. Same columns (and ids) as Transaction.
+    """
+    __tablename__ = "transactions_archive"
+    __table_args__ = (
+        # A member's history, newest first
+        Index("ix_transactions_archive_user_created", "user_id", "created_at"),
+        Index("ix_transactions_archive_book_user", "book_id", "user_id"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    book_id = Column(Integer, ForeignKey("books.id"), nullable=False)
+    transaction_type = Column(String, nullable=False)
+    amount = Column(Float, nullable=False)
+    due_date = Column(DateTime(timezone=True), nullable=True)
+    return_date = Column(DateTime(timezone=True), nullable=True)
+    is_returned = Column(Boolean, default=False)
+    created_at = Column(DateTime(timezone=True), nullable=False)
+    archived_at = Column(DateTime(timezone=True), nullable=False, default=utcnow)
+
+class SalesRollup(Base):
+    """
+    Per day, per book totals of transactions.
+    Maintained incrementally in the same DB transaction as every buy, borrow and
+    return so the dashboard never has to scan the transactions table.
+    """
+    __tablename__ = "sales_rollups"
+
+    day = Column(Date, primary_key=True)
+    book_id = Column(Integer, ForeignKey("books.id"), primary_key=True)
+    units_sold = Column(Integer, nullable=False, default=0)
+    revenue = Column(Float, nullable=False, default=0.0)
+    borrows = Column(Integer, nullable=False, default=0)
+    returns = Column(Integer, nullable=False, default=0)
+
+    # Relationships
+    book = relationship("Book")
+
+
+class BorrowDueState(Base):
+    """
+    Precomputed due status of every open borrow, refreshed by the overdue scanner
+    (app/due.py) so pages do not have to classify borrows on every request.
+    """
+    __tablename__ = "borrow_due_states"
+    __table_args__ = (
+        # Dashboard lists: overdue / due soon, ordered by due date
+        Index("ix_borrow_due_states_state_due", "state", "due_date"),
+    )
+
+    transaction_id = Column(Integer, ForeignKey("transactions.id"), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    book_id = Column(Integer, ForeignKey("books.id"), nullable=False)
+    due_date = Column(DateTime(timezone=True), nullable=False)
+    state = Column(String, nullable=False)  # 'overdue', 'due_soon' or 'ok'
+    days_late = Column(Integer, nullable=False, default=0)
+    checked_at = Column(DateTime(timezone=True), nullable=False, default=utcnow)
+
+    # Relationships
+    transaction = relationship("Transaction")
+
+
+class JobLease(Base):
+    """
+    Lease naming the worker process that currently runs a background job,
+    so only one of several app workers runs it at a time.
+    """
+    __tablename__ = "job_leases"
+
+    name = Column(String, primary_key=True)
+    holder = Column(String, nullable=False)
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+
+
+class CatalogVersion(Base):
+    """
+    Single-row counter bumped in the same DB transaction as every change to the
+    catalog listings (books added, edited, deleted or imported; books selling
+    out or coming back into stock). Cached catalog pages are keyed and
+    validated on it. deletions only counts the deletes.
+    """
+    __tablename__ = "catalog_version"
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    deletions = Column(Integer, nullable=False, server_default="0")
+    changed_at = Column(DateTime(timezone=True), nullable=False, default=utcnow)
+
+
+class BookRecommendation(Base):
+    """
+    "Members who borrowed this also borrowed": the top neighbours of a book by
+    how many members bought or borrowed both, precomputed by app/recommendations.py.
+    """
+    __tablename__ = "book_recommendations"
+
+    book_id = Column(Integer, ForeignKey("books.id"), primary_key=True)
+    rank = Column(SmallInteger, primary_key=True)  # 0 is the closest neighbour
+    neighbour_id = Column(Integer, ForeignKey("books.id"), nullable=False)
+    score = Column(Integer, nullable=False)  # members who have both books
+
+
+class RecommendationState(Base):
+    """
+    Single row recording how far the recommendations have read the transactions.
+    """
+    __tablename__ = "recommendation_state"
+
+    id = Column(Integer, primary_key=True)
+    last_transaction_id = Column(Integer, nullable=False, default=0)
+    refreshed_at = Column(DateTime(timezone=True), nullable=True)
@@ -0,0 +1,127 @@
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional, Tuple
+from fastapi import Request, Response, status
+from markupsafe import Markup
+from sqlalchemy.orm import Session
+from app import catalog, security, recommendations
+from app.cache import TTLCache
+from app.templating import templates, fragment_cache
+import hashlib
+import os
+
+# HTTP caching helpers and the catalog page cache.
+# The catalog section of the home and search pages (everything but the navbar,
+# which shows the signed-in user) is cached per catalog version, viewer role and
+# query string: the ids of the page's books and its links, so the catalog query
+# runs once per version. Edits, imports and books going in or out of stock bump
+# the version, so a new version simply misses and stale entries age out of the
+# LRU. Other stock changes only move the books' updated_at: the cards are
+# rendered per request from the (cached) book_card() fragments, and the books'
+# updated_at is part of the ETag and Last-Modified headers, so unchanged pages
+# still cost a 304.
+
+CATALOG_CACHE_SIZE = int(os.getenv("CATALOG_CACHE_SIZE", "2000"))
+CATALOG_CACHE_TTL = float(os.getenv("CATALOG_CACHE_TTL", "600"))
+
+catalog_cache = TTLCache(maxsize=CATALOG_CACHE_SIZE, ttl=CATALOG_CACHE_TTL)
+
+
+def make_etag(*parts) -> str:
+    return '"' + hashlib.sha256(repr(parts).encode()).hexdigest()[:32] + '"'
+
+
+def not_modified(request: Request, etag: str, last_modified: Optional[datetime] = None) -> bool:
+    """
+    Whether the client's copy is current: If-None-Match is checked against the
+    ETag, or when it is absent, If-Modified-Since against last_modified.
+    """
+    header = request.headers.get("if-none-match")
+    if header:
+        return header.strip() == "*" or etag in [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    since = request.headers.get("if-modified-since")
+    if not since or last_modified is None:
+        return False
+    try:
+        since = parsedate_to_datetime(since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    # HTTP dates have whole seconds
+    return last_modified.replace(microsecond=0) <= since
+
+
+def viewer_role(user) -> str:
+    if not user:
+        return "anonymous"
+    return "staff" if user.is_staff else "member"
+
+
+@dataclass
+class CachedCatalog:
+    """
+    A catalog page as cached: its books' ids and the rest of the template context.
+    """
+    book_ids: Tuple[int, ...]
+    context: dict
+
+
+def catalog_response(db: Session, request: Request, user, q=None, error=None, sort=None, after=None, before=None, limit=None) -> Response:
+    """
+    The home/search page, with the catalog query served from the cache when
+    possible. Takes a sync session, so the async routes call it through run_sync.
+    """
+    version, changed_at = catalog.current_version(db)
+    role = viewer_role(user)
+    query = tuple(sorted(request.query_params.multi_items()))
+    key = (version, role, request.url.path, query)
+    cached = catalog_cache.get(key)
+    if cached is None:
+        page = catalog.get_catalog_page(db, q=q, sort=sort, after=after, before=before, limit=limit)
+        books = page.items
+        cached = CachedCatalog(tuple(book.id for book in books), {
+            "sort": catalog.current_sort(q, sort),
+            "query": q,
+            "error": error,
+            **catalog.page_links(request, page)
+        })
+        catalog_cache.set(key, cached)
+    else:
+        books = catalog.books_by_id(db, cached.book_ids)
+
+    # The navbar shows the user's email, so it is part of the ETag (not the cache key)
+    stamps = tuple(book.updated_at for book in books)
+    etag = make_etag("catalog", version, request.url.path, query, role, user.email if user else None, stamps)
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "private, no-cache" if user else "no-cache",
+        "Vary": "Cookie, Authorization",
+    }
+    last_modified = max(filter(None, [changed_at, *map(catalog.as_utc, stamps)]), default=None)
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(last_modified.astimezone(timezone.utc), usegmt=True)
+    if not_modified(request, etag, last_modified):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    section = Markup(templates.env.get_template("partials/catalog.html").render(
+        request=request,
+        books=books,
+        also=recommendations.for_books(db, cached.book_ids, version),
+        staff=role == "staff",
+        **cached.context
+    ))
+    return templates.TemplateResponse("index.html", {"request": request, "user": user, "catalog": section}, headers=headers)
+
+
+def stats() -> dict:
+    """
+    Entry and hit/miss counts of this worker's caches, for monitoring.
+    """
+    return {
+        "catalog_pages": catalog_cache.stats(),
+        "book_cards": fragment_cache.stats(),
+        "users": security.user_cache.stats(),
+        "recommendations": recommendations.recommendation_cache.stats(),
+    }
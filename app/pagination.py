@@ -0,0 +1,186 @@
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, List, Optional, Sequence
+from sqlalchemy import and_, literal, or_, tuple_
+import base64
+import json
+import os
+
+# Page size used when the request does not ask for one, and the hard upper bound
+DEFAULT_PAGE_SIZE = int(os.getenv("CATALOG_PAGE_SIZE", "24"))
+MAX_PAGE_SIZE = int(os.getenv("CATALOG_MAX_PAGE_SIZE", "100"))
+
+
+class InvalidCursor(ValueError):
+    """
+    Raised when a cursor token cannot be decoded.
+    """
+
+
+@dataclass
+class SortKey:
+    """
+    One column (or SQL expression) of a keyset ordering.
+    The last key of every ordering must be unique (normally the primary key)
+    so that the ordering is total and pages never overlap.
+    """
+    expression: Any
+    descending: bool = False
+
+
+@dataclass
+class Page:
+    """
+    A single page of results plus the cursors needed to move around it.
+    """
+    items: List[Any] = field(default_factory=list)
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
+    page_size: int = DEFAULT_PAGE_SIZE
+
+
+def clamp_page_size(limit: Optional[int]) -> int:
+    """
+    Normalise a user supplied page size into the allowed range.
+    """
+    if not limit or limit < 1:
+        return DEFAULT_PAGE_SIZE
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    """
+    Encode the sort key values of a row into an opaque, URL safe token.
+    """
+    payload = [{"dt": v.isoformat()} if isinstance(v, datetime) else v for v in values]
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _python_type(key: SortKey) -> Optional[type]:
+    try:
+        return key.expression.type.python_type
+    except NotImplementedError:
+        # SQL functions without a declared type, e.g. bm25()
+        return None
+
+
+def decode_cursor(token: str, keys: Sequence[SortKey]) -> List[Any]:
+    """
+    Decode a token produced by encode_cursor back into sort key values,
+    checking each value against the type of its key: cursors come from the
+    client, so anything else is rejected with InvalidCursor.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        payload = json.loads(raw)
+    except (ValueError, TypeError) as exc:
+        raise InvalidCursor(str(exc)) from exc
+
+    if not isinstance(payload, list) or len(payload) != len(keys):
+        raise InvalidCursor("cursor does not match the requested ordering")
+
+    values = []
+    for key, value in zip(keys, payload):
+        if isinstance(value, dict):
+            try:
+                value = datetime.fromisoformat(value["dt"])
+            except (KeyError, TypeError, ValueError) as exc:
+                raise InvalidCursor(str(exc)) from exc
+        if value is not None:
+            expected = _python_type(key)
+            if isinstance(value, bool) or not isinstance(value, (str, int, float, datetime)):
+                raise InvalidCursor(f"unexpected cursor value {value!r}")
+            if expected is float and isinstance(value, int):
+                value = float(value)
+            elif expected in (str, int, float, datetime) and not isinstance(value, expected):
+                raise InvalidCursor(f"cursor value {value!r} does not match its sort key")
+        values.append(value)
+    return values
+
+
+def keyset_predicate(keys: Sequence[SortKey], values: Sequence[Any], forward: bool = True):
+    """
+    Build the WHERE clause selecting rows strictly after (or before) the cursor
+    position, honouring the direction of every key. When all keys go the same
+    way this is a row-value comparison, (k1, k2) > (v1, v2), which the database
+    can answer by seeking an index on (k1, k2). Mixed directions expand to
+    (k1 > v1) OR (k1 = v1 AND k2 > v2) OR ..., with a leading k1 >= v1 bound so
+    that an index on k1 can still be used for the range.
+    """
+    greater = [key.descending != forward for key in keys]
+    if all(greater) or not any(greater):
+        row = tuple_(*[key.expression for key in keys])
+        cursor = tuple_(*[literal(value, key.expression.type) for key, value in zip(keys, values)])
+        return row > cursor if greater[0] else row < cursor
+
+    # Bind the cursor values with the keys' types so both sides compare alike
+    bound_values = [literal(value, key.expression.type) for key, value in zip(keys, values)]
+    clauses = []
+    for i, key in enumerate(keys):
+        step = key.expression > bound_values[i] if greater[i] else key.expression < bound_values[i]
+        prefix = [keys[j].expression == bound_values[j] for j in range(i)]
+        clauses.append(and_(*prefix, step))
+    first = keys[0].expression
+    bound = first >= bound_values[0] if greater[0] else first <= bound_values[0]
+    return and_(bound, or_(*clauses))
+
+
+def apply_keyset(query, keys: Sequence[SortKey], after: Optional[str] = None, before: Optional[str] = None, page_size: int = DEFAULT_PAGE_SIZE):
+    """
+    Restrict, order and limit a Query or Select to one page.
+    The sort key values are appended as trailing columns so the page cursors can
+    be built from the rows; one extra row is fetched to detect further pages.
+    Raises InvalidCursor if the cursor cannot be decoded.
+    """
+    backward = bool(before)
+    token = before if backward else after
+    if token:
+        values = decode_cursor(token, keys)
+        query = query.filter(keyset_predicate(keys, values, forward=not backward))
+
+    ordering = []
+    for key in keys:
+        descending = key.descending != backward
+        ordering.append(key.expression.desc() if descending else key.expression.asc())
+
+    return query.order_by(*ordering).add_columns(*[key.expression for key in keys]).limit(page_size + 1)
+
+
+def build_page(rows: Sequence[Any], keys: Sequence[SortKey], after: Optional[str] = None, before: Optional[str] = None, page_size: int = DEFAULT_PAGE_SIZE) -> Page:
+    """
+    Turn the rows fetched by a query from apply_keyset into a Page.
+    """
+    backward = bool(before)
+    has_more = len(rows) > page_size
+    rows = list(rows[:page_size])
+    if backward:
+        rows.reverse()
+
+    key_count = len(keys)
+    page = Page(items=[row[0] for row in rows], page_size=page_size)
+    if not rows:
+        return page
+
+    first = encode_cursor(rows[0][-key_count:])
+    last = encode_cursor(rows[-1][-key_count:])
+    if backward:
+        page.prev_cursor = first if has_more else None
+        page.next_cursor = last
+    else:
+        page.prev_cursor = first if after else None
+        page.next_cursor = last if has_more else None
+    return page
+
+
+def paginate(query, keys: Sequence[SortKey], after: Optional[str] = None, before: Optional[str] = None, page_size: int = DEFAULT_PAGE_SIZE) -> Page:
+    """
+    Fetch one keyset page of a (sync) ORM query.
+    An undecodable cursor simply restarts from the first page.
+    """
+    try:
+        rows = apply_keyset(query, keys, after=after, before=before, page_size=page_size).all()
+    except InvalidCursor:
+        after = before = None
+        rows = apply_keyset(query, keys, page_size=page_size).all()
+    return build_page(rows, keys, after=after, before=before, page_size=page_size)
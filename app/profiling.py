@@ -0,0 +1,186 @@
+from collections import Counter
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+from fastapi import FastAPI, Request
+from starlette.datastructures import MutableHeaders
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import logging
+import os
+import time
+
+# Opt-in SQL profiling. With SQL_PROFILING=1 every request counts the queries
+# it runs and the time spent in the database (engine events, all engines),
+# answers with a Server-Timing header, logs slow requests with their
+# statements, and warns when one statement shape repeats often enough to look
+# like an N+1 pattern. Routes with an entry in QUERY_BUDGETS are also checked
+# against it; in strict mode (used by tests/test_query_budgets.py) going over
+# the budget raises QueryBudgetExceeded instead of only logging.
+# With profiling off (the default) nothing is installed: no middleware, no
+# engine event listeners.
+
+SQL_PROFILING = os.getenv("SQL_PROFILING", "0").lower() in ("1", "true", "yes")
+SQL_PROFILING_STRICT = os.getenv("SQL_PROFILING_STRICT", "0").lower() in ("1", "true", "yes")
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "500"))
+# The same statement this many times in one request is reported as a suspected N+1
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "5"))
+
+# Most queries a request may run, by method and route path. Cached users and
+# catalog pages make many requests cheaper; these are the uncached worst cases.
+QUERY_BUDGETS: Dict[Tuple[str, str], int] = {
+    ("GET", "/"): 5,
+    ("GET", "/books/"): 5,
+    ("GET", "/books/my-books"): 7,
+    ("POST", "/books/buy/{book_id}"): 6,
+    ("POST", "/books/borrow/{book_id}"): 6,
+    ("POST", "/books/return/{transaction_id}"): 6,
+    ("POST", "/books/checkout"): 6,
+    ("GET", "/dashboard/"): 6,
+    ("POST", "/dashboard/return/{transaction_id}"): 6,
+    ("GET", "/api/v1/books"): 2,
+    ("GET", "/api/v1/books/{book_id}"): 1,
+    ("POST", "/api/v1/checkout"): 6,
+}
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(AssertionError):
+    """
+    Raised in strict mode when a request runs more queries than its route's budget.
+    """
+
+
+@dataclass
+class RequestProfile:
+    """
+    The statements one request ran, as (normalised SQL, seconds) pairs.
+    """
+    statements: List[Tuple[str, float]] = field(default_factory=list)
+
+    def record(self, statement: str, seconds: float) -> None:
+        self.statements.append((" ".join(statement.split()), seconds))
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    @property
+    def db_time(self) -> float:
+        return sum(seconds for _, seconds in self.statements)
+
+    def repeated(self, threshold: int = N_PLUS_ONE_THRESHOLD) -> List[Tuple[str, int]]:
+        """
+        Statement shapes run at least threshold times, most frequent first.
+        """
+        counts = Counter(statement for statement, _ in self.statements)
+        return [(statement, count) for statement, count in counts.most_common() if count >= threshold]
+
+    def server_timing(self, total: float) -> str:
+        return f'db;dur={1000 * self.db_time:.1f};desc="{self.count} queries", app;dur={1000 * total:.1f}'
+
+
+_current: ContextVar[Optional[RequestProfile]] = ContextVar("sql_profile", default=None)
+
+
+def _start_timer(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and _current.get() is not None:
+        context._profiling_started = time.perf_counter()
+
+
+def _record_statement(conn, cursor, statement, parameters, context, executemany):
+    profile = _current.get()
+    started = getattr(context, "_profiling_started", None)
+    if profile is not None and started is not None:
+        profile.record(statement, time.perf_counter() - started)
+
+
+def enable() -> None:
+    """
+    Start timing the statements of every engine.
+    """
+    if not event.contains(Engine, "before_cursor_execute", _start_timer):
+        event.listen(Engine, "before_cursor_execute", _start_timer)
+        event.listen(Engine, "after_cursor_execute", _record_statement)
+
+
+def disable() -> None:
+    if event.contains(Engine, "before_cursor_execute", _start_timer):
+        event.remove(Engine, "before_cursor_execute", _start_timer)
+        event.remove(Engine, "after_cursor_execute", _record_statement)
+
+
+def route_key(request: Request) -> Tuple[str, str]:
+    """
+    (method, route path template) of a handled request, e.g. ("GET", "/books/edit/{book_id}").
+    """
+    route = request.scope.get("route")
+    return request.method, getattr(route, "path", request.url.path)
+
+
+def check(request: Request, profile: RequestProfile, total: float) -> None:
+    """
+    Log a slow request, suspected N+1 patterns and a blown query budget.
+    """
+    method, path = route_key(request)
+    if 1000 * total >= SLOW_REQUEST_MS:
+        statements = "\n".join(f"  {1000 * seconds:8.1f}ms  {statement}" for statement, seconds in profile.statements)
+        logger.warning("Slow request %s %s: %.0f ms, %d queries (%.0f ms)\n%s", method, path, 1000 * total, profile.count, 1000 * profile.db_time, statements)
+    for statement, count in profile.repeated():
+        logger.warning("Suspected N+1 in %s %s: %d x %s", method, path, count, statement)
+
+    budget = QUERY_BUDGETS.get((method, path))
+    if budget is not None and profile.count > budget:
+        message = f"{method} {path} ran {profile.count} queries, budget is {budget}"
+        if SQL_PROFILING_STRICT:
+            raise QueryBudgetExceeded(message + ":\n" + "\n".join(statement for statement, _ in profile.statements))
+        logger.warning(message)
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware collecting the SQL statements run while handling a request.
+    The Server-Timing header and the checks are done when the response starts;
+    statements run while a streamed body is sent are not counted.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        profile = RequestProfile()
+        started = time.perf_counter()
+        failure = None
+
+        async def send_wrapper(message):
+            nonlocal failure
+            if message["type"] == "http.response.start":
+                total = time.perf_counter() - started
+                MutableHeaders(scope=message).append("Server-Timing", profile.server_timing(total))
+                try:
+                    check(Request(scope), profile, total)
+                except QueryBudgetExceeded as exc:
+                    # Raised once the response is sent, like any handler error
+                    failure = exc
+            await send(message)
+
+        token = _current.set(profile)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+        if failure is not None:
+            raise failure
+
+
+def install(app: FastAPI) -> None:
+    """
+    Add the profiling middleware and engine listeners when SQL_PROFILING is on.
+    """
+    if SQL_PROFILING:
+        enable()
+        app.add_middleware(ProfilingMiddleware)
@@ -0,0 +1,296 @@
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from sqlalchemy import delete, func, insert, or_, select, union
+from sqlalchemy.orm import Session
+from app import models, catalog
+from app.cache import TTLCache
+import os
+import sys
+
+# "Members who borrowed this also borrowed" recommendations, precomputed.
+#
+# Two books are related by the number of members who bought or borrowed both
+# (archived history included). Counting that per request would scan the
+# transactions, so a background job (app/scheduler.py) keeps the top
+# RECOMMENDATIONS_K neighbours of every book in book_recommendations:
+#
+#   A = members x books 0/1 matrix (scipy.sparse), C = A.T @ A
+#
+# C[b, n] is the number of members who have both b and n. Only the rows of
+# books that can have changed are recomputed: a new transaction by member u
+# changes the rows of every book u has. Those rows need only the members who
+# have one of those books, and are computed in blocks of RECOMMENDATIONS_BLOCK
+# books, so memory stays bounded however big the catalog is. NumPy and SciPy
+# are imported on the first run: the job runs in the threadpool of whichever
+# web worker holds its lease, so that worker loads them and does the matrix
+# work. `python -m app.recommendations` runs the same refresh from cron.
+# The catalog version is only bumped when some book's neighbours changed.
+#
+# Pages read the table through for_books(), cached per worker and per catalog
+# version: a refresh that changes some neighbours bumps the version, so every
+# worker sees the new recommendations on its next request.
+
+RECOMMENDATIONS_K = int(os.getenv("RECOMMENDATIONS_K", "10"))
+# Pairs of books fewer members have in common are not recommended
+RECOMMENDATIONS_MIN_SCORE = int(os.getenv("RECOMMENDATIONS_MIN_SCORE", "2"))
+RECOMMENDATIONS_INTERVAL = float(os.getenv("RECOMMENDATIONS_INTERVAL", "3600"))
+# Books per block of C computed at once
+RECOMMENDATIONS_BLOCK = int(os.getenv("RECOMMENDATIONS_BLOCK", "2000"))
+# More books to recompute than this and the whole table is rebuilt instead
+FULL_REFRESH_BOOKS = 20000
+# Transactions this much older than the last refresh are read again, in case
+# one with a smaller id committed after it
+REFRESH_OVERLAP = timedelta(minutes=10)
+STATE_ID = 1
+
+# Neighbours shown per catalog card, and books suggested on My Books
+RECOMMENDATIONS_SHOWN = int(os.getenv("RECOMMENDATIONS_SHOWN", "3"))
+MEMBER_RECOMMENDATIONS = int(os.getenv("MEMBER_RECOMMENDATIONS", "6"))
+RECOMMENDATION_CACHE_SIZE = int(os.getenv("RECOMMENDATION_CACHE_SIZE", "20000"))
+RECOMMENDATION_CACHE_TTL = float(os.getenv("RECOMMENDATION_CACHE_TTL", "600"))
+
+recommendation_cache = TTLCache(maxsize=RECOMMENDATION_CACHE_SIZE, ttl=RECOMMENDATION_CACHE_TTL)
+
+# Up to RECOMMENDATIONS_SHOWN (book id, title) pairs, closest first
+Neighbours = Tuple[Tuple[int, str], ...]
+
+
+# --- Building ---
+
+def _numeric():
+    try:
+        import numpy
+        from scipy import sparse
+    except ImportError as exc:
+        raise RuntimeError("Building recommendations needs numpy and scipy (pip install numpy scipy)") from exc
+    return numpy, sparse
+
+
+def _member_books(users=None):
+    """
+    Distinct (member, book) pairs of the live and archived transactions,
+    optionally of the given members only.
+    """
+    queries = []
+    for Transaction in (models.Transaction, models.TransactionArchive):
+        query = select(Transaction.user_id, Transaction.book_id)
+        if users is not None:
+            query = query.where(Transaction.user_id.in_(users))
+        queries.append(query)
+    return union(*queries)
+
+
+def _members_with(book_ids: List[int]):
+    return union(*[
+        select(Transaction.user_id).where(Transaction.book_id.in_(book_ids))
+        for Transaction in (models.Transaction, models.TransactionArchive)
+    ])
+
+
+def top_neighbours(A, columns, k: int = RECOMMENDATIONS_K, min_score: int = RECOMMENDATIONS_MIN_SCORE):
+    """
+    The k closest neighbours of the books at `columns` of the member x book
+    matrix A (CSC), as parallel arrays (position in columns, neighbour column,
+    score, rank). Ties go to the lower column, i.e. the lower book id.
+    """
+    np, _ = _numeric()
+    # C[i, j] = members who have both book columns[i] and book j
+    C = (A[:, columns].T @ A).tocsr()
+    row = np.repeat(np.arange(C.shape[0]), np.diff(C.indptr))
+    col, score = C.indices, C.data
+    keep = (score >= min_score) & (col != columns[row])
+    row, col, score = row[keep], col[keep], score[keep]
+
+    # Sort every row by score (descending), then column; the rank is the
+    # position in the row
+    order = np.lexsort((col, -score, row))
+    row, col, score = row[order], col[order], score[order]
+    rank = np.arange(len(row)) - np.searchsorted(row, row)
+    keep = rank < k
+    return row[keep], col[keep], score[keep], rank[keep]
+
+
+def compute(pairs, book_ids: Optional[Iterable[int]] = None) -> List[dict]:
+    """
+    book_recommendations rows for book_ids (every book when None), from
+    (member, book) pairs that include all the pairs of the members who have
+    one of those books.
+    """
+    np, sparse = _numeric()
+    pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+    if not len(pairs):
+        return []
+    _, user_index = np.unique(pairs[:, 0], return_inverse=True)
+    books, book_index = np.unique(pairs[:, 1], return_inverse=True)
+    A = sparse.csc_matrix(
+        (np.ones(len(pairs), dtype=np.int32), (user_index, book_index)),
+        shape=(user_index.max() + 1, len(books)),
+    )
+    if book_ids is None:
+        columns = np.arange(len(books))
+    else:
+        wanted = np.asarray(sorted(set(book_ids)), dtype=np.int64)
+        columns = np.searchsorted(books, wanted)
+        columns = columns[(columns < len(books)) & (books[np.minimum(columns, len(books) - 1)] == wanted)]
+
+    rows = []
+    for start in range(0, len(columns), RECOMMENDATIONS_BLOCK):
+        block = columns[start:start + RECOMMENDATIONS_BLOCK]
+        position, neighbour, score, rank = top_neighbours(A, block)
+        rows.extend(
+            {"book_id": book, "rank": r, "neighbour_id": n, "score": s}
+            for book, n, s, r in zip(
+                books[block[position]].tolist(), books[neighbour].tolist(), score.tolist(), rank.tolist()
+            )
+        )
+    return rows
+
+
+def _state(db: Session) -> models.RecommendationState:
+    state = db.get(models.RecommendationState, STATE_ID)
+    if state is None:
+        state = models.RecommendationState(id=STATE_ID, last_transaction_id=0)
+        db.add(state)
+    return state
+
+
+def _chunks(values: List[int], size: int = 500):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def _as_set(rows: Iterable[dict]) -> Set[Tuple[int, int, int, int]]:
+    return {(row["book_id"], row["rank"], row["neighbour_id"], row["score"]) for row in rows}
+
+
+def _stored(db: Session, book_ids: Optional[List[int]] = None) -> Set[Tuple[int, int, int, int]]:
+    """
+    The book_recommendations rows of book_ids (of every book when None), as
+    (book, rank, neighbour, score) tuples.
+    """
+    Recommendation = models.BookRecommendation
+    columns = (Recommendation.book_id, Recommendation.rank, Recommendation.neighbour_id, Recommendation.score)
+    if book_ids is None:
+        return {tuple(row) for row in db.query(*columns)}
+    return {tuple(row) for chunk in _chunks(book_ids) for row in db.query(*columns).filter(Recommendation.book_id.in_(chunk))}
+
+
+def refresh(db: Session, full: bool = False) -> int:
+    """
+    Bring book_recommendations up to date with the transactions made since the
+    last refresh, or rebuild it from scratch with full=True (also done on the
+    first run, or when too many books are affected). Runs in the caller's DB
+    transaction. Returns the number of books whose neighbours were recomputed.
+    """
+    state = _state(db)
+    last_id = db.query(func.max(models.Transaction.id)).scalar() or 0
+    if not full and last_id <= state.last_transaction_id:
+        return 0
+
+    book_ids: Optional[List[int]] = None
+    if not full and state.refreshed_at is not None:
+        since = catalog.as_utc(state.refreshed_at) - REFRESH_OVERLAP
+        new_members = select(models.Transaction.user_id).where(or_(
+            models.Transaction.id > state.last_transaction_id, models.Transaction.created_at > since
+        ))
+        # Every book of a member with a new transaction has a changed row
+        book_ids = sorted({book_id for _, book_id in db.execute(_member_books(new_members))})
+        if len(book_ids) > FULL_REFRESH_BOOKS:
+            book_ids = None
+
+    if book_ids is None:
+        pairs = db.execute(_member_books()).all()
+        rows = compute(pairs)
+        changed = _stored(db) != _as_set(rows)
+        if changed:
+            db.execute(delete(models.BookRecommendation))
+        refreshed = len({pair[1] for pair in pairs})
+    else:
+        pairs = db.execute(_member_books(_members_with(book_ids))).all() if book_ids else []
+        rows = compute(pairs, book_ids)
+        changed = _stored(db, book_ids) != _as_set(rows)
+        if changed:
+            for chunk in _chunks(book_ids):
+                db.execute(delete(models.BookRecommendation).where(models.BookRecommendation.book_id.in_(chunk)))
+        refreshed = len(book_ids)
+
+    if changed and rows:
+        db.execute(insert(models.BookRecommendation), rows)
+    state.last_transaction_id = last_id
+    state.refreshed_at = datetime.now(timezone.utc)
+    if changed:
+        # Catalog pages show the recommendations
+        catalog.bump_version(db)
+    return refreshed
+
+
+# --- Serving ---
+
+def for_books(db: Session, book_ids: Iterable[int], version: Optional[int] = None) -> Dict[int, Neighbours]:
+    """
+    The closest RECOMMENDATIONS_SHOWN neighbours of each book, with their
+    titles. Cached per book and catalog version (pass it if it is already at
+    hand, otherwise it is read); the misses are loaded with one query.
+    """
+    if version is None:
+        version = catalog.current_version(db)[0]
+    result: Dict[int, Neighbours] = {}
+    missing = []
+    for book_id in dict.fromkeys(book_ids):
+        cached = recommendation_cache.get((version, book_id))
+        if cached is None:
+            missing.append(book_id)
+        else:
+            result[book_id] = cached
+
+    if missing:
+        found: Dict[int, list] = {book_id: [] for book_id in missing}
+        rows = db.query(models.BookRecommendation.book_id, models.Book.id, models.Book.title).join(
+            models.Book, models.Book.id == models.BookRecommendation.neighbour_id
+        ).filter(
+            models.BookRecommendation.book_id.in_(missing),
+            models.BookRecommendation.rank < RECOMMENDATIONS_SHOWN,
+        ).order_by(models.BookRecommendation.book_id, models.BookRecommendation.rank)
+        for book_id, neighbour_id, title in rows:
+            found[book_id].append((neighbour_id, title))
+        for book_id, neighbours in found.items():
+            result[book_id] = tuple(neighbours)
+            recommendation_cache.set((version, book_id), result[book_id])
+    return result
+
+
+def member_book_ids(db: Session, user_id: int) -> Set[int]:
+    """
+    Every book a member has bought or borrowed, archived history included.
+    """
+    return {book_id for _, book_id in db.execute(_member_books([user_id]))}
+
+
+def for_member(db: Session, book_ids: Iterable[int], owned: Set[int], limit: int = MEMBER_RECOMMENDATIONS) -> List[Tuple[int, str]]:
+    """
+    Books to suggest to a member from the neighbours of book_ids (the books on
+    their My Books page), leaving out the books they already have (owned). The
+    books recommended by more of book_ids come first.
+    """
+    votes: Dict[Tuple[int, str], int] = {}
+    for neighbours in for_books(db, book_ids).values():
+        for neighbour in neighbours:
+            if neighbour[0] not in owned:
+                votes[neighbour] = votes.get(neighbour, 0) + 1
+    # Stable sort: equally voted books keep their closest-first order
+    return sorted(votes, key=votes.get, reverse=True)[:limit]
+
+
+if __name__ == "__main__":
+    # Usage: python -m app.recommendations [refresh|rebuild]
+    command = sys.argv[1] if len(sys.argv) > 1 else "refresh"
+    if command not in ("refresh", "rebuild"):
+        sys.exit("usage: python -m app.recommendations [refresh|rebuild]")
+    from app.database import SessionLocal
+    session = SessionLocal()
+    try:
+        count = refresh(session, full=command == "rebuild")
+        session.commit()
+        print(f"Recomputed the recommendations of {count} books")
+    finally:
+        session.close()
@@ -0,0 +1,170 @@
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import Date, delete, func, insert, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from app import models
+from datetime import date, datetime, time, timedelta, timezone
+import os
+import sys
+
+COUNTERS = ("units_sold", "revenue", "borrows", "returns")
+# Days of rollups summed into the dashboard's revenue and books sold; 0 (the
+# default) sums them all, so the figures are all-time totals
+SALES_TOTALS_DAYS = int(os.getenv("SALES_TOTALS_DAYS", "0"))
+
+
+def today() -> date:
+    """
+    Rollup day of "now". Days are UTC, like every transaction timestamp
+    (created_at, due_date and return_date are all written in UTC).
+    """
+    return datetime.now(timezone.utc).date()
+
+
+def rollup_upsert_stmt(dialect_name: str, book_id: int, day: date, **increments):
+    """
+    INSERT ... ON CONFLICT (day, book_id) DO UPDATE adding `increments` to the counters.
+    Returns None for databases without an upsert, see record().
+    """
+    return rollup_upsert_many_stmt(dialect_name, day, {book_id: increments})
+
+
+def rollup_upsert_many_stmt(dialect_name: str, day: date, increments_by_book: Dict[int, Dict[str, float]]):
+    """
+    One multi-row upsert adding each book's increments to its counters for `day`.
+    Returns None for databases without an upsert.
+    """
+    dialects = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+    if dialect_name not in dialects:
+        return None
+
+    table = models.SalesRollup.__table__
+    stmt = dialects[dialect_name](table).values([
+        {"day": day, "book_id": book_id, **{name: increments.get(name, 0) for name in COUNTERS}}
+        for book_id, increments in increments_by_book.items()
+    ])
+    changed = {name for increments in increments_by_book.values() for name, value in increments.items() if value}
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c.day, table.c.book_id],
+        set_={name: table.c[name] + stmt.excluded[name] for name in COUNTERS if name in changed},
+    )
+
+
+def record(db: Session, book_id: int, day: Optional[date] = None, **increments) -> None:
+    """
+    Add to the rollup counters of a book for a day (today by default), e.g.
+    record(db, book_id, units_sold=1, revenue=price).
+    Runs in the caller's DB transaction; the caller commits.
+    """
+    day = day or today()
+    stmt = rollup_upsert_stmt(db.get_bind().dialect.name, book_id, day, **increments)
+    if stmt is not None:
+        db.execute(stmt)
+        return
+
+    # Portable fallback: update the row, insert it if it did not exist yet
+    table = models.SalesRollup.__table__
+    result = db.execute(
+        update(table)
+        .where(table.c.day == day, table.c.book_id == book_id)
+        .values({name: table.c[name] + value for name, value in increments.items()})
+    )
+    if result.rowcount == 0:
+        db.execute(insert(table).values(day=day, book_id=book_id, **{name: increments.get(name, 0) for name in COUNTERS}))
+
+
+def record_many(db: Session, increments_by_book: Dict[int, Dict[str, float]], day: Optional[date] = None) -> None:
+    """
+    record() for several books in one statement, e.g.
+    record_many(db, {book_id: {"borrows": 1}, other_id: {"borrows": 1}}).
+    """
+    if not increments_by_book:
+        return
+    day = day or today()
+    stmt = rollup_upsert_many_stmt(db.get_bind().dialect.name, day, increments_by_book)
+    if stmt is not None:
+        db.execute(stmt)
+        return
+    for book_id, increments in increments_by_book.items():
+        record(db, book_id, day, **increments)
+
+
+def sales_totals(db: Session, days: int = SALES_TOTALS_DAYS) -> Tuple[float, int]:
+    """
+    Total revenue and books sold, summed over the (per day) rollup rows.
+    With days, only the last `days` days are summed: a range of the (day, book_id) key.
+    """
+    query = db.query(
+        func.coalesce(func.sum(models.SalesRollup.revenue), 0.0),
+        func.coalesce(func.sum(models.SalesRollup.units_sold), 0),
+    )
+    if days:
+        query = query.filter(models.SalesRollup.day >= today() - timedelta(days=days))
+    revenue, units = query.one()
+    return revenue, units
+
+
+def high_demand_books(db: Session, days: int = 3, limit: int = 5) -> List[Tuple[models.Book, int]]:
+    """
+    Books with the most sales over the last `days` days, as (book, units sold) pairs.
+    """
+    since = today() - timedelta(days=days)
+    units = func.sum(models.SalesRollup.units_sold)
+    return db.query(models.Book, units.label("sales_count")).join(
+        models.SalesRollup, models.SalesRollup.book_id == models.Book.id
+    ).filter(
+        models.SalesRollup.day >= since
+    ).group_by(models.Book.id).having(units > 0).order_by(units.desc()).limit(limit).all()
+
+
+def backfill(db: Session, since: Optional[date] = None) -> int:
+    """
+    Rebuild the rollup table from the transaction history (archive included),
+    or only its days from `since` on, which reads just those days' transactions
+    through the (transaction_type, created_at) index. Returns the number of
+    rollup rows written.
+    """
+    start = datetime.combine(since, time.min, tzinfo=timezone.utc) if since else None
+    totals = {}
+
+    def add(rows, *names):
+        for row in rows:
+            counters = totals.setdefault((row[0], row[1]), dict.fromkeys(COUNTERS, 0))
+            for name, value in zip(names, row[2:]):
+                counters[name] += value or 0
+
+    # Live and archived transactions have the same columns
+    for Transaction in (models.Transaction, models.TransactionArchive):
+        created_day = func.date(Transaction.created_at, type_=Date)
+        returned_day = func.date(Transaction.return_date, type_=Date)
+        created = [Transaction.created_at >= start] if start else []
+        returned = [Transaction.return_date >= start] if start else []
+        add(db.query(created_day, Transaction.book_id, func.count(Transaction.id), func.sum(Transaction.amount))
+            .filter(Transaction.transaction_type == "buy", *created).group_by(created_day, Transaction.book_id), "units_sold", "revenue")
+        add(db.query(created_day, Transaction.book_id, func.count(Transaction.id))
+            .filter(Transaction.transaction_type == "borrow", *created).group_by(created_day, Transaction.book_id), "borrows")
+        add(db.query(returned_day, Transaction.book_id, func.count(Transaction.id))
+            .filter(Transaction.transaction_type == "borrow", Transaction.is_returned == True, Transaction.return_date.isnot(None), *returned)
+            .group_by(returned_day, Transaction.book_id), "returns")
+
+    clear = delete(models.SalesRollup)
+    db.execute(clear.where(models.SalesRollup.day >= since) if since else clear)
+    if totals:
+        db.execute(insert(models.SalesRollup), [
+            {"day": day, "book_id": book_id, **counters} for (day, book_id), counters in totals.items()
+        ])
+    db.commit()
+    return len(totals)
+
+
+if __name__ == "__main__":
+    # Usage: python -m app.rollups backfill [days]
+    if sys.argv[1:2] != ["backfill"] or len(sys.argv) > 3:
+        sys.exit("usage: python -m app.rollups backfill [days]")
+    from app.database import SessionLocal
+    days = int(sys.argv[2]) if len(sys.argv) == 3 else None
+    session = SessionLocal()
+    try:
+        print(f"Wrote {backfill(session, since=today() - timedelta(days=days) if days is not None else None)} rollup rows")
+    finally:
+        session.close()
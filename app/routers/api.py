@@ -0,0 +1,161 @@
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from app import models, schemas, database, catalog, inventory, archive, metrics
+from app.page_cache import make_etag, not_modified
+from app.pagination import clamp_page_size
+from app.security import CurrentUser, get_current_user
+
+# JSON API for the kiosk and mobile clients. Authenticated with the session
+# cookie or the same token sent as "Authorization: Bearer <token>".
+# Responses are encoded with orjson; list endpoints send an ETag that is
+# validated before running the list query, so unchanged pages cost a 304.
+
+router = APIRouter(
+    prefix="/api/v1",
+    tags=["API"],
+    default_response_class=ORJSONResponse
+)
+
+
+def conditional(request: Request, etag: str, build) -> Response:
+    """
+    304 if the client already has this ETag, else the JSON built by build().
+    """
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if not_modified(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return ORJSONResponse(build().model_dump(), headers=headers)
+
+
+def require_user(request: Request, db: Session = Depends(database.get_db)) -> CurrentUser:
+    user = get_current_user(request, db)
+    if not user:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
+    return user
+
+
+def checkout_failed(db: Session, book_id: int) -> HTTPException:
+    if db.query(models.Book.id).filter(models.Book.id == book_id).first() is None:
+        return HTTPException(status_code=404, detail="Book not found")
+    return HTTPException(status_code=409, detail="Out of stock")
+
+
+@router.get("/books", response_model=schemas.BookPage)
+def list_books(
+    request: Request,
+    q: Optional[str] = None,
+    sort: Optional[str] = None,
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+    limit: Optional[int] = None,
+    db: Session = Depends(database.get_read_db)
+):
+    """
+    One keyset page of the catalog, optionally searched with q.
+    """
+    # Stock changes do not bump the catalog version but move the newest updated_at
+    etag = make_etag("books", catalog.stock_version(db), q, sort, after, before, clamp_page_size(limit))
+
+    def build():
+        page = catalog.get_catalog_page(db, q=q, sort=sort, after=after, before=before, limit=limit)
+        return schemas.BookPage(
+            items=[schemas.BookResponse.model_validate(book) for book in page.items],
+            next_cursor=page.next_cursor,
+            prev_cursor=page.prev_cursor
+        )
+
+    return conditional(request, etag, build)
+
+
+@router.get("/books/{book_id}", response_model=schemas.BookResponse)
+def get_book(book_id: int, request: Request, db: Session = Depends(database.get_read_db)):
+    book = db.query(models.Book).filter(models.Book.id == book_id).first()
+    if not book:
+        raise HTTPException(status_code=404, detail="Book not found")
+    return conditional(request, make_etag("book", book.id, book.updated_at), lambda: schemas.BookResponse.model_validate(book))
+
+
+@router.get("/me/transactions", response_model=schemas.TransactionPage)
+def my_transactions(
+    request: Request,
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+    limit: Optional[int] = None,
+    user: CurrentUser = Depends(require_user),
+    db: Session = Depends(database.get_read_db)
+):
+    """
+    The caller's purchases and borrows (archived ones included), newest first.
+    """
+    mine = models.Transaction.user_id == user.id
+    # New transactions raise the max id, returns raise the max return date
+    state = tuple(db.query(func.count(models.Transaction.id), func.max(models.Transaction.id), func.max(models.Transaction.return_date)).filter(mine).one())
+    etag = make_etag("transactions", user.id, state, after, before, clamp_page_size(limit))
+
+    def build():
+        page = archive.history_page(db, user.id, after=after, before=before, limit=limit, include_open=True)
+        return schemas.TransactionPage(
+            items=[schemas.TransactionResponse.model_validate(transaction) for transaction in page.items],
+            next_cursor=page.next_cursor,
+            prev_cursor=page.prev_cursor
+        )
+
+    return conditional(request, etag, build)
+
+
+@router.post("/books/{book_id}/buy", response_model=schemas.TransactionResponse, status_code=status.HTTP_201_CREATED)
+def buy_book(book_id: int, user: CurrentUser = Depends(require_user), db: Session = Depends(database.get_db)):
+    transaction = inventory.buy(db, user.id, book_id)
+    if transaction is None:
+        raise checkout_failed(db, book_id)
+    db.commit()
+    metrics.BOOKS_BOUGHT.inc()
+    return ORJSONResponse(schemas.TransactionResponse.model_validate(transaction).model_dump(), status_code=status.HTTP_201_CREATED)
+
+
+@router.post("/books/{book_id}/borrow", response_model=schemas.TransactionResponse, status_code=status.HTTP_201_CREATED)
+def borrow_book(book_id: int, user: CurrentUser = Depends(require_user), db: Session = Depends(database.get_db)):
+    try:
+        transaction = inventory.borrow(db, user.id, book_id)
+    except inventory.AlreadyBorrowed:
+        raise HTTPException(status_code=409, detail="You have already borrowed this book")
+    if transaction is None:
+        raise checkout_failed(db, book_id)
+    db.commit()
+    metrics.BOOKS_BORROWED.inc()
+    return ORJSONResponse(schemas.TransactionResponse.model_validate(transaction).model_dump(), status_code=status.HTTP_201_CREATED)
+
+
+@router.post("/checkout", response_model=schemas.CheckoutResponse, status_code=status.HTTP_201_CREATED)
+def checkout(body: schemas.CheckoutRequest, user: CurrentUser = Depends(require_user), db: Session = Depends(database.get_db)):
+    """
+    Buy or borrow several books in one DB transaction. All or nothing unless
+    partial is set; 409 with the failures when nothing was checked out.
+    """
+    if len(body.book_ids) > inventory.CHECKOUT_MAX_BOOKS:
+        raise HTTPException(status_code=422, detail=f"At most {inventory.CHECKOUT_MAX_BOOKS} books per checkout")
+    result = inventory.checkout(db, user.id, body.book_ids, body.action, partial=body.partial)
+    failed = [schemas.CheckoutFailure(book_id=book_id, reason=reason) for book_id, reason in result.failed.items()]
+    if not result.transactions:
+        raise HTTPException(status_code=409, detail=[failure.model_dump() for failure in failed])
+    # Serialised before the commit expires the rows, which would reload them one by one
+    response = schemas.CheckoutResponse(
+        transactions=[schemas.TransactionResponse.model_validate(transaction) for transaction in result.transactions],
+        failed=failed
+    )
+    db.commit()
+    (metrics.BOOKS_BOUGHT if body.action == "buy" else metrics.BOOKS_BORROWED).inc(amount=len(result.transactions))
+    return ORJSONResponse(response.model_dump(), status_code=status.HTTP_201_CREATED)
+
+
+@router.post("/transactions/{transaction_id}/return", response_model=schemas.TransactionResponse)
+def return_book(transaction_id: int, user: CurrentUser = Depends(require_user), db: Session = Depends(database.get_db)):
+    if inventory.give_back(db, transaction_id, user_id=user.id) is None:
+        raise HTTPException(status_code=404, detail="Transaction not found or already returned")
+    db.commit()
+    metrics.BOOKS_RETURNED.inc("member")
+    transaction = db.query(models.Transaction).filter(models.Transaction.id == transaction_id).one()
+    return ORJSONResponse(schemas.TransactionResponse.model_validate(transaction).model_dump())
@@ -0,0 +1,140 @@
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, status, Request
+from fastapi.responses import HTMLResponse, RedirectResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from app import database, inventory, page_cache, metrics, fragments
+from app.templating import templates
+from app.routers.dashboard import dashboard_context
+from app.security import get_current_user_async
+
+# Async versions of the hot routes, used instead of the sync ones when DB_ASYNC=1.
+# The query logic is shared with the sync handlers through AsyncSession.run_sync,
+# which runs it on the async driver without blocking the event loop.
+
+router = APIRouter(tags=["Async"])
+
+
+
+async def render_catalog(request: Request, db: AsyncSession, q, error, sort, after, before, limit):
+    user = await get_current_user_async(request, db)
+    return await db.run_sync(page_cache.catalog_response, request, user, q=q, error=error, sort=sort, after=after, before=before, limit=limit)
+
+
+@router.get("/", response_class=HTMLResponse)
+async def read_root(
+    request: Request,
+    q: Optional[str] = None,
+    error: Optional[str] = None,
+    sort: Optional[str] = None,
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+    limit: Optional[int] = None,
+    db: AsyncSession = Depends(database.get_async_db)
+):
+    return await render_catalog(request, db, q, error, sort, after, before, limit)
+
+
+@router.get("/books/", response_class=HTMLResponse)
+async def get_books(
+    request: Request,
+    q: Optional[str] = None,
+    error: Optional[str] = None,
+    sort: Optional[str] = None,
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+    limit: Optional[int] = None,
+    db: AsyncSession = Depends(database.get_async_db)
+):
+    return await render_catalog(request, db, q, error, sort, after, before, limit)
+
+
+@router.post("/books/buy/{book_id}")
+async def buy_book(book_id: int, request: Request, db: AsyncSession = Depends(database.get_async_db)):
+    user = await get_current_user_async(request, db)
+    fragment = fragments.wants_fragment(request)
+    if not user:
+        return fragments.login_redirect() if fragment else RedirectResponse(url="/auth/login", status_code=status.HTTP_303_SEE_OTHER)
+
+    if await db.run_sync(inventory.buy, user.id, book_id) is None:
+        if fragment:
+            return await db.run_sync(fragments.card_response, book_id, "This book is out of stock", status.HTTP_409_CONFLICT)
+        return RedirectResponse(url="/", status_code=status.HTTP_303_SEE_OTHER)
+    await db.commit()
+    metrics.BOOKS_BOUGHT.inc()
+
+    if fragment:
+        return await db.run_sync(fragments.card_response, book_id)
+    return RedirectResponse(url="/", status_code=status.HTTP_303_SEE_OTHER)
+
+
+@router.post("/books/borrow/{book_id}")
+async def borrow_book(book_id: int, request: Request, db: AsyncSession = Depends(database.get_async_db)):
+    user = await get_current_user_async(request, db)
+    fragment = fragments.wants_fragment(request)
+    if not user:
+        return fragments.login_redirect() if fragment else RedirectResponse(url="/auth/login", status_code=status.HTTP_303_SEE_OTHER)
+
+    try:
+        transaction = await db.run_sync(inventory.borrow, user.id, book_id)
+    except inventory.AlreadyBorrowed:
+        if fragment:
+            return await db.run_sync(fragments.card_response, book_id, "You have already borrowed this book", status.HTTP_409_CONFLICT)
+        return RedirectResponse(url="/?error=You have already borrowed this book", status_code=status.HTTP_303_SEE_OTHER)
+
+    if transaction is None:
+        if fragment:
+            return await db.run_sync(fragments.card_response, book_id, "This book is out of stock", status.HTTP_409_CONFLICT)
+        return RedirectResponse(url="/", status_code=status.HTTP_303_SEE_OTHER)
+    await db.commit()
+    metrics.BOOKS_BORROWED.inc()
+
+    if fragment:
+        return await db.run_sync(fragments.card_response, book_id)
+    return RedirectResponse(url="/", status_code=status.HTTP_303_SEE_OTHER)
+
+
+@router.post("/books/return/{transaction_id}")
+async def return_book_user(transaction_id: int, request: Request, db: AsyncSession = Depends(database.get_async_db)):
+    user = await get_current_user_async(request, db)
+    fragment = fragments.wants_fragment(request)
+    if not user:
+        return fragments.login_redirect() if fragment else RedirectResponse(url="/auth/login", status_code=status.HTTP_303_SEE_OTHER)
+
+    if await db.run_sync(inventory.give_back, transaction_id, user_id=user.id) is None:
+        if fragment:
+            return await db.run_sync(fragments.returned_row_response, user.id, transaction_id, "This book was already returned", status.HTTP_409_CONFLICT)
+        raise HTTPException(status_code=404, detail="Transaction not found or already returned")
+    await db.commit()
+    metrics.BOOKS_RETURNED.inc("member")
+
+    if fragment:
+        return await db.run_sync(fragments.returned_row_response, user.id, transaction_id)
+    return RedirectResponse(url="/books/my-books", status_code=status.HTTP_303_SEE_OTHER)
+
+
+@router.get("/dashboard/", response_class=HTMLResponse)
+async def get_dashboard(request: Request, db: AsyncSession = Depends(database.get_async_db)):
+    user = await get_current_user_async(request, db)
+    if not user or not user.is_staff:
+        return RedirectResponse(url="/auth/login", status_code=status.HTTP_303_SEE_OTHER)
+
+    context = await db.run_sync(dashboard_context)
+    return templates.TemplateResponse("dashboard.html", {"request": request, "user": user, **context})
+
+
+@router.post("/dashboard/return/{transaction_id}")
+async def return_book(transaction_id: int, request: Request, db: AsyncSession = Depends(database.get_async_db)):
+    user = await get_current_user_async(request, db)
+    if not user or not user.is_staff:
+        raise HTTPException(status_code=403, detail="Not authorized")
+
+    if await db.run_sync(inventory.give_back, transaction_id) is None:
+        if fragments.wants_fragment(request):
+            return fragments.removed_row_response("This borrow is not open any more", status.HTTP_409_CONFLICT)
+        raise HTTPException(status_code=404, detail="Transaction not found or already returned")
+    await db.commit()
+    metrics.BOOKS_RETURNED.inc("staff")
+
+    if fragments.wants_fragment(request):
+        return fragments.removed_row_response()
+    return RedirectResponse(url="/dashboard", status_code=status.HTTP_303_SEE_OTHER)
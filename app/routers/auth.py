@@ -1,31 +1,50 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Request, Form
+from fastapi import APIRouter, Depends, status, Request, Form
 from fastapi.responses import HTMLResponse, RedirectResponse
-from fastapi.templating import Jinja2Templates
 from sqlalchemy.orm import Session
-from app import models, schemas, utils, database
-from datetime import timedelta
+from starlette.concurrency import run_in_threadpool
+from app import models, utils, database, security, metrics
+from app.templating import templates
 
 router = APIRouter(
     prefix="/auth",
     tags=["Authentication"]
 )
 
-templates = Jinja2Templates(directory="templates")
+# login and register are async so they can await the hashing process pool;
+# their (sync) database work runs on the threadpool, like sync handlers, so a
+# slow database never blocks the event loop.
+
+
+def _find_user(db: Session, email: str):
+    user = db.query(models.User.id, models.User.password_hash, models.User.is_staff).filter(models.User.email == email).first()
+    # End the read transaction so no pooled connection is held while hashing
+    db.rollback()
+    return user
+
+
+def _create_user(db: Session, email: str, password_hash: str, is_staff: bool) -> None:
+    db.add(models.User(email=email, password_hash=password_hash, is_staff=is_staff))
+    db.commit()
+
+
+def _save_hash(db: Session, user_id: int, password_hash: str) -> None:
+    db.query(models.User).filter(models.User.id == user_id).update({models.User.password_hash: password_hash}, synchronize_session=False)
+    db.commit()
+
 
 @router.get("/register", response_class=HTMLResponse)
 def register_page(request: Request):
     return templates.TemplateResponse("register.html", {"request": request})
 
 @router.post("/register")
-def register(
+async def register(
     request: Request,
     email: str = Form(...),
     password: str = Form(...),
     staff_pin: str = Form(None),
     db: Session = Depends(database.get_db)
 ):
-    user = db.query(models.User).filter(models.User.email == email).first()
-    if user:
+    if await run_in_threadpool(_find_user, db, email):
         return templates.TemplateResponse("register.html", {"request": request, "error": "Email already registered"})
 
     is_staff = False
@@ -35,11 +54,12 @@ def register(
         else:
             return templates.TemplateResponse("register.html", {"request": request, "error": "Invalid Staff PIN"})
 
-    hashed_password = utils.get_password_hash(password)
-    new_user = models.User(email=email, password_hash=hashed_password, is_staff=is_staff)
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    # bcrypt runs on the hashing process pool, not on a request thread
+    try:
+        hashed_password = await utils.get_password_hash_async(password)
+    except utils.HashingBusy:
+        return templates.TemplateResponse("register.html", {"request": request, "error": "Server busy, please try again"}, status_code=503)
+    await run_in_threadpool(_create_user, db, email, hashed_password, is_staff)
 
     return RedirectResponse(url="/auth/login", status_code=status.HTTP_303_SEE_OTHER)
 
@@ -48,26 +68,42 @@ def login_page(request: Request):
     return templates.TemplateResponse("login.html", {"request": request})
 
 @router.post("/login")
-def login(
+async def login(
     request: Request,
     email: str = Form(...),
     password: str = Form(...),
     db: Session = Depends(database.get_db)
 ):
-    user = db.query(models.User).filter(models.User.email == email).first()
-    if not user or not utils.verify_password(password, user.password_hash):
+    user = await run_in_threadpool(_find_user, db, email)
+    if not user:
+        metrics.LOGINS.inc("failure")
         return templates.TemplateResponse("login.html", {"request": request, "error": "Invalid credentials"})
 
-    # for simplicity we are using a cookie to store the user id and in a real production app, use JWT tokens
+    # bcrypt runs on the hashing process pool, not on a request thread
+    try:
+        valid, new_hash = await utils.verify_and_update_async(password, user.password_hash)
+    except utils.HashingBusy:
+        metrics.LOGINS.inc("rejected")
+        return templates.TemplateResponse("login.html", {"request": request, "error": "Server busy, please try again"}, status_code=503)
+    if not valid:
+        metrics.LOGINS.inc("failure")
+        return templates.TemplateResponse("login.html", {"request": request, "error": "Invalid credentials"})
+
+    # Transparently rehash when the stored hash uses an outdated cost
+    if new_hash:
+        await run_in_threadpool(_save_hash, db, user.id, new_hash)
+
+    # The session cookie holds a signed token, verified without a database lookup
     response = RedirectResponse(url="/", status_code=status.HTTP_303_SEE_OTHER)
     if user.is_staff:
         response = RedirectResponse(url="/dashboard", status_code=status.HTTP_303_SEE_OTHER)
     
-    response.set_cookie(key="user_id", value=str(user.id))
+    security.set_session_cookie(response, user.id)
+    metrics.LOGINS.inc("success")
     return response
 
 @router.get("/logout")
 def logout(request: Request):
     response = RedirectResponse(url="/auth/login", status_code=status.HTTP_303_SEE_OTHER)
-    response.delete_cookie("user_id")
+    security.clear_session_cookie(response)
     return response
@@ -1,32 +1,60 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Request, Form, UploadFile, File
-from fastapi.responses import HTMLResponse, RedirectResponse
-from fastapi.templating import Jinja2Templates
-from sqlalchemy.orm import Session, joinedload
-from app import models, schemas, database
-from typing import Optional
-from datetime import datetime, timedelta
-import shutil
-import os
+from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse
+from sqlalchemy.orm import Session
+from app import models, database, catalog, inventory, images, due, archive, page_cache, metrics, fragments, stock_feed, suggest, recommendations
+from app.templating import templates, invalidate_book
+from app.security import get_current_user
+from typing import Dict, List, Optional
+import logging
 
 router = APIRouter(
     prefix="/books",
     tags=["Books"]
 )
 
-templates = Jinja2Templates(directory="templates")
+logger = logging.getLogger(__name__)
 
-# Dependency to get current user from cookie
-def get_current_user(request: Request, db: Session = Depends(database.get_db)):
-    user_id = request.cookies.get("user_id")
-    if not user_id:
-        return None
-    return db.query(models.User).filter(models.User.id == int(user_id)).first()
 
 @router.get("/", response_class=HTMLResponse)
-def get_books(request: Request, error: Optional[str] = None, db: Session = Depends(database.get_db)):
-    books = db.query(models.Book).all()
+def get_books(
+    request: Request,
+    q: Optional[str] = None,
+    error: Optional[str] = None,
+    sort: Optional[str] = None,
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+    limit: Optional[int] = None,
+    db: Session = Depends(database.get_read_db)
+):
     user = get_current_user(request, db)
-    return templates.TemplateResponse("index.html", {"request": request, "books": books, "user": user, "error": error})
+    return page_cache.catalog_response(db, request, user, q=q, error=error, sort=sort, after=after, before=before, limit=limit)
+
+@router.get("/stock-stream")
+def stock_stream(request: Request, db: Session = Depends(database.get_read_db)):
+    """
+    Server-sent events with the re-rendered cards of books whose stock or
+    details change, for open catalog pages.
+    """
+    user = get_current_user(request, db)
+    staff = bool(user and user.is_staff)
+    # Give the connection back now rather than when the stream ends
+    db.close()
+    return StreamingResponse(
+        stock_feed.stream(staff),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/suggest")
+def suggest_books(q: str = "", limit: Optional[int] = None, db: Session = Depends(database.get_read_db)):
+    """
+    Autocomplete for the search box: titles and authors starting with q,
+    answered from the in-process prefix index without a query.
+    """
+    suggest.index.ensure(db)
+    limit = min(max(limit or suggest.SUGGEST_LIMIT, 1), suggest.SUGGEST_MAX_LIMIT)
+    titles, authors = suggest.index.lookup(q, limit)
+    return {"titles": [{"id": book_id, "title": title} for book_id, title in titles], "authors": authors}
 
 @router.post("/add")
 async def add_book(
@@ -43,13 +71,7 @@ async def add_book(
     if not user or not user.is_staff:
         raise HTTPException(status_code=403, detail="Not authorized")
 
-    # Save image
-    file_location = f"static/images/{image.filename}"
-    os.makedirs(os.path.dirname(file_location), exist_ok=True)
-    with open(file_location, "wb+") as file_object:
-        shutil.copyfileobj(image.file, file_object)
-    
-    image_url = f"/static/images/{image.filename}"
+    image_url = await images.save_cover(image)
 
     new_book = models.Book(
         title=title,
@@ -60,113 +82,160 @@ async def add_book(
         image_url=image_url
     )
     db.add(new_book)
+    catalog.bump_version(db)
     db.commit()
-    
+    suggest.index.update(new_book.id, title, author)
+
     return RedirectResponse(url="/dashboard", status_code=status.HTTP_303_SEE_OTHER)
 
 @router.post("/buy/{book_id}")
 def buy_book(book_id: int, request: Request, db: Session = Depends(database.get_db)):
     user = get_current_user(request, db)
+    fragment = fragments.wants_fragment(request)
     if not user:
-        return RedirectResponse(url="/auth/login", status_code=status.HTTP_303_SEE_OTHER)
+        return fragments.login_redirect() if fragment else RedirectResponse(url="/auth/login", status_code=status.HTTP_303_SEE_OTHER)
 
-    book = db.query(models.Book).filter(models.Book.id == book_id).first()
-    if not book or book.quantity < 1:
+    # Reserve a copy atomically and record the sale in the same DB transaction
+    if inventory.buy(db, user.id, book_id) is None:
+        if fragment:
+            return fragments.card_response(db, book_id, "This book is out of stock", status.HTTP_409_CONFLICT)
         # Handle out of stock (flash message ideally, but simple redirect for now)
         return RedirectResponse(url="/", status_code=status.HTTP_303_SEE_OTHER)
-
-    # Create Transaction
-    transaction = models.Transaction(
-        user_id=user.id,
-        book_id=book.id,
-        transaction_type="buy",
-        amount=book.price
-    )
-    
-    # Update Stock
-    book.quantity -= 1
-    
-    db.add(transaction)
     db.commit()
-    
+    metrics.BOOKS_BOUGHT.inc()
+
+    # Only the card changed; the full page would re-render the whole catalog
+    if fragment:
+        return fragments.card_response(db, book_id)
     return RedirectResponse(url="/", status_code=status.HTTP_303_SEE_OTHER)
 
 @router.post("/borrow/{book_id}")
 def borrow_book(book_id: int, request: Request, db: Session = Depends(database.get_db)):
     user = get_current_user(request, db)
+    fragment = fragments.wants_fragment(request)
     if not user:
-        return RedirectResponse(url="/auth/login", status_code=status.HTTP_303_SEE_OTHER)
-        
-    book = db.query(models.Book).filter(models.Book.id == book_id).first()
-    if not book or book.quantity < 1:
-        return RedirectResponse(url="/", status_code=status.HTTP_303_SEE_OTHER)
+        return fragments.login_redirect() if fragment else RedirectResponse(url="/auth/login", status_code=status.HTTP_303_SEE_OTHER)
 
-    # Check if user already has this book borrowed and not returned
-    existing_borrow = db.query(models.Transaction).filter(
-        models.Transaction.user_id == user.id,
-        models.Transaction.book_id == book_id,
-        models.Transaction.transaction_type == "borrow",
-        models.Transaction.is_returned == False
-    ).first()
-
-    if existing_borrow:
+    try:
+        transaction = inventory.borrow(db, user.id, book_id)
+    except inventory.AlreadyBorrowed:
         # Prevent double borrowing
+        if fragment:
+            return fragments.card_response(db, book_id, "You have already borrowed this book", status.HTTP_409_CONFLICT)
         return RedirectResponse(url="/?error=You have already borrowed this book", status_code=status.HTTP_303_SEE_OTHER)
 
-    # Create Transaction
-    due_date = datetime.now() + timedelta(days=14) # 2 weeks borrow period
-    transaction = models.Transaction(
-        user_id=user.id,
-        book_id=book.id,
-        transaction_type="borrow",
-        amount=0, # No cost for borrowing initially
-        due_date=due_date
-    )
-    
-    # Update Stock
-    book.quantity -= 1
-    
-    db.add(transaction)
+    if transaction is None:
+        if fragment:
+            return fragments.card_response(db, book_id, "This book is out of stock", status.HTTP_409_CONFLICT)
+        return RedirectResponse(url="/", status_code=status.HTTP_303_SEE_OTHER)
     db.commit()
-    
+    metrics.BOOKS_BORROWED.inc()
+
+    if fragment:
+        return fragments.card_response(db, book_id)
     return RedirectResponse(url="/", status_code=status.HTTP_303_SEE_OTHER)
 
+CHECKOUT_REASONS = {
+    inventory.NOT_FOUND: "not found",
+    inventory.OUT_OF_STOCK: "out of stock",
+    inventory.ALREADY_BORROWED: "already borrowed",
+}
+
+
+def checkout_error(failed: Dict[int, str], partial: bool) -> str:
+    """
+    Message for the catalog page summarising why books were not checked out.
+    """
+    counts: Dict[str, int] = {}
+    for reason in failed.values():
+        counts[reason] = counts.get(reason, 0) + 1
+    summary = ", ".join(f"{count} {CHECKOUT_REASONS[reason]}" for reason, count in counts.items())
+    prefix = "Some books were not checked out" if partial else "Nothing was checked out"
+    return f"{prefix}: {summary}"
+
+
+@router.post("/checkout")
+def checkout_books(
+    request: Request,
+    action: str = Form(...),
+    book_ids: List[int] = Form([]),
+    partial: bool = Form(False),
+    db: Session = Depends(database.get_db)
+):
+    """
+    Buy or borrow all the books ticked in the catalog in one DB transaction.
+    """
+    user = get_current_user(request, db)
+    if not user:
+        return RedirectResponse(url="/auth/login", status_code=status.HTTP_303_SEE_OTHER)
+    if action not in ("buy", "borrow"):
+        raise HTTPException(status_code=400, detail="Unknown action")
+    if not book_ids:
+        return RedirectResponse(url="/?error=Select the books to check out first", status_code=status.HTTP_303_SEE_OTHER)
+    if len(book_ids) > inventory.CHECKOUT_MAX_BOOKS:
+        return RedirectResponse(url=f"/?error=At most {inventory.CHECKOUT_MAX_BOOKS} books can be checked out at once", status_code=status.HTTP_303_SEE_OTHER)
+
+    result = inventory.checkout(db, user.id, book_ids, action, partial=partial)
+    if result.transactions:
+        db.commit()
+        (metrics.BOOKS_BOUGHT if action == "buy" else metrics.BOOKS_BORROWED).inc(amount=len(result.transactions))
+
+    if result.failed:
+        return RedirectResponse(url=f"/?error={checkout_error(result.failed, partial)}", status_code=status.HTTP_303_SEE_OTHER)
+    return RedirectResponse(url="/books/my-books", status_code=status.HTTP_303_SEE_OTHER)
+
 @router.get("/my-books", response_class=HTMLResponse)
-def my_books(request: Request, db: Session = Depends(database.get_db)):
+def my_books(
+    request: Request,
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+    limit: Optional[int] = None,
+    db: Session = Depends(database.get_read_db)
+):
+    """
+    A member's active borrows, then one page of their finished purchases and
+    borrows (including archived ones), newest first, and books that members
+    with the same books also borrowed.
+    """
     user = get_current_user(request, db)
     if not user:
         return RedirectResponse(url="/auth/login", status_code=status.HTTP_303_SEE_OTHER)
-    
-    transactions = db.query(models.Transaction).options(joinedload(models.Transaction.book)).filter(models.Transaction.user_id == user.id).order_by(models.Transaction.created_at.desc()).all()
-    
-    return templates.TemplateResponse("my_books.html", {"request": request, "transactions": transactions, "user": user, "now": datetime.now().astimezone(), "timedelta": timedelta})
+
+    active = archive.open_borrows(db, user.id)
+    page = archive.history_page(db, user.id, after=after, before=before, limit=limit)
+    # Overdue / due soon flags come from the background overdue scanner
+    due_states = due.states_for_user(db, user.id) if active else {}
+    shown = [t.book_id for t in active] + [t.book_id for t in page.items]
+    also = recommendations.for_member(db, shown, recommendations.member_book_ids(db, user.id)) if shown else []
+
+    return templates.TemplateResponse("my_books.html", {
+        "request": request,
+        "active": active,
+        "history": page.items,
+        "due_states": due_states,
+        "also": also,
+        "user": user,
+        **catalog.page_links(request, page)
+    })
 
 @router.post("/return/{transaction_id}")
 def return_book_user(transaction_id: int, request: Request, db: Session = Depends(database.get_db)):
     user = get_current_user(request, db)
+    fragment = fragments.wants_fragment(request)
     if not user:
-        return RedirectResponse(url="/auth/login", status_code=status.HTTP_303_SEE_OTHER)
+        return fragments.login_redirect() if fragment else RedirectResponse(url="/auth/login", status_code=status.HTTP_303_SEE_OTHER)
 
-    transaction = db.query(models.Transaction).filter(
-        models.Transaction.id == transaction_id,
-        models.Transaction.user_id == user.id,
-        models.Transaction.transaction_type == "borrow",
-        models.Transaction.is_returned == False
-    ).first()
-
-    if not transaction:
+    # Close the borrow and restock the book in one DB transaction
+    if inventory.give_back(db, transaction_id, user_id=user.id) is None:
+        if fragment:
+            return fragments.returned_row_response(db, user.id, transaction_id, "This book was already returned", status.HTTP_409_CONFLICT)
         raise HTTPException(status_code=404, detail="Transaction not found or already returned")
 
-    transaction.is_returned = True
-    transaction.return_date = datetime.now()
-
-    # Restock book
-    book = db.query(models.Book).filter(models.Book.id == transaction.book_id).first()
-    if book:
-        book.quantity += 1
-    
     db.commit()
+    metrics.BOOKS_RETURNED.inc("member")
 
+    if fragment:
+        return fragments.returned_row_response(db, user.id, transaction_id)
     return RedirectResponse(url="/books/my-books", status_code=status.HTTP_303_SEE_OTHER)
 
 @router.get("/edit/{book_id}", response_class=HTMLResponse)
@@ -208,13 +277,12 @@ async def edit_book(
     book.description = description
 
     if image and image.filename:
-        file_location = f"static/images/{image.filename}"
-        os.makedirs(os.path.dirname(file_location), exist_ok=True)
-        with open(file_location, "wb+") as file_object:
-            shutil.copyfileobj(image.file, file_object)
-        book.image_url = f"/static/images/{image.filename}"
+        book.image_url = await images.save_cover(image)
     
+    catalog.bump_version(db)
     db.commit()
+    invalidate_book(book_id)
+    suggest.index.update(book_id, title, author)
     return RedirectResponse(url="/", status_code=status.HTTP_303_SEE_OTHER)
 
 @router.post("/delete/{book_id}")
@@ -229,10 +297,13 @@ def delete_book(book_id: int, request: Request, db: Session = Depends(database.g
     
     try:
         db.delete(book)
+        catalog.bump_version(db, deleted=True)
         db.commit()
-    except Exception as e:
+        invalidate_book(book_id)
+        suggest.index.remove(book_id)
+    except Exception:
         db.rollback()
         # If deletion fails (likely due to FK), we could flash a message, but for now redirect.
-        print(f"Delete failed: {e}")
+        logger.exception("could not delete book %s", book_id)
         
     return RedirectResponse(url="/", status_code=status.HTTP_303_SEE_OTHER)
@@ -1,77 +1,67 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Request, Form
-from fastapi.responses import HTMLResponse, RedirectResponse
-from fastapi.templating import Jinja2Templates
-from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import func
-from app import models, database
-from datetime import datetime, timedelta
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Form, UploadFile, File
+from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse
+from sqlalchemy.orm import Session
+from app import models, database, inventory, rollups, bulk, due, page_cache, metrics, fragments
+from app.templating import templates
+from app.security import get_current_user, invalidate_user
+import io
 
 router = APIRouter(
     prefix="/dashboard",
     tags=["Dashboard"]
 )
 
-templates = Jinja2Templates(directory="templates")
 
-def get_current_user(request: Request, db: Session = Depends(database.get_db)):
-    user_id = request.cookies.get("user_id")
-    if not user_id:
-        return None
-    return db.query(models.User).filter(models.User.id == int(user_id)).first()
-
-@router.get("/", response_class=HTMLResponse)
-def get_dashboard(request: Request, db: Session = Depends(database.get_db)):
-    user = get_current_user(request, db)
-    if not user or not user.is_staff:
-        return RedirectResponse(url="/auth/login", status_code=status.HTTP_303_SEE_OTHER)
-
-    # --- Analytics Logic ---
-    
-    # 1. Sales Visuals (Total Money, Total Books Sold)
-    total_sales_amount = db.query(func.sum(models.Transaction.amount)).filter(models.Transaction.transaction_type == "buy").scalar() or 0.0
-    total_books_sold = db.query(func.count(models.Transaction.id)).filter(models.Transaction.transaction_type == "buy").scalar() or 0
+def dashboard_context(db: Session) -> dict:
+    """
+    Gather the analytics shown on the staff dashboard.
+    Everything the template touches is loaded eagerly, so this also runs under AsyncSession.run_sync.
+    """
+    # 1. Sales Visuals (Total Money, Total Books Sold), summed from the daily rollups
+    # (all time, or the last SALES_TOTALS_DAYS days when that is set)
+    total_sales_amount, total_books_sold = rollups.sales_totals(db)
     
     # 2. High Demand Books (Sold in past 3 days)
-    three_days_ago = datetime.now() - timedelta(days=3)  # A timedelta is a Python object that represents a duration, or the difference between two dates or times.
-    high_demand_books = db.query(
-        models.Book,
-        func.count(models.Transaction.id).label("sales_count")
-    ).join(models.Transaction).filter(
-        models.Transaction.transaction_type == "buy",
-        models.Transaction.created_at >= three_days_ago
-    ).group_by(models.Book.id).order_by(func.count(models.Transaction.id).desc()).limit(5).all()
+    high_demand_books = rollups.high_demand_books(db, days=3, limit=5)
 
     # 3. Low Stock Books (Quantity < 5)
     low_stock_books = db.query(models.Book).filter(models.Book.quantity < 5).all()
 
     # 4. Overdue/Deadline Tracking
-    # People who have missed deadlines or are close (due within 2 days)
-    now = datetime.now()
-    two_days_from_now = now + timedelta(days=2)
-    
-    overdue_transactions = db.query(models.Transaction).options(joinedload(models.Transaction.user), joinedload(models.Transaction.book)).filter(
-        models.Transaction.transaction_type == "borrow",
-        models.Transaction.is_returned == False,
-        models.Transaction.due_date < now
-    ).all()
-    
-    upcoming_due_transactions = db.query(models.Transaction).options(joinedload(models.Transaction.user), joinedload(models.Transaction.book)).filter(
-        models.Transaction.transaction_type == "borrow",
-        models.Transaction.is_returned == False,
-        models.Transaction.due_date >= now,
-        models.Transaction.due_date <= two_days_from_now
-    ).all()
-
-    return templates.TemplateResponse("dashboard.html", {
-        "request": request,
-        "user": user,
+    # People who have missed deadlines or are close (due within 2 days),
+    # as classified by the background overdue scanner
+    overdue_transactions = due.borrows_in_state(db, due.OVERDUE)
+    upcoming_due_transactions = due.borrows_in_state(db, due.DUE_SOON)
+
+    return {
         "total_sales_amount": total_sales_amount,
         "total_books_sold": total_books_sold,
+        "sales_days": rollups.SALES_TOTALS_DAYS,
         "high_demand_books": high_demand_books,
         "low_stock_books": low_stock_books,
         "overdue_transactions": overdue_transactions,
         "upcoming_due_transactions": upcoming_due_transactions
-    })
+    }
+
+@router.get("/", response_class=HTMLResponse)
+def get_dashboard(request: Request, db: Session = Depends(database.get_read_db)):
+    user = get_current_user(request, db)
+    if not user or not user.is_staff:
+        return RedirectResponse(url="/auth/login", status_code=status.HTTP_303_SEE_OTHER)
+
+    # --- Analytics Logic ---
+    context = dashboard_context(db)
+    return templates.TemplateResponse("dashboard.html", {"request": request, "user": user, **context})
+
+@router.get("/cache-stats")
+def cache_stats(request: Request, db: Session = Depends(database.get_read_db)):
+    """
+    Hit/miss counters of this worker's page, card and user caches.
+    """
+    user = get_current_user(request, db)
+    if not user or not user.is_staff:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    return page_cache.stats()
 
 @router.post("/return/{transaction_id}")
 def return_book(transaction_id: int, request: Request, db: Session = Depends(database.get_db)):
@@ -79,26 +69,21 @@ def return_book(transaction_id: int, request: Request, db: Session = Depends(dat
     if not user or not user.is_staff:
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    transaction = db.query(models.Transaction).filter(models.Transaction.id == transaction_id).first()
-    if not transaction or transaction.transaction_type != "borrow":
-        raise HTTPException(status_code=404, detail="Transaction not found")
-    
-    transaction.is_returned = True
-    transaction.return_date = datetime.now()
-    
-    # Restock book
-    book = db.query(models.Book).filter(models.Book.id == transaction.book_id).first()
-    if book:
-        book.quantity += 1
+    # Close the borrow and restock the book in one DB transaction
+    if inventory.give_back(db, transaction_id) is None:
+        if fragments.wants_fragment(request):
+            return fragments.removed_row_response("This borrow is not open any more", status.HTTP_409_CONFLICT)
+        raise HTTPException(status_code=404, detail="Transaction not found or already returned")
         
     db.commit()
-    
-    return RedirectResponse(url="/dashboard", status_code=status.HTTP_303_SEE_OTHER)
-    
+    metrics.BOOKS_RETURNED.inc("staff")
+
+    if fragments.wants_fragment(request):
+        return fragments.removed_row_response()
     return RedirectResponse(url="/dashboard", status_code=status.HTTP_303_SEE_OTHER)
 
 @router.get("/users", response_class=HTMLResponse)
-def get_users(request: Request, db: Session = Depends(database.get_db)):
+def get_users(request: Request, db: Session = Depends(database.get_read_db)):
     user = get_current_user(request, db)
     if not user or not user.is_staff:
         return RedirectResponse(url="/auth/login", status_code=status.HTTP_303_SEE_OTHER)
@@ -137,6 +122,7 @@ def edit_user(
     target_user.email = email
     target_user.is_staff = is_staff
     db.commit()
+    invalidate_user(user_id)
     
     return RedirectResponse(url="/dashboard/users", status_code=status.HTTP_303_SEE_OTHER)
 
@@ -152,5 +138,51 @@ def delete_user(user_id: int, request: Request, db: Session = Depends(database.g
         
     db.delete(target_user)
     db.commit()
+    invalidate_user(user_id)
     
     return RedirectResponse(url="/dashboard/users", status_code=status.HTTP_303_SEE_OTHER)
+
+@router.post("/import")
+def import_catalog(
+    request: Request,
+    file: UploadFile = File(...),
+    format: str = Form(None),
+    db: Session = Depends(database.get_db)
+):
+    """
+    Upsert books from an uploaded CSV or JSONL file and report invalid rows.
+    """
+    user = get_current_user(request, db)
+    if not user or not user.is_staff:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    if format not in (None, *bulk.FORMATS):
+        raise HTTPException(status_code=400, detail="Unsupported format")
+
+    # The upload is already spooled to a temporary file; read it line by line
+    stream = io.TextIOWrapper(file.file, encoding="utf-8-sig", newline="")
+    try:
+        report = bulk.import_books(db, bulk.read_rows(stream, format or bulk.detect_format(file.filename)))
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="File is not UTF-8 text")
+    finally:
+        stream.detach()
+    return report.as_dict()
+
+@router.get("/export/{kind}")
+def export_table(kind: str, request: Request, format: str = "csv", db: Session = Depends(database.get_read_db)):
+    """
+    Stream all books or transactions as CSV or JSONL.
+    """
+    user = get_current_user(request, db)
+    if not user or not user.is_staff:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    if kind not in bulk.EXPORTS or format not in bulk.FORMATS:
+        raise HTTPException(status_code=404, detail="Unknown export")
+
+    # The export opens its own session on the same engine, since the request's
+    # session is closed before the response body is streamed.
+    return StreamingResponse(
+        bulk.export_rows(db.get_bind(), kind, format),
+        media_type=bulk.MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{kind}.{format}"'}
+    )
@@ -0,0 +1,180 @@
+from datetime import datetime, timedelta, timezone
+from typing import Callable, List
+from sqlalchemy import insert, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from app import models, due, archive, recommendations
+import asyncio
+import logging
+import os
+import socket
+import uuid
+
+# Periodic background jobs, started from the application lifespan. Every
+# worker process runs the loop, but a job only runs in the worker holding its
+# lease in job_leases; if that worker dies the lease expires and another
+# worker takes over. Leases are short (at most JOB_LEASE_TTL seconds) and the
+# holder renews its lease every third of that, between runs and while a run
+# is in progress, so a long job keeps its lease and a dead holder's lease
+# runs out in seconds rather than hours.
+
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "1") == "1"
+OVERDUE_SCAN_INTERVAL = float(os.getenv("OVERDUE_SCAN_INTERVAL", "300"))
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL", str(24 * 3600)))
+# Longest a lease lasts without being renewed
+JOB_LEASE_TTL = float(os.getenv("JOB_LEASE_TTL", "60"))
+
+# Identifies this worker process as a lease holder
+HOLDER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+logger = logging.getLogger(__name__)
+
+
+def acquire_lease(db: Session, name: str, holder: str, ttl: float) -> bool:
+    """
+    Take or renew the lease on a job. Returns False while another holder's lease is valid.
+    """
+    now = datetime.now(timezone.utc)
+    expires_at = now + timedelta(seconds=ttl)
+    renewed = db.execute(
+        update(models.JobLease)
+        .where(models.JobLease.name == name, (models.JobLease.holder == holder) | (models.JobLease.expires_at < now))
+        .values(holder=holder, expires_at=expires_at)
+        .execution_options(synchronize_session=False)
+    )
+    if renewed.rowcount:
+        db.commit()
+        return True
+    # No lease we could take: create it unless it exists (held by a live
+    # worker). Losing that race is the normal case for every worker but the
+    # holder, so it must not be an error in the database log.
+    dialects = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+    dialect_name = db.get_bind().dialect.name
+    if dialect_name in dialects:
+        created = db.execute(
+            dialects[dialect_name](models.JobLease)
+            .values(name=name, holder=holder, expires_at=expires_at)
+            .on_conflict_do_nothing(index_elements=[models.JobLease.name])
+        )
+        db.commit()
+        return bool(created.rowcount)
+
+    # Portable fallback: only try the insert when there is no lease row yet
+    if db.query(models.JobLease.name).filter(models.JobLease.name == name).first() is not None:
+        db.rollback()
+        return False
+    try:
+        db.execute(insert(models.JobLease).values(name=name, holder=holder, expires_at=expires_at))
+        db.commit()
+        return True
+    except IntegrityError:
+        # Another worker created it first
+        db.rollback()
+        return False
+
+
+def release_lease(db: Session, name: str, holder: str) -> None:
+    db.execute(
+        update(models.JobLease)
+        .where(models.JobLease.name == name, models.JobLease.holder == holder)
+        .values(expires_at=datetime.now(timezone.utc))
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+
+
+def lease_ttl(interval: float) -> float:
+    """
+    Lease TTL of a job run every `interval` seconds: a couple of missed
+    renewals, and never more than JOB_LEASE_TTL.
+    """
+    return min(interval * 2.5, JOB_LEASE_TTL)
+
+
+def renew_lease(session_factory, name: str, ttl: float) -> bool:
+    db = session_factory()
+    try:
+        return acquire_lease(db, name, HOLDER, ttl)
+    finally:
+        db.close()
+
+
+def run_job(session_factory, name: str, func: Callable[[Session], object], ttl: float) -> bool:
+    """
+    Run func(db) and commit if this process holds (or can take) the job's lease.
+    Returns whether the job ran.
+    """
+    db = session_factory()
+    try:
+        if not acquire_lease(db, name, HOLDER, ttl):
+            return False
+        result = func(db)
+        db.commit()
+        logger.debug("job %s: %s", name, result)
+        return True
+    finally:
+        db.close()
+
+
+async def run_periodically(session_factory, name: str, func: Callable[[Session], object], interval: float) -> None:
+    ttl = lease_ttl(interval)
+    renew_every = ttl / 3
+    loop = asyncio.get_running_loop()
+    next_run = loop.time()
+    while True:
+        try:
+            if loop.time() >= next_run:
+                job = asyncio.ensure_future(run_in_threadpool(run_job, session_factory, name, func, ttl))
+                # Keep the lease while the job runs
+                while not (await asyncio.wait({job}, timeout=renew_every))[0]:
+                    if not await run_in_threadpool(renew_lease, session_factory, name, ttl):
+                        logger.warning("background job %s lost its lease while running", name)
+                # Workers without the lease try again at the next renewal, to
+                # take over as soon as the holder's lease expires
+                if job.result():
+                    next_run = loop.time() + interval
+            else:
+                # Keep the lease between runs
+                await run_in_threadpool(renew_lease, session_factory, name, ttl)
+        except Exception:
+            logger.exception("background job %s failed", name)
+            if next_run <= loop.time():
+                # The run failed; try again at the next interval
+                next_run = loop.time() + interval
+        delay = next_run - loop.time()
+        await asyncio.sleep(delay if 0 < delay < renew_every else renew_every)
+
+
+# (name, function taking a session, interval in seconds)
+JOBS = [
+    ("overdue-scan", due.scan, OVERDUE_SCAN_INTERVAL),
+    ("archive-transactions", archive.archive, ARCHIVE_INTERVAL),
+    ("recommendations", recommendations.refresh, recommendations.RECOMMENDATIONS_INTERVAL),
+]
+
+
+def start(session_factory) -> List[asyncio.Task]:
+    """
+    Start every job's loop on the running event loop.
+    """
+    if not SCHEDULER_ENABLED:
+        return []
+    return [asyncio.create_task(run_periodically(session_factory, name, func, interval)) for name, func, interval in JOBS]
+
+
+async def stop(session_factory, tasks: List[asyncio.Task]) -> None:
+    """
+    Cancel the job loops and hand the leases over to the other workers.
+    """
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    if tasks:
+        db = session_factory()
+        try:
+            for name, _, _ in JOBS:
+                await run_in_threadpool(release_lease, db, name, HOLDER)
+        finally:
+            db.close()
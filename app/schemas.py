@@ -1,5 +1,5 @@
-from pydantic import BaseModel, EmailStr
-from typing import Optional, List
+from pydantic import BaseModel, ConfigDict, EmailStr, Field
+from typing import Literal, Optional, List
 from datetime import datetime
 
 # --- User Schemas ---
@@ -18,8 +18,7 @@ class UserResponse(UserBase):
     is_staff: bool
     created_at: datetime
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 # --- Book Schemas ---
 class BookBase(BaseModel):
@@ -39,9 +38,14 @@ class BookUpdate(BookBase):
 class BookResponse(BookBase):
     id: int
     created_at: datetime
+    updated_at: Optional[datetime] = None
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
+
+class BookPage(BaseModel):
+    items: List[BookResponse]
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
 
 # --- Transaction Schemas ---
 class TransactionBase(BaseModel):
@@ -60,5 +64,23 @@ class TransactionResponse(TransactionBase):
     is_returned: bool
     created_at: datetime
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
+
+class TransactionPage(BaseModel):
+    items: List[TransactionResponse]
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
+
+# --- Batch Checkout Schemas ---
+class CheckoutRequest(BaseModel):
+    book_ids: List[int] = Field(min_length=1)
+    action: Literal["buy", "borrow"]
+    partial: bool = False # check out what is available instead of all or nothing
+
+class CheckoutFailure(BaseModel):
+    book_id: int
+    reason: str # 'not_found', 'out_of_stock' or 'already_borrowed'
+
+class CheckoutResponse(BaseModel):
+    transactions: List[TransactionResponse]
+    failed: List[CheckoutFailure] = []
@@ -0,0 +1,186 @@
+from typing import List, Optional, Tuple
+from sqlalchemy import DDL, cast, event, func, inspect, literal_column, or_, false
+from sqlalchemy.dialects.postgresql import DOUBLE_PRECISION
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import column, table
+from app import models
+from app.pagination import Page, SortKey, clamp_page_size, paginate
+import re
+import sys
+
+# Words are matched as prefixes, so "harr pot" finds "Harry Potter"
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+MAX_TOKENS = 8
+
+
+def tokenize(q: str) -> List[str]:
+    """
+    Split a raw search string into the words used for matching.
+    """
+    return TOKEN_RE.findall(q.lower())[:MAX_TOKENS]
+
+
+class SearchBackend:
+    """
+    Base class for catalog search backends.
+    apply() restricts a Book query to the matches of a search string and returns
+    the keyset ordering (best match first) used to paginate the results.
+    """
+    name = "base"
+
+    def apply(self, query, q: str) -> Tuple[object, List[SortKey]]:
+        raise NotImplementedError
+
+
+class LikeSearchBackend(SearchBackend):
+    """
+    Unindexed substring search, used when no full-text index is available.
+    """
+    name = "like"
+
+    def apply(self, query, q):
+        search = f"%{q}%"
+        query = query.filter(or_(models.Book.title.ilike(search), models.Book.author.ilike(search), models.Book.description.ilike(search)))
+        return query, [SortKey(models.Book.title), SortKey(models.Book.id)]
+
+
+# --- SQLite: FTS5 external content table kept in sync by triggers ---
+
+books_fts = table("books_fts", column("rowid"))
+
+SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5("
+    "title, author, description, content='books', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    "CREATE TRIGGER IF NOT EXISTS books_fts_ai AFTER INSERT ON books BEGIN "
+    "INSERT INTO books_fts(rowid, title, author, description) VALUES (new.id, new.title, new.author, new.description); END",
+    "CREATE TRIGGER IF NOT EXISTS books_fts_ad AFTER DELETE ON books BEGIN "
+    "INSERT INTO books_fts(books_fts, rowid, title, author, description) VALUES ('delete', old.id, old.title, old.author, old.description); END",
+    # Only text columns are indexed, so stock updates never touch the index
+    "CREATE TRIGGER IF NOT EXISTS books_fts_au AFTER UPDATE OF title, author, description ON books BEGIN "
+    "INSERT INTO books_fts(books_fts, rowid, title, author, description) VALUES ('delete', old.id, old.title, old.author, old.description); "
+    "INSERT INTO books_fts(rowid, title, author, description) VALUES (new.id, new.title, new.author, new.description); END",
+]
+
+
+class SQLiteFTSBackend(SearchBackend):
+    """
+    SQLite FTS5 backend ranked by bm25, weighting title over author over description.
+    """
+    name = "sqlite-fts5"
+
+    def apply(self, query, q):
+        tokens = tokenize(q)
+        if not tokens:
+            return query.filter(false()), [SortKey(models.Book.id)]
+
+        match = " ".join('"{}"*'.format(token.replace('"', '""')) for token in tokens)
+        rank = func.bm25(literal_column("books_fts"), 10.0, 5.0, 1.0)
+        query = query.join(books_fts, books_fts.c.rowid == models.Book.id).filter(literal_column("books_fts").match(match))
+        # bm25 is negative and smaller is better
+        return query, [SortKey(rank), SortKey(models.Book.id)]
+
+
+# --- PostgreSQL: weighted tsvector (GIN) plus trigram indexes for substring matches ---
+
+def _vector_sql(prefix: str = "") -> str:
+    parts = [
+        f"setweight(to_tsvector('simple'::regconfig, coalesce({prefix}{name}, '')), '{weight}')"
+        for name, weight in (("title", "A"), ("author", "B"), ("description", "C"))
+    ]
+    return " || ".join(parts)
+
+
+POSTGRES_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    f"CREATE INDEX IF NOT EXISTS ix_books_search_vector ON books USING gin (({_vector_sql()}))",
+    "CREATE INDEX IF NOT EXISTS ix_books_title_trgm ON books USING gin (title gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_books_author_trgm ON books USING gin (author gin_trgm_ops)",
+]
+
+
+class PostgresSearchBackend(SearchBackend):
+    """
+    PostgreSQL full-text backend ranked by ts_rank with prefix matching.
+    Plain substring matches on title/author are also returned (served by the trigram indexes).
+    """
+    name = "postgresql-tsvector"
+
+    def apply(self, query, q):
+        tokens = tokenize(q)
+        if not tokens:
+            return query.filter(false()), [SortKey(models.Book.id)]
+
+        vector = literal_column(_vector_sql("books."))
+        tsquery = func.to_tsquery(literal_column("'simple'::regconfig"), " & ".join(f"{token}:*" for token in tokens))
+        search = f"%{q}%"
+        query = query.filter(or_(
+            vector.op("@@")(tsquery),
+            models.Book.title.ilike(search),
+            models.Book.author.ilike(search),
+        ))
+        # ts_rank is a float4, which does not survive the round trip through a
+        # JSON cursor; as a float8 the cursor holds the exact value, so the same
+        # expression can be ordered on and compared against
+        rank = cast(func.ts_rank(vector, tsquery), DOUBLE_PRECISION)
+        return query, [SortKey(rank, descending=True), SortKey(models.Book.id)]
+
+
+# Create the search index together with the books table
+for statement in SQLITE_DDL:
+    event.listen(models.Book.__table__, "after_create", DDL(statement).execute_if(dialect="sqlite"))
+event.listen(models.Book.__table__, "after_drop", DDL("DROP TABLE IF EXISTS books_fts").execute_if(dialect="sqlite"))
+for statement in POSTGRES_DDL:
+    event.listen(models.Book.__table__, "after_create", DDL(statement).execute_if(dialect="postgresql"))
+
+_backends = {}
+
+
+def get_backend(db: Session) -> SearchBackend:
+    """
+    Pick the search backend for the database behind a session.
+    The choice is cached per engine URL.
+    """
+    bind = db.get_bind()
+    key = str(bind.url)
+    if key not in _backends:
+        if bind.dialect.name == "postgresql":
+            _backends[key] = PostgresSearchBackend()
+        elif bind.dialect.name == "sqlite" and inspect(bind).has_table("books_fts"):
+            _backends[key] = SQLiteFTSBackend()
+        else:
+            _backends[key] = LikeSearchBackend()
+    return _backends[key]
+
+
+def search_books(db: Session, q: str, keys: Optional[List[SortKey]] = None, after: Optional[str] = None, before: Optional[str] = None, limit: Optional[int] = None) -> Page:
+    """
+    Run a catalog search and return one page of ranked results.
+    Pass keys to order the matches by something other than relevance.
+    """
+    query, relevance = get_backend(db).apply(db.query(models.Book), q)
+    return paginate(query, keys or relevance, after=after, before=before, page_size=clamp_page_size(limit))
+
+
+def rebuild_index(bind) -> None:
+    """
+    Create the search index on an existing database and (re)populate it.
+    """
+    with bind.begin() as conn:
+        if conn.dialect.name == "sqlite":
+            for statement in SQLITE_DDL:
+                conn.exec_driver_sql(statement)
+            conn.exec_driver_sql("INSERT INTO books_fts(books_fts) VALUES ('rebuild')")
+        elif conn.dialect.name == "postgresql":
+            for statement in POSTGRES_DDL:
+                conn.exec_driver_sql(statement)
+    _backends.pop(str(bind.url), None)
+
+
+if __name__ == "__main__":
+    # Usage: python -m app.search rebuild
+    if sys.argv[1:] != ["rebuild"]:
+        sys.exit("usage: python -m app.search rebuild")
+    from app.database import engine
+    rebuild_index(engine)
+    print("Search index rebuilt")
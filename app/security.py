@@ -0,0 +1,162 @@
+from dataclasses import dataclass
+from typing import Optional
+from fastapi import Depends, Request
+from jose import JWTError, jwt
+from sqlalchemy.orm import Session
+from app import models, database
+from app.cache import TTLCache
+from datetime import datetime, timedelta, timezone
+import os
+import secrets
+
+# Session tokens are signed JWTs stored in a cookie.
+# SECRET_KEY should be set (and shared by all workers) in production. Without it
+# a random key is generated once and kept in SECRET_KEY_FILE, which every worker
+# on the host then reads, so there is never a well-known signing key.
+SECRET_KEY_FILE = os.getenv("SECRET_KEY_FILE", ".secret_key")
+
+
+def load_secret_key(path: str) -> str:
+    """
+    Read the signing key from path, creating it with a random key if it does not exist.
+    """
+    try:
+        with open(path) as f:
+            key = f.read().strip()
+    except FileNotFoundError:
+        key = ""
+    if key:
+        return key
+    # Write a private temporary file and link it into place: the link fails if
+    # another worker got there first, and then its key is used instead
+    tmp = f"{path}.{os.getpid()}.tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write(secrets.token_urlsafe(64))
+    try:
+        os.link(tmp, path)
+    except FileExistsError:
+        pass
+    finally:
+        os.unlink(tmp)
+    with open(path) as f:
+        return f.read().strip()
+
+
+SECRET_KEY = os.getenv("SECRET_KEY") or load_secret_key(SECRET_KEY_FILE)
+ALGORITHM = "HS256"
+SESSION_COOKIE = "session"
+SESSION_MAX_AGE = int(os.getenv("SESSION_MAX_AGE", str(7 * 24 * 3600)))
+
+# Per-process cache of the user fields needed to render pages
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
+
+
+@dataclass(frozen=True)
+class CurrentUser:
+    """
+    The logged in user as seen by request handlers and templates.
+    """
+    id: int
+    email: str
+    is_staff: bool
+
+
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+
+def create_session_token(user_id: int) -> str:
+    """
+    Issue a signed session token for a user.
+    """
+    expires = datetime.now(timezone.utc) + timedelta(seconds=SESSION_MAX_AGE)
+    return jwt.encode({"sub": str(user_id), "exp": expires}, SECRET_KEY, algorithm=ALGORITHM)
+
+
+def read_session_token(token: str) -> Optional[int]:
+    """
+    Verify a session token (signature and expiry) and return its user id.
+    No database access is needed.
+    """
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        return int(payload["sub"])
+    except (JWTError, KeyError, ValueError):
+        return None
+
+
+def load_user(db: Session, user_id: int) -> Optional[CurrentUser]:
+    """
+    Look a user up by id, going to the database only on a cache miss.
+    """
+    cached = user_cache.get(user_id)
+    if cached is not None:
+        return cached
+
+    row = db.query(models.User.id, models.User.email, models.User.is_staff).filter(models.User.id == user_id).first()
+    if not row:
+        return None
+    user = CurrentUser(id=row.id, email=row.email, is_staff=bool(row.is_staff))
+    user_cache.set(user_id, user)
+    return user
+
+
+def session_token(request: Request) -> Optional[str]:
+    """
+    The session token of a request: the session cookie, or an
+    "Authorization: Bearer" header for API clients without cookies.
+    """
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() == "bearer" and token:
+        return token.strip()
+    return request.cookies.get(SESSION_COOKIE)
+
+
+def get_current_user(request: Request, db: Session = Depends(database.get_db)) -> Optional[CurrentUser]:
+    """
+    Dependency returning the user of the current session, or None.
+    """
+    token = session_token(request)
+    if not token:
+        return None
+    user_id = read_session_token(token)
+    if user_id is None:
+        return None
+    return load_user(db, user_id)
+
+
+async def get_current_user_async(request: Request, db) -> Optional[CurrentUser]:
+    """
+    get_current_user for async handlers; takes an AsyncSession.
+    """
+    token = session_token(request)
+    user_id = read_session_token(token) if token else None
+    if user_id is None:
+        return None
+    cached = user_cache.get(user_id)
+    if cached is not None:
+        return cached
+    return await db.run_sync(load_user, user_id)
+
+
+def invalidate_user(user_id: int) -> None:
+    """
+    Drop a user from the cache after their record changed.
+    Other workers pick the change up when their entry expires (USER_CACHE_TTL).
+    """
+    user_cache.pop(user_id)
+
+
+def set_session_cookie(response, user_id: int) -> None:
+    response.set_cookie(
+        key=SESSION_COOKIE,
+        value=create_session_token(user_id),
+        max_age=SESSION_MAX_AGE,
+        httponly=True,
+        samesite="lax",
+    )
+
+
+def clear_session_cookie(response) -> None:
+    response.delete_cookie(SESSION_COOKIE)
@@ -0,0 +1,146 @@
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, List, Optional, Set, Tuple
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from app import models, catalog, database, recommendations
+from app.templating import book_card
+import asyncio
+import json
+import logging
+import os
+import time
+
+# Live stock updates for open catalog pages: GET /books/stock-stream is a
+# server-sent events stream that static/script.js reads with EventSource.
+# One poller per worker watches books.updated_at, which every edit and stock
+# change moves (one indexed range query every STOCK_STREAM_INTERVAL seconds,
+# however many pages are open). When the recently changed books differ from
+# the last poll, they are loaded once and every open page gets their
+# re-rendered cards, which it swaps in place. updated_at lives in the
+# database, so changes made through any worker show up.
+
+STOCK_STREAM_INTERVAL = float(os.getenv("STOCK_STREAM_INTERVAL", "2"))
+# Comment line sent on idle streams so proxies do not close them
+STOCK_STREAM_KEEPALIVE = float(os.getenv("STOCK_STREAM_KEEPALIVE", "15"))
+# Streams end after this many seconds and the browser reconnects, which
+# spreads them over the workers and lets a worker shut down gracefully
+STOCK_STREAM_MAX_AGE = float(os.getenv("STOCK_STREAM_MAX_AGE", "300"))
+# Changes committed this long before the newest one seen are looked at again,
+# in case a transaction that started earlier committed later
+CHANGE_OVERLAP = timedelta(seconds=5)
+# Updates queued per page; a page that falls further behind misses some
+QUEUE_SIZE = 100
+
+logger = logging.getLogger(__name__)
+
+
+class StockFeed:
+    """
+    Fans the catalog changes seen by one poller out to every connected page.
+    """
+
+    def __init__(self):
+        self.subscribers: Set[asyncio.Queue] = set()
+        self.task: Optional[asyncio.Task] = None
+        # Newest updated_at seen, and (count, newest) of the books changed
+        # within CHANGE_OVERLAP of it at the last poll
+        self.since = None
+        self.recent: Optional[tuple] = None
+
+    def poll(self, db: Session) -> List[models.Book]:
+        """
+        The books changed since the previous poll (none on the first one).
+        """
+        if self.since is None:
+            newest = db.query(func.max(models.Book.updated_at)).scalar()
+            self.since = catalog.as_utc(newest) or datetime.now(timezone.utc)
+            return []
+
+        window = models.Book.updated_at > self.since - CHANGE_OVERLAP
+        # A late commit inside the window changes the count even if not the newest
+        recent = tuple(db.query(func.count(models.Book.id), func.max(models.Book.updated_at)).filter(window).one())
+        if recent == self.recent:
+            return []
+
+        books = db.query(models.Book).filter(window).order_by(models.Book.updated_at).all()
+        if books:
+            self.since = max(self.since, catalog.as_utc(books[-1].updated_at))
+        in_window = [book for book in books if catalog.as_utc(book.updated_at) > self.since - CHANGE_OVERLAP]
+        self.recent = (len(in_window), in_window[-1].updated_at if in_window else None)
+        return books
+
+    def _poll_once(self) -> List[Tuple[models.Book, recommendations.Neighbours]]:
+        factory = database.ReadSessionLocal or database.SessionLocal
+        db = factory()
+        try:
+            books = self.poll(db)
+            also = recommendations.for_books(db, [book.id for book in books]) if books else {}
+            return [(book, also[book.id]) for book in books]
+        finally:
+            db.close()
+
+    async def run(self) -> None:
+        while True:
+            try:
+                books = await run_in_threadpool(self._poll_once)
+            except Exception:
+                logger.exception("stock feed poll failed")
+                books = []
+            if books:
+                self.publish(books)
+            await asyncio.sleep(STOCK_STREAM_INTERVAL)
+
+    def publish(self, books: List[Tuple[models.Book, recommendations.Neighbours]]) -> None:
+        for queue in self.subscribers:
+            try:
+                queue.put_nowait(books)
+            except asyncio.QueueFull:
+                pass
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.subscribers.add(queue)
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        self.subscribers.discard(queue)
+        # Stop polling while no page is listening
+        if not self.subscribers and self.task is not None:
+            self.task.cancel()
+            self.task = None
+            self.since = self.recent = None
+
+
+feed = StockFeed()
+
+
+def card_event(book: models.Book, staff: bool, also: recommendations.Neighbours = ()) -> str:
+    """
+    A server-sent event carrying the re-rendered card of a book.
+    """
+    data = json.dumps({"id": book.id, "html": str(book_card(book, staff, also))})
+    return f"event: card\ndata: {data}\n\n"
+
+
+async def stream(staff: bool) -> AsyncIterator[str]:
+    """
+    Body of one page's event stream, ending after STOCK_STREAM_MAX_AGE seconds.
+    """
+    queue = feed.subscribe()
+    deadline = time.monotonic() + STOCK_STREAM_MAX_AGE
+    try:
+        # Reconnect quickly once the stream ends
+        yield "retry: 1000\n\n"
+        while (remaining := deadline - time.monotonic()) > 0:
+            try:
+                books = await asyncio.wait_for(queue.get(), min(STOCK_STREAM_KEEPALIVE, remaining))
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            for book, also in books:
+                yield card_event(book, staff, also)
+    finally:
+        feed.unsubscribe(queue)
@@ -0,0 +1,261 @@
+from array import array
+from bisect import bisect_left, insort
+from datetime import timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from app import models, catalog, database
+from app.search import TOKEN_RE
+import asyncio
+import logging
+import os
+import threading
+import unicodedata
+
+# Title and author autocomplete (GET /books/suggest) from an in-process prefix
+# index, so typing in the search box never touches the database.
+#
+# Each worker keeps the normalized titles in a sorted list and answers a
+# prefix with one bisect plus a short scan; authors get a second sorted list
+# with one entry per distinct author. The index is built when the worker
+# starts and updated right away by the add, edit and delete handlers of that
+# worker. Every SUGGEST_SYNC_INTERVAL seconds it also picks up changes made
+# through other workers and imports, by watching the catalog version. Edits
+# and imports are read back by updated_at; deletes leave nothing to read, so
+# the books are only counted when the version's deletions counter moved.
+
+SUGGEST_LIMIT = int(os.getenv("SUGGEST_LIMIT", "8"))
+SUGGEST_MAX_LIMIT = 20
+SUGGEST_SYNC_INTERVAL = float(os.getenv("SUGGEST_SYNC_INTERVAL", "10"))
+# More changed books than this are applied by rebuilding the whole index
+REBUILD_THRESHOLD = 1000
+# Changes committed this long before the newest one seen are looked at again
+CHANGE_OVERLAP = timedelta(seconds=5)
+
+# Entries are "<normalized text>\0<text as written>": they sort and match on
+# the normalized part and carry the text to display. \0 sorts first, so an
+# exact match comes before longer ones.
+SEPARATOR = "\0"
+
+logger = logging.getLogger(__name__)
+
+
+def normalize(text: str) -> str:
+    """
+    Lowercase words without accents or punctuation: "Les Misérables!" -> "les miserables".
+    """
+    text = text.lower()
+    if text.isascii():
+        return " ".join(TOKEN_RE.findall(text))
+    decomposed = unicodedata.normalize("NFKD", text)
+    return " ".join(TOKEN_RE.findall("".join(ch for ch in decomposed if not unicodedata.combining(ch))))
+
+
+def entry(text: str) -> str:
+    return normalize(text) + SEPARATOR + text
+
+
+class PrefixIndex:
+    """
+    Sorted title and author entries of the catalog, matched by prefix.
+    Safe to use from several threads.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self) -> None:
+        # titles[i] is the entry of book title_ids[i]; title_authors[i] is the
+        # (shared) entry of its author in authors
+        self.titles: List[str] = []
+        self.title_ids = array("q")
+        self.title_authors: List[str] = []
+        # book id -> its entry in titles, to find it by bisect
+        self.book_titles: Dict[int, str] = {}
+        self.authors: List[str] = []
+        # author entry -> [the shared entry, number of books]
+        self.author_refs: Dict[str, list] = {}
+        self.built = False
+        self.version: Optional[int] = None
+        self.deletions: Optional[int] = None
+        self.since = None
+
+    def __len__(self) -> int:
+        return len(self.titles)
+
+    def build(self, books: Iterable[Tuple[int, str, str]]) -> None:
+        """
+        Replace the contents with (id, title, author) rows.
+        """
+        author_refs: Dict[str, list] = {}
+        # Authors usually have several books; normalize each name once
+        by_name: Dict[str, list] = {}
+        rows = []
+        for book_id, title, author in books:
+            ref = by_name.get(author)
+            if ref is None:
+                author_entry = entry(author)
+                ref = by_name[author] = author_refs.setdefault(author_entry, [author_entry, 0])
+            ref[1] += 1
+            rows.append((entry(title), book_id, ref[0]))
+        rows.sort()
+
+        titles = [title for title, _, _ in rows]
+        title_ids = array("q", (book_id for _, book_id, _ in rows))
+        title_authors = [author for _, _, author in rows]
+        book_titles = {book_id: title for title, book_id, _ in rows}
+        authors = sorted(author_refs)
+        with self.lock:
+            self.titles, self.title_ids, self.title_authors, self.book_titles = titles, title_ids, title_authors, book_titles
+            self.authors, self.author_refs = authors, author_refs
+            self.built = True
+
+    def _position(self, book_id: int) -> Optional[int]:
+        title_entry = self.book_titles.get(book_id)
+        if title_entry is None:
+            return None
+        i = bisect_left(self.titles, title_entry)
+        # Books with the same title sit next to each other
+        while self.title_ids[i] != book_id:
+            i += 1
+        return i
+
+    def _add(self, book_id: int, title: str, author: str) -> None:
+        title_entry = entry(title)
+        author_entry = entry(author)
+        ref = self.author_refs.get(author_entry)
+        if ref is None:
+            ref = self.author_refs[author_entry] = [author_entry, 0]
+            insort(self.authors, author_entry)
+        ref[1] += 1
+        i = bisect_left(self.titles, title_entry)
+        self.titles.insert(i, title_entry)
+        self.title_ids.insert(i, book_id)
+        self.title_authors.insert(i, ref[0])
+        self.book_titles[book_id] = title_entry
+
+    def _remove(self, book_id: int) -> bool:
+        i = self._position(book_id)
+        if i is None:
+            return False
+        author_entry = self.title_authors[i]
+        del self.titles[i], self.title_ids[i], self.title_authors[i], self.book_titles[book_id]
+        ref = self.author_refs[author_entry]
+        ref[1] -= 1
+        if not ref[1]:
+            del self.author_refs[author_entry]
+            del self.authors[bisect_left(self.authors, author_entry)]
+        return True
+
+    def update(self, book_id: int, title: str, author: str) -> None:
+        """
+        Add a book, or re-index it if its title or author changed.
+        """
+        with self.lock:
+            i = self._position(book_id)
+            if i is not None:
+                if self.titles[i] == entry(title) and self.title_authors[i] == entry(author):
+                    return
+                self._remove(book_id)
+            self._add(book_id, title, author)
+
+    def remove(self, book_id: int) -> None:
+        with self.lock:
+            self._remove(book_id)
+
+    def lookup(self, q: str, limit: int = SUGGEST_LIMIT) -> Tuple[List[Tuple[int, str]], List[str]]:
+        """
+        Up to `limit` (book id, title) pairs and `limit` authors starting with q,
+        in alphabetical order of their normalized text.
+        """
+        prefix = normalize(q)
+        if not prefix:
+            return [], []
+        with self.lock:
+            titles = [
+                (self.title_ids[i], self.titles[i].split(SEPARATOR, 1)[1])
+                for i in _matches(self.titles, prefix, limit)
+            ]
+            authors = [self.authors[i].split(SEPARATOR, 1)[1] for i in _matches(self.authors, prefix, limit)]
+        return titles, authors
+
+    def sync(self, db: Session) -> None:
+        """
+        Build the index, or apply the catalog changes made since the last sync.
+        """
+        version, deletions, changed_at = catalog.version_state(db)
+        if self.built and version == self.version:
+            return
+
+        columns = (models.Book.id, models.Book.title, models.Book.author)
+        if self.built and self.since is not None:
+            changed = db.query(*columns, models.Book.updated_at).filter(
+                models.Book.updated_at > self.since - CHANGE_OVERLAP
+            ).order_by(models.Book.updated_at).limit(REBUILD_THRESHOLD + 1).all()
+            if len(changed) <= REBUILD_THRESHOLD:
+                for book_id, title, author, _ in changed:
+                    self.update(book_id, title, author)
+                # Deletes leave no row behind: after one, a count that does
+                # not match shows them (this worker's own are already removed)
+                if deletions == self.deletions or db.query(func.count(models.Book.id)).scalar() == len(self):
+                    if changed:
+                        self.since = max(self.since, catalog.as_utc(changed[-1].updated_at))
+                    self.version, self.deletions = version, deletions
+                    return
+
+        self.build(db.query(*columns).yield_per(10000))
+        newest = db.query(func.max(models.Book.updated_at)).scalar()
+        self.version, self.deletions, self.since = version, deletions, catalog.as_utc(newest) or changed_at
+
+    def ensure(self, db: Session) -> None:
+        """
+        Build the index now if the background sync has not yet.
+        """
+        if not self.built:
+            self.sync(db)
+
+
+def _matches(entries: List[str], prefix: str, limit: int) -> range:
+    """
+    Positions of the first `limit` entries whose normalized text starts with prefix.
+    """
+    start = bisect_left(entries, prefix)
+    end = start
+    stop = min(len(entries), start + limit)
+    while end < stop and entries[end].startswith(prefix):
+        end += 1
+    return range(start, end)
+
+
+index = PrefixIndex()
+
+
+def _sync_once() -> None:
+    db = (database.ReadSessionLocal or database.SessionLocal)()
+    try:
+        index.sync(db)
+    finally:
+        db.close()
+
+
+async def run_sync() -> None:
+    while True:
+        try:
+            await run_in_threadpool(_sync_once)
+        except Exception:
+            logger.exception("could not sync the suggestion index")
+        await asyncio.sleep(SUGGEST_SYNC_INTERVAL)
+
+
+def start() -> asyncio.Task:
+    """
+    Build the index in the background, then keep it in sync.
+    """
+    return asyncio.create_task(run_sync())
+
+
+async def stop(task: asyncio.Task) -> None:
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
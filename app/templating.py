@@ -0,0 +1,72 @@
+from fastapi.templating import Jinja2Templates
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+from markupsafe import Markup
+from app import assets
+from app.cache import TTLCache
+import os
+import tempfile
+
+# One template environment shared by every router, so each template is parsed
+# once per worker. Compiled templates are also kept on disk (bytecode cache),
+# so new workers skip parsing too.
+TEMPLATE_DIR = "templates"
+TEMPLATE_CACHE_DIR = os.getenv("TEMPLATE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "library-jinja-cache"))
+# 0 stops checking template files for changes on every render (production)
+TEMPLATE_AUTO_RELOAD = os.getenv("TEMPLATE_AUTO_RELOAD", "1") == "1"
+
+# Rendered catalog cards kept per worker
+FRAGMENT_CACHE_SIZE = int(os.getenv("FRAGMENT_CACHE_SIZE", "5000"))
+FRAGMENT_CACHE_TTL = float(os.getenv("FRAGMENT_CACHE_TTL", "3600"))
+
+os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+
+env = Environment(
+    loader=FileSystemLoader(TEMPLATE_DIR),
+    autoescape=True,
+    auto_reload=TEMPLATE_AUTO_RELOAD,
+    bytecode_cache=FileSystemBytecodeCache(TEMPLATE_CACHE_DIR),
+)
+templates = Jinja2Templates(env=env)
+
+fragment_cache = TTLCache(maxsize=FRAGMENT_CACHE_SIZE, ttl=FRAGMENT_CACHE_TTL)
+
+
+def book_card(book, staff: bool, also=()) -> Markup:
+    """
+    HTML of one catalog card, listing the (id, title) pairs in `also` as
+    "members also borrowed". Cards are cached per book and viewer role and
+    re-rendered when the book's updated_at or recommendations change; every
+    edit and stock change bumps updated_at, so the cache stays correct across
+    workers.
+    """
+    key = (book.id, staff)
+    version = (book.updated_at, also)
+    cached = fragment_cache.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    html = Markup(env.get_template("partials/book_card.html").render(book=book, staff=staff, also=also))
+    fragment_cache.set(key, (version, html))
+    return html
+
+
+def invalidate_book(book_id: int) -> None:
+    """
+    Drop a book's cached cards (after it is edited or deleted).
+    """
+    for staff in (False, True):
+        fragment_cache.pop((book_id, staff))
+
+
+def precompile() -> int:
+    """
+    Load every template now rather than on its first request. Returns the count.
+    """
+    names = env.list_templates(extensions=["html"])
+    for name in names:
+        env.get_template(name)
+    return len(names)
+
+
+env.globals["static_url"] = assets.static_url
+env.globals["book_card"] = book_card
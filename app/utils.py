@@ -1,6 +1,30 @@
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
 from passlib.context import CryptContext
+from starlette.concurrency import run_in_threadpool
+import asyncio
+import os
+import threading
+import weakref
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt work factor; hashes with any other cost are upgraded on the next login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+# Hashing runs in a separate process pool so a burst of logins cannot starve
+# the request threads. 0 workers hashes in the threadpool instead.
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(os.cpu_count() or 1, 4))))
+# Max hashing jobs running or queued at once per worker process, and how long
+# a request may wait for a slot before it is rejected.
+PASSWORD_HASH_CONCURRENCY = int(os.getenv("PASSWORD_HASH_CONCURRENCY", str(max(PASSWORD_HASH_WORKERS, 1) * 2)))
+PASSWORD_HASH_QUEUE_TIMEOUT = float(os.getenv("PASSWORD_HASH_QUEUE_TIMEOUT", "5"))
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
 
 def verify_password(plain_password, hashed_password):
     """
@@ -13,3 +37,73 @@ def get_password_hash(password):
     Generate a hash for a plain password.
     """
     return pwd_context.hash(password)
+
+def verify_and_update(plain_password, hashed_password) -> Tuple[bool, Optional[str]]:
+    """
+    Verify a password and, if the stored hash uses an outdated scheme or cost,
+    also return a fresh hash to store (None otherwise).
+    """
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
+class HashingBusy(Exception):
+    """
+    Raised when no hashing slot frees up within PASSWORD_HASH_QUEUE_TIMEOUT.
+    """
+
+
+_executor = None
+_executor_lock = threading.Lock()
+# One semaphore per event loop (there is one loop per server process)
+_slots = weakref.WeakKeyDictionary()
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS)
+        return _executor
+
+
+async def _run_hashing(func, *args):
+    loop = asyncio.get_running_loop()
+    slots = _slots.get(loop)
+    if slots is None:
+        slots = _slots[loop] = asyncio.Semaphore(PASSWORD_HASH_CONCURRENCY)
+
+    try:
+        await asyncio.wait_for(slots.acquire(), timeout=PASSWORD_HASH_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HashingBusy()
+    try:
+        if PASSWORD_HASH_WORKERS <= 0:
+            return await run_in_threadpool(func, *args)
+        return await loop.run_in_executor(_get_executor(), func, *args)
+    finally:
+        slots.release()
+
+
+async def get_password_hash_async(password) -> str:
+    """
+    get_password_hash on the hashing pool.
+    """
+    return await _run_hashing(get_password_hash, password)
+
+
+async def verify_and_update_async(plain_password, hashed_password) -> Tuple[bool, Optional[str]]:
+    """
+    verify_and_update on the hashing pool.
+    """
+    return await _run_hashing(verify_and_update, plain_password, hashed_password)
+
+
+def shutdown_hashing() -> None:
+    """
+    Stop the hashing processes (called when the application shuts down).
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
@@ -0,0 +1,90 @@
+"""
+Cold-start benchmark: how long a new worker takes before it can serve traffic.
+
+    python benchmarks/cold_start.py --runs 5
+
+For each mode a fresh uvicorn process is started against a temporary SQLite
+database (already migrated) and the catalog is polled until it answers 200.
+Reported: the time to import app.main alone, and the time from spawning the
+worker to its first successful response. "auto-migrate" runs create_all and
+the migrations on every start, as workers did before startup moved into the
+lifespan; "schema check" only reads the schema version.
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODES = {
+    "auto-migrate (before)": {"DB_AUTO_MIGRATE": "1"},
+    "schema check": {"DB_AUTO_MIGRATE": "0"},
+}
+IMPORT_SNIPPET = "import time; started = time.perf_counter(); import app.main; print(time.perf_counter() - started)"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def import_time(env: dict) -> float:
+    output = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET], env=env, cwd=ROOT, check=True, stdout=subprocess.PIPE, text=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def time_to_first_response(env: dict, timeout: float = 60.0) -> float:
+    port = free_port()
+    started = time.perf_counter()
+    worker = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        env=env, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            if worker.poll() is not None:
+                raise RuntimeError(f"worker exited with {worker.returncode}")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - started
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.01)
+        raise RuntimeError("worker did not answer in time")
+    finally:
+        worker.terminate()
+        worker.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        base_env = {
+            **os.environ,
+            "DATABASE_URL": f"sqlite:///{tmp}/bench.db",
+            "SCHEDULER_ENABLED": "0",
+            "TEMPLATE_CACHE_DIR": os.path.join(tmp, "jinja"),
+        }
+        # Migrate once up front, as a deploy would
+        subprocess.run([sys.executable, "-m", "app.migrations", "upgrade"], env=base_env, cwd=ROOT, check=True, stdout=subprocess.DEVNULL)
+
+        print(f"{'mode':<24}{'import p50':>12}{'first response p50':>20}{'max':>10}")
+        for mode, env in MODES.items():
+            child_env = {**base_env, **env}
+            imports = [import_time(child_env) for _ in range(args.runs)]
+            starts = [time_to_first_response(child_env) for _ in range(args.runs)]
+            print(f"{mode:<24}{1000 * statistics.median(imports):>10.0f}ms{1000 * statistics.median(starts):>18.0f}ms{1000 * max(starts):>8.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,388 @@
+"""
+Load test for the core user journeys: browse, search, buy, borrow, return,
+my_books and the staff dashboard, driven concurrently by virtual users.
+
+    python benchmarks/journeys.py --books 5000 --members 200 --concurrency 32 --duration 30
+    python benchmarks/journeys.py --output results.json --baseline baseline.json
+
+By default the app runs in-process (httpx over ASGI) against a temporary
+SQLite database seeded with a synthetic catalog, members and transaction
+history. With --url the requests go to a running server instead; the data is
+then seeded into DATABASE_URL, which must be the server's database (and the
+server must share SECRET_KEY, since virtual users carry session cookies).
+
+Reports requests, throughput and p50/p95/p99 latency per journey, and writes
+them as JSON with --output. With --baseline the run is compared with an
+earlier result file: a journey whose p95 grew or whose throughput fell by
+more than --tolerance is flagged and the exit status is 1.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Journey -> relative weight in the traffic mix
+DEFAULT_MIX = {
+    "browse": 30,
+    "search": 20,
+    "buy": 8,
+    "borrow": 10,
+    "return": 10,
+    "my_books": 15,
+    "dashboard": 7,
+}
+WORDS = [
+    "silent", "river", "empire", "garden", "shadow", "winter", "atlas", "harbor", "crimson", "forest",
+    "machine", "ocean", "letters", "kingdom", "glass", "memory", "storm", "orchard", "lantern", "summit",
+]
+AUTHORS = ["Asha Rao", "Daniel Kim", "Maria Lopez", "Omar Haddad", "Lena Fischer", "Kenji Sato", "Priya Nair", "Tom Becker"]
+EMAIL_PREFIX = "bench-"
+
+
+# --- Synthetic dataset ---
+
+def seed(books: int, members: int, history: int, open_borrows: int, rng: random.Random) -> None:
+    """
+    Insert the synthetic catalog, members and transaction history, then
+    rebuild the sales rollups and due states as the app would have.
+    """
+    from sqlalchemy import insert
+    from app import models, utils, rollups, due, catalog, migrations
+    from app.database import SessionLocal, get_engine
+
+    migrations.upgrade(get_engine())
+    db = SessionLocal()
+    try:
+        now = datetime.now(timezone.utc)
+        # One bcrypt hash for everybody: seeding should not take minutes
+        password_hash = utils.get_password_hash("password123")
+        db.execute(insert(models.User), [
+            {"email": f"{EMAIL_PREFIX}staff@example.com", "password_hash": password_hash, "is_staff": True},
+            *({"email": f"{EMAIL_PREFIX}member-{i}@example.com", "password_hash": password_hash, "is_staff": False} for i in range(members)),
+        ])
+        db.execute(insert(models.Book), [
+            {
+                "title": f"{rng.choice(WORDS).title()} {rng.choice(WORDS).title()} {i}",
+                "author": rng.choice(AUTHORS),
+                "price": round(rng.uniform(5, 60), 2),
+                "quantity": rng.randint(0, 40),
+                "description": " ".join(rng.choices(WORDS, k=12)),
+                "created_at": now - timedelta(days=rng.randint(0, 900)),
+            }
+            for i in range(books)
+        ])
+        user_ids = [row.id for row in db.query(models.User.id).filter(models.User.email.like(f"{EMAIL_PREFIX}member-%"))]
+        book_ids = [row.id for row in db.query(models.Book.id)]
+
+        rows = []
+        for _ in range(history):
+            created_at = now - timedelta(days=rng.uniform(1, 400))
+            if rng.random() < 0.6:
+                rows.append({"user_id": rng.choice(user_ids), "book_id": rng.choice(book_ids), "transaction_type": "buy",
+                             "amount": round(rng.uniform(5, 60), 2), "created_at": created_at})
+            else:
+                rows.append({"user_id": rng.choice(user_ids), "book_id": rng.choice(book_ids), "transaction_type": "borrow", "amount": 0,
+                             "due_date": created_at + timedelta(days=14), "is_returned": True,
+                             "return_date": created_at + timedelta(days=rng.uniform(1, 14)), "created_at": created_at})
+        for user_id in user_ids:
+            for book_id in rng.sample(book_ids, min(open_borrows, len(book_ids))):
+                created_at = now - timedelta(days=rng.uniform(0, 20))
+                rows.append({"user_id": user_id, "book_id": book_id, "transaction_type": "borrow", "amount": 0,
+                             "due_date": created_at + timedelta(days=14), "is_returned": False, "created_at": created_at})
+        for start in range(0, len(rows), 5000):
+            db.execute(insert(models.Transaction), rows[start:start + 5000])
+
+        rollups.backfill(db)
+        due.scan(db)
+        catalog.bump_version(db)
+        db.commit()
+    finally:
+        db.close()
+
+
+def load_context() -> dict:
+    """
+    Ids the journeys need, read back from the seeded database.
+    """
+    from app import models
+    from app.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        users = db.query(models.User.id, models.User.is_staff).filter(models.User.email.like(f"{EMAIL_PREFIX}%")).all()
+        open_borrows = {}
+        for row in db.query(models.Transaction.id, models.Transaction.user_id).filter(
+            models.Transaction.transaction_type == "borrow", models.Transaction.is_returned == False
+        ):
+            open_borrows.setdefault(row.user_id, []).append(row.id)
+        members = [user.id for user in users if not user.is_staff]
+        return {
+            "staff": next(user.id for user in users if user.is_staff),
+            "members": members,
+            "book_ids": [row.id for row in db.query(models.Book.id)],
+            "open_borrows": {user_id: open_borrows.get(user_id, []) for user_id in members},
+        }
+    finally:
+        db.close()
+
+
+# --- Journeys ---
+# Each takes (client, staff client, virtual user state, rng) and returns the response.
+
+async def browse(client, staff, vu, rng):
+    return await client.get("/", params={"sort": rng.choice(["title", "newest"])})
+
+
+async def search(client, staff, vu, rng):
+    return await client.get("/", params={"q": rng.choice(WORDS)[:rng.randint(3, 6)]})
+
+
+async def buy(client, staff, vu, rng):
+    return await client.post(f"/books/buy/{rng.choice(vu['book_ids'])}")
+
+
+async def borrow(client, staff, vu, rng):
+    return await client.post(f"/books/borrow/{rng.choice(vu['book_ids'])}")
+
+
+async def give_back(client, staff, vu, rng):
+    if not vu["open_borrows"]:
+        return None
+    return await client.post(f"/books/return/{vu['open_borrows'].pop()}")
+
+
+async def my_books(client, staff, vu, rng):
+    return await client.get("/books/my-books")
+
+
+async def dashboard(client, staff, vu, rng):
+    return await staff.get("/dashboard/")
+
+
+JOURNEYS = {
+    "browse": browse,
+    "search": search,
+    "buy": buy,
+    "borrow": borrow,
+    "return": give_back,
+    "my_books": my_books,
+    "dashboard": dashboard,
+}
+
+
+def percentile(values, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+async def drive(make_client, context: dict, mix: dict, concurrency: int, duration: float, warmup: float, seed_value: int) -> dict:
+    """
+    Run `concurrency` virtual users for warmup + duration seconds; only the
+    requests started after the warm-up are measured.
+    """
+    import httpx
+    from app import security
+
+    latencies = {name: [] for name in mix}
+    errors = {name: 0 for name in mix}
+    names, weights = list(mix), list(mix.values())
+    started = time.perf_counter()
+    measure_from = started + warmup
+    stop_at = measure_from + duration
+
+    async def virtual_user(index: int):
+        rng = random.Random(seed_value + index)
+        user_id = context["members"][index % len(context["members"])]
+        # Virtual users playing the same member share its list of open borrows
+        vu = {"book_ids": context["book_ids"], "open_borrows": context["open_borrows"][user_id]}
+        async with make_client(security.create_session_token(user_id)) as client, make_client(security.create_session_token(context["staff"])) as staff:
+            while True:
+                name = rng.choices(names, weights)[0]
+                before = time.perf_counter()
+                if before >= stop_at:
+                    return
+                try:
+                    response = await JOURNEYS[name](client, staff, vu, rng)
+                except httpx.HTTPError:
+                    failed = True
+                else:
+                    if response is None:
+                        # Nothing to do, e.g. no open borrow left to return
+                        continue
+                    failed = response.status_code >= 400
+                after = time.perf_counter()
+                if before < measure_from:
+                    continue
+                latencies[name].append(after - before)
+                errors[name] += failed
+
+    await asyncio.gather(*(virtual_user(index) for index in range(concurrency)))
+    elapsed = time.perf_counter() - measure_from
+
+    routes = {}
+    for name in mix:
+        values = latencies[name]
+        routes[name] = {
+            "requests": len(values),
+            "errors": errors[name],
+            "throughput_rps": len(values) / elapsed,
+            "p50_ms": 1000 * percentile(values, 50),
+            "p95_ms": 1000 * percentile(values, 95),
+            "p99_ms": 1000 * percentile(values, 99),
+        }
+    everything = [value for values in latencies.values() for value in values]
+    routes["all"] = {
+        "requests": len(everything),
+        "errors": sum(errors.values()),
+        "throughput_rps": len(everything) / elapsed,
+        "p50_ms": 1000 * percentile(everything, 50),
+        "p95_ms": 1000 * percentile(everything, 95),
+        "p99_ms": 1000 * percentile(everything, 99),
+    }
+    return routes
+
+
+async def run(args, mix: dict) -> dict:
+    import httpx
+    from app import security
+
+    rng = random.Random(args.seed)
+    if not args.no_seed:
+        seed(args.books, args.members, args.history, args.open_borrows, rng)
+    context = load_context()
+
+    if args.url:
+        def make_client(token):
+            return httpx.AsyncClient(base_url=args.url, cookies={security.SESSION_COOKIE: token}, timeout=60)
+        return await drive(make_client, context, mix, args.concurrency, args.duration, args.warmup, args.seed)
+
+    from app.main import app
+    # Unhandled errors in the app count as 500s instead of stopping the run
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+
+    def make_client(token):
+        return httpx.AsyncClient(transport=transport, base_url="http://bench", cookies={security.SESSION_COOKIE: token}, timeout=60)
+
+    async with app.router.lifespan_context(app):
+        return await drive(make_client, context, mix, args.concurrency, args.duration, args.warmup, args.seed)
+
+
+# --- Reporting ---
+
+def print_report(routes: dict) -> None:
+    print(f"{'journey':<12}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for name, result in routes.items():
+        print(f"{name:<12}{result['requests']:>10}{result['errors']:>8}{result['throughput_rps']:>10.1f}"
+              f"{result['p50_ms']:>8.1f}ms{result['p95_ms']:>8.1f}ms{result['p99_ms']:>8.1f}ms")
+
+
+def compare(routes: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Journeys whose p95 latency rose, or throughput fell, by more than tolerance.
+    """
+    regressions = []
+    for name, result in routes.items():
+        before = baseline["routes"].get(name)
+        if not before or not before["requests"]:
+            continue
+        if result["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {before['p95_ms']:.1f}ms -> {result['p95_ms']:.1f}ms")
+        if result["throughput_rps"] < before["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {before['throughput_rps']:.1f} -> {result['throughput_rps']:.1f} req/s")
+    return regressions
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, check=True, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def parse_mix(value: str) -> dict:
+    # "browse=5,search=3,buy=1"
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name not in JOURNEYS:
+            raise argparse.ArgumentTypeError(f"unknown journey {name!r}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="benchmark a running server instead of the in-process app")
+    parser.add_argument("--books", type=int, default=2000)
+    parser.add_argument("--members", type=int, default=100)
+    parser.add_argument("--history", type=int, default=20000, help="finished transactions to seed")
+    parser.add_argument("--open-borrows", type=int, default=3, help="open borrows seeded per member")
+    parser.add_argument("--no-seed", action="store_true", help="reuse data seeded by an earlier run")
+    parser.add_argument("--concurrency", type=int, default=16, help="virtual users")
+    parser.add_argument("--duration", type=float, default=20, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=2, help="unmeasured seconds before that")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX, help="journey weights, e.g. browse=5,search=3,buy=1")
+    parser.add_argument("--seed", type=int, default=1, help="random seed")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="earlier --output file to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative p95/throughput change")
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    tmp = None
+    if not args.url:
+        # The in-process app gets its own database unless DATABASE_URL is set
+        if "DATABASE_URL" not in os.environ:
+            tmp = tempfile.TemporaryDirectory()
+            os.environ["DATABASE_URL"] = f"sqlite:///{tmp.name}/journeys.db"
+        os.environ.setdefault("SCHEDULER_ENABLED", "0")
+
+    try:
+        routes = asyncio.run(run(args, args.mix))
+    finally:
+        if tmp is not None:
+            tmp.cleanup()
+
+    print_report(routes)
+    result = {
+        "revision": git_revision(),
+        "recorded_at": datetime.now(timezone.utc).isoformat(),
+        "config": {
+            "target": args.url or "in-process",
+            "books": args.books,
+            "members": args.members,
+            "history": args.history,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "mix": args.mix,
+        },
+        "routes": routes,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(routes, json.load(f), args.tolerance)
+        if regressions:
+            print("\nRegressions against the baseline:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("\nNo regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
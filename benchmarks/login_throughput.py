@@ -0,0 +1,102 @@
+"""
+Login throughput benchmark: hashing in the request threadpool vs the process pool.
+
+    python benchmarks/login_throughput.py --logins 200 --concurrency 50
+
+Each mode runs in a fresh process against a temporary SQLite database. While the
+login burst runs, catalog pages are requested too, to show how much the burst
+slows down unrelated requests on the same worker.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODES = {
+    "threadpool (before)": {"PASSWORD_HASH_WORKERS": "0", "PASSWORD_HASH_CONCURRENCY": "1000"},
+    "process pool": {},
+}
+
+
+async def run_burst(logins: int, concurrency: int) -> dict:
+    import httpx
+    from app.main import app
+    from app.database import SessionLocal, get_engine
+    from app import models, utils, migrations
+
+    migrations.upgrade(get_engine())
+    db = SessionLocal()
+    db.add(models.User(email="bench@example.com", password_hash=utils.get_password_hash("password123")))
+    db.commit()
+    db.close()
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        limiter = asyncio.Semaphore(concurrency)
+        catalog_latencies = []
+        rejected = []
+        done = asyncio.Event()
+
+        async def login():
+            async with limiter:
+                response = await client.post("/auth/login", data={"email": "bench@example.com", "password": "password123"})
+                if response.status_code == 503:
+                    rejected.append(response)
+                else:
+                    assert response.status_code == 303, response.status_code
+
+        async def browse():
+            while not done.is_set():
+                started = time.perf_counter()
+                await client.get("/")
+                catalog_latencies.append(time.perf_counter() - started)
+
+        browsers = [asyncio.create_task(browse()) for _ in range(4)]
+        started = time.perf_counter()
+        await asyncio.gather(*(login() for _ in range(logins)))
+        elapsed = time.perf_counter() - started
+        done.set()
+        await asyncio.gather(*browsers)
+
+    utils.shutdown_hashing()
+    catalog_latencies.sort()
+    return {
+        "logins_per_second": (logins - len(rejected)) / elapsed,
+        "rejected": len(rejected),
+        "catalog_p50_ms": 1000 * statistics.median(catalog_latencies),
+        "catalog_p95_ms": 1000 * catalog_latencies[int(0.95 * (len(catalog_latencies) - 1))],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        sys.path.insert(0, ROOT)
+        print(json.dumps(asyncio.run(run_burst(args.logins, args.concurrency))))
+        return
+
+    print(f"{'mode':<22}{'logins/s':>10}{'rejected':>10}{'catalog p50':>14}{'catalog p95':>14}")
+    for mode, env in MODES.items():
+        with tempfile.TemporaryDirectory() as tmp:
+            child_env = {**os.environ, **env, "DATABASE_URL": f"sqlite:///{tmp}/bench.db"}
+            output = subprocess.run(
+                [sys.executable, __file__, "--child", "--logins", str(args.logins), "--concurrency", str(args.concurrency)],
+                env=child_env, cwd=ROOT, check=True, stdout=subprocess.PIPE, text=True,
+            ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{mode:<22}{result['logins_per_second']:>10.1f}{result['rejected']:>10}{result['catalog_p50_ms']:>12.1f}ms{result['catalog_p95_ms']:>12.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Recommendations benchmark: time and memory to compute the "members who
+borrowed this also borrowed" neighbours of a synthetic history, in full and
+incrementally after a batch of new transactions.
+
+    python benchmarks/recommendations.py --books 100000 --members 50000 --history 40
+
+Members borrow --history books on average, drawn from a skewed popularity
+curve (a few bestsellers, a long tail). The incremental refresh recomputes the
+books of --new members who each borrowed one more book, from the history of
+the members who have one of those books, like app.recommendations.refresh().
+Times are for app.recommendations.compute() only; reading the transactions and
+writing the rows are left to the database.
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def synthetic_pairs(books: int, members: int, history: int, rng) -> np.ndarray:
+    counts = rng.poisson(history, members)
+    users = np.repeat(np.arange(1, members + 1), counts)
+    # Zipf-like popularity: book i is picked in proportion to 1 / (i + 10)
+    weights = 1.0 / (np.arange(books) + 10)
+    borrowed = rng.choice(np.arange(1, books + 1), size=len(users), p=weights / weights.sum())
+    return np.unique(np.column_stack([users, borrowed]), axis=0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--books", type=int, default=100_000)
+    parser.add_argument("--members", type=int, default=50_000)
+    parser.add_argument("--history", type=int, default=40)
+    parser.add_argument("--new", type=int, default=200, help="members with a new transaction")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    from app.recommendations import compute
+
+    rng = np.random.default_rng(args.seed)
+    pairs = synthetic_pairs(args.books, args.members, args.history, rng)
+
+    started = time.perf_counter()
+    rows = compute(pairs)
+    full_seconds = time.perf_counter() - started
+
+    tracemalloc.start()
+    compute(pairs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    new_members = rng.choice(np.arange(1, args.members + 1), size=args.new, replace=False)
+    new_pairs = np.column_stack([new_members, rng.integers(1, args.books + 1, size=args.new)])
+    pairs = np.unique(np.vstack([pairs, new_pairs]), axis=0)
+
+    started = time.perf_counter()
+    affected = np.unique(pairs[np.isin(pairs[:, 0], new_members), 1])
+    members_with = np.unique(pairs[np.isin(pairs[:, 1], affected), 0])
+    subset = pairs[np.isin(pairs[:, 0], members_with)]
+    changed = compute(subset, affected.tolist())
+    incremental_seconds = time.perf_counter() - started
+
+    print(f"history:     {len(pairs):,} (member, book) pairs, {args.books:,} books, {args.members:,} members")
+    print(f"full:        {full_seconds:.2f} s, {len(rows):,} rows, peak {peak / 2**20:.0f} MiB")
+    print(f"incremental: {incremental_seconds:.2f} s for {args.new} new transactions "
+          f"({len(affected):,} books, {len(members_with):,} members, {len(changed):,} rows)")
+
+
+if __name__ == "__main__":
+    main()
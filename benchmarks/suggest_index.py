@@ -0,0 +1,105 @@
+"""
+Autocomplete index benchmark: build time, memory footprint and lookup latency
+of app.suggest.PrefixIndex for a large synthetic catalog.
+
+    python benchmarks/suggest_index.py --books 500000
+
+Titles are 2-6 words from a fixed vocabulary (some with accents), and every
+author writes about 20 books. Memory is what tracemalloc sees allocated by the
+index after the build (the peak includes the temporary rows of the build).
+Lookups use prefixes of 1-12 characters cut from random titles and authors.
+"""
+import argparse
+import gc
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+WORDS = (
+    "the a of and night garden river empire shadow house silent winter summer last first "
+    "city sea stone fire glass iron war peace love death secret lost king queen child "
+    "mountain island storm letters journey dream café élan naïve señor crème école über "
+    "history theory science modern ancient guide art little great dark light road home"
+).split()
+FIRST = "Anna Ben Chloé Dmitri Elena Farid Grace Hugo Ines José Kai Lena Marta Nils Olga Pablo Renée Sven Tara Zoë".split()
+LAST = "Adler Brontë Cruz Dumas Eliot Fontaine García Hesse Ibsen Jansson Kafka Lindgren Müller Nørgaard Orwell Pérez".split()
+
+
+def synthetic_books(count: int, seed: int):
+    rng = random.Random(seed)
+    authors = [f"{rng.choice(FIRST)} {rng.choice(LAST)} {i}" for i in range(max(1, count // 20))]
+    for book_id in range(1, count + 1):
+        title = " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 6))).title()
+        yield book_id, title, rng.choice(authors)
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--books", type=int, default=500_000)
+    parser.add_argument("--lookups", type=int, default=20_000)
+    parser.add_argument("--limit", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    from app.suggest import PrefixIndex
+
+    books = list(synthetic_books(args.books, args.seed))
+    gc.collect()
+
+    # Timed and measured in separate builds: tracemalloc slows allocations down
+    index = PrefixIndex()
+    started = time.perf_counter()
+    index.build(books)
+    build_seconds = time.perf_counter() - started
+
+    index = PrefixIndex()
+    gc.collect()
+    tracemalloc.start()
+    index.build(books)
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    rng = random.Random(args.seed + 1)
+    prefixes = []
+    for _ in range(args.lookups):
+        _, title, author = rng.choice(books)
+        text = title if rng.random() < 0.7 else author
+        prefixes.append(text[:rng.randint(1, 12)])
+
+    latencies = []
+    found = 0
+    for prefix in prefixes:
+        started = time.perf_counter()
+        titles, authors = index.lookup(prefix, args.limit)
+        latencies.append(time.perf_counter() - started)
+        found += bool(titles or authors)
+
+    updates = []
+    for book_id, title, author in rng.sample(books, 200):
+        started = time.perf_counter()
+        index.update(book_id, title + " Revised", author)
+        updates.append(time.perf_counter() - started)
+
+    print(f"books:            {args.books:,} ({len(index.authors):,} distinct authors)")
+    print(f"build:            {build_seconds:.2f} s")
+    print(f"memory:           {current / 2**20:.1f} MiB ({current / args.books:.0f} bytes/book), peak {peak / 2**20:.1f} MiB during build")
+    print(f"lookup (top {args.limit}):  p50 {1e6 * statistics.median(latencies):.1f} us, "
+          f"p99 {1e6 * percentile(latencies, 0.99):.1f} us, max {1e6 * max(latencies):.1f} us "
+          f"({found / len(prefixes):.0%} with matches)")
+    print(f"update (re-index): p50 {1e6 * statistics.median(updates):.1f} us, p99 {1e6 * percentile(updates, 0.99):.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,10 @@
-from app.database import SessionLocal, engine, Base
-from app import models, utils
+from app.database import SessionLocal, engine
+from app import models, utils, migrations
 from datetime import datetime
 import random
 
-# Create tables
-Base.metadata.create_all(bind=engine)
+# Create tables and bring them up to date
+migrations.upgrade(engine)
 
 db = SessionLocal()
 
@@ -1,3 +1,102 @@
 // Chart.js implementation can go here if needed for more complex visuals
 // Currently using server-side rendering for simplicity and robustness
-console.log("LMS Script Loaded");
+
+// Partial-page updates: forms marked data-fragment="<selector>" (buy, borrow,
+// return) are posted with fetch() and an HX-Request header. The server answers
+// with the HTML of the changed element only, which replaces the form's closest
+// <selector> element (an empty answer removes it). Without JavaScript the
+// forms post normally and the server redirects to the full page.
+document.addEventListener("submit", async (event) => {
+    const form = event.target;
+    if (!form.dataset.fragment) {
+        return;
+    }
+    event.preventDefault();
+    const target = form.closest(form.dataset.fragment);
+
+    let response;
+    try {
+        response = await fetch(form.action, {
+            method: "POST",
+            body: new FormData(form),
+            headers: { "HX-Request": "true" },
+            credentials: "same-origin",
+        });
+    } catch (error) {
+        form.submit();
+        return;
+    }
+
+    const redirect = response.headers.get("HX-Redirect");
+    if (redirect) {
+        window.location.href = redirect;
+        return;
+    }
+    const contentType = response.headers.get("Content-Type") || "";
+    if (target && contentType.startsWith("text/html")) {
+        const html = await response.text();
+        if (html) {
+            target.outerHTML = html;
+        } else {
+            target.remove();
+        }
+    }
+    const message = response.headers.get("X-Message");
+    if (message) {
+        alert(message);
+    } else if (!response.ok) {
+        alert("Something went wrong, please reload the page.");
+    }
+});
+
+// Live stock: catalog pages listen to /books/stock-stream and swap in the
+// cards of books that were bought, borrowed, returned or edited elsewhere.
+// EventSource reconnects by itself when the server ends the stream.
+if (document.querySelector(".books-grid") && window.EventSource) {
+    const stock = new EventSource("/books/stock-stream");
+    stock.addEventListener("card", (event) => {
+        const update = JSON.parse(event.data);
+        const card = document.querySelector(`.book-card[data-book-id="${update.id}"]`);
+        if (!card) {
+            return;
+        }
+        // Keep a ticked batch checkout box ticked
+        const box = card.querySelector('input[name="book_ids"]');
+        const checked = box && box.checked;
+        card.outerHTML = update.html;
+        const replaced = document.querySelector(`.book-card[data-book-id="${update.id}"] input[name="book_ids"]`);
+        if (replaced && checked) {
+            replaced.checked = true;
+        }
+    });
+}
+
+// Autocomplete: titles and authors from /books/suggest fill the search box's
+// datalist as the user types (debounced; stale answers are dropped).
+const searchBox = document.querySelector('input[name="q"][list="suggestions"]');
+if (searchBox) {
+    const options = document.getElementById("suggestions");
+    let timer = null;
+    let latest = 0;
+    searchBox.addEventListener("input", () => {
+        clearTimeout(timer);
+        timer = setTimeout(async () => {
+            const q = searchBox.value.trim();
+            const request = ++latest;
+            if (!q) {
+                options.replaceChildren();
+                return;
+            }
+            const response = await fetch(`/books/suggest?q=${encodeURIComponent(q)}`);
+            if (!response.ok || request !== latest) {
+                return;
+            }
+            const { titles, authors } = await response.json();
+            options.replaceChildren(...[...titles.map((book) => book.title), ...authors].map((text) => {
+                const option = document.createElement("option");
+                option.value = text;
+                return option;
+            }));
+        }, 150);
+    });
+}
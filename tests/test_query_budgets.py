@@ -0,0 +1,129 @@
+from datetime import datetime, timedelta, timezone
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.main import app
+from app.database import Base, get_db, get_read_db
+from app import models, inventory, security, profiling, page_cache, templating, recommendations
+import logging
+import pytest
+
+# Query budget suite: every route in profiling.QUERY_BUDGETS is requested with
+# SQL profiling in strict mode and cold caches, so a handler that starts
+# running more queries (an N+1 in a template, a lost eager load, an extra
+# lookup) fails here with the statements it ran.
+
+BOOKS = 60
+BORROWS = 12
+
+
+@pytest.fixture(scope="module")
+def budget_db(tmp_path_factory):
+    engine = create_engine(f"sqlite:///{tmp_path_factory.mktemp('budgets')}/budgets.db", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    now = datetime.now(timezone.utc)
+    db = Session()
+    db.add_all([
+        models.User(id=1, email="budget-staff@example.com", password_hash="x", is_staff=True),
+        models.User(id=2, email="budget-member@example.com", password_hash="x"),
+    ])
+    db.add_all([models.Book(id=i, title=f"Budget Book {i}", author="Counter", price=4.0, quantity=20) for i in range(1, BOOKS + 1)])
+    # Open borrows, some overdue, so the dashboard and my_books render rows
+    db.add_all([
+        models.Transaction(id=i, user_id=2, book_id=i, transaction_type="borrow", amount=0, created_at=now - timedelta(days=20),
+                           due_date=now - timedelta(days=20) + timedelta(days=inventory.BORROW_DAYS + i % 10))
+        for i in range(1, BORROWS + 1)
+    ])
+    db.add_all([models.Transaction(user_id=2, book_id=i, transaction_type="buy", amount=4.0, created_at=now - timedelta(days=i)) for i in range(1, 30)])
+    db.commit()
+    from app import due
+    due.scan(db)
+    db.commit()
+    db.close()
+
+    yield Session
+    engine.dispose()
+
+
+@pytest.fixture
+def strict_client(budget_db, monkeypatch):
+    def override():
+        db = budget_db()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    # Profiling is off by default, so it is switched on around the app here
+    monkeypatch.setattr(profiling, "SQL_PROFILING_STRICT", True)
+    profiling.enable()
+    monkeypatch.setitem(app.dependency_overrides, get_db, override)
+    monkeypatch.setitem(app.dependency_overrides, get_read_db, override)
+
+    def request(user_id, method, url, body=None):
+        # Worst case: nothing cached yet
+        security.user_cache.clear()
+        page_cache.catalog_cache.clear()
+        templating.fragment_cache.clear()
+        recommendations.recommendation_cache.clear()
+        client = TestClient(profiling.ProfilingMiddleware(app), cookies={security.SESSION_COOKIE: security.create_session_token(user_id)})
+        response = client.request(method, url, follow_redirects=False, **(body or {}))
+        assert response.status_code < 400, response.text
+        return response
+
+    yield request
+    profiling.disable()
+
+
+# (user id, method, url[, body arguments]) exercising each budgeted route
+REQUESTS = {
+    ("GET", "/"): (2, "GET", "/?q=budget"),
+    ("GET", "/books/"): (1, "GET", "/books/?sort=newest"),
+    ("GET", "/books/my-books"): (2, "GET", "/books/my-books"),
+    ("POST", "/books/buy/{book_id}"): (2, "POST", "/books/buy/40"),
+    ("POST", "/books/borrow/{book_id}"): (2, "POST", "/books/borrow/41"),
+    ("POST", "/books/return/{transaction_id}"): (2, "POST", "/books/return/1"),
+    ("POST", "/books/checkout"): (2, "POST", "/books/checkout", {"data": {"action": "borrow", "book_ids": [50, 51, 52, 53, 54]}}),
+    ("GET", "/dashboard/"): (1, "GET", "/dashboard/"),
+    ("POST", "/dashboard/return/{transaction_id}"): (1, "POST", "/dashboard/return/2"),
+    ("GET", "/api/v1/books"): (2, "GET", "/api/v1/books?limit=50"),
+    ("GET", "/api/v1/books/{book_id}"): (2, "GET", "/api/v1/books/3"),
+    ("POST", "/api/v1/checkout"): (2, "POST", "/api/v1/checkout", {"json": {"action": "buy", "book_ids": [55, 56, 57, 58]}}),
+}
+
+
+def test_every_budget_is_exercised():
+    assert set(REQUESTS) == set(profiling.QUERY_BUDGETS)
+
+
+@pytest.mark.parametrize("route", list(REQUESTS), ids=[f"{method} {path}" for method, path in REQUESTS])
+def test_route_stays_within_query_budget(strict_client, route):
+    response = strict_client(*REQUESTS[route])
+    assert response.headers["server-timing"].startswith("db;dur=")
+
+
+def test_repeated_statements_are_reported_as_n_plus_one(caplog):
+    from starlette.requests import Request
+
+    profile = profiling.RequestProfile()
+    for _ in range(profiling.N_PLUS_ONE_THRESHOLD):
+        profile.record("SELECT books.title\n  FROM books WHERE books.id = ?", 0.001)
+    profile.record("SELECT count(*) FROM users", 0.001)
+    assert profile.repeated() == [("SELECT books.title FROM books WHERE books.id = ?", profiling.N_PLUS_ONE_THRESHOLD)]
+    assert 'desc="6 queries"' in profile.server_timing(0.01)
+
+    request = Request({"type": "http", "method": "GET", "path": "/unbudgeted", "headers": [], "query_string": b""})
+    with caplog.at_level(logging.WARNING, logger="app.profiling"):
+        profiling.check(request, profile, 0.01)
+    assert "Suspected N+1 in GET /unbudgeted: 5 x SELECT books.title" in caplog.text
+
+
+def test_profiling_is_not_installed_by_default():
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    assert not profiling.SQL_PROFILING
+    assert not event.contains(Engine, "before_cursor_execute", profiling._start_timer)
+    assert profiling.ProfilingMiddleware not in [middleware.cls for middleware in app.user_middleware]